@@ -0,0 +1,111 @@
+'''
+Single-pass topic demultiplexing for rosbag files.
+
+Topic discovery is answered from the bag's connection index, so no message has to be
+deserialized just to learn which topics exist. The bag is then streamed exactly once and
+every message is handed to the handler registered for its topic, instead of calling
+bag.read_messages(topicName) again for every topic. The time spent reading, deserializing
+and handling each topic is recorded in metrics.py.
+
+Messages are read raw and deserialized here; handlers that set raw_views get camera frames
+as zero-copy views of the serialized buffer instead (see rawMessages.py).
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import time
+import metrics
+from rawMessages import RAW_VIEWS
+
+
+def listBagTopics(bag):
+    """Return the set of topics recorded in bag, read from its connection index."""
+    return set(bag.get_type_and_topic_info().topics.keys())
+
+
+def getTopicMessageCounts(bag):
+    """Return {topic: message_count} from the bag index without reading any message."""
+    return {topic: info.message_count for topic, info in bag.get_type_and_topic_info().topics.items()}
+
+
+class TopicHandler:
+    """
+    Base class for the per-topic sinks fed by demuxBag().
+
+    handle() is called once per message of the topic, in bag order, and close() once the
+    pass is over (also when the pass is aborted by an exception). sync() makes the output
+    written so far durable, for checkpoints, and returns the output file offset (or None).
+
+    A handler with raw_views = True is handed a rawMessages view, instead of the genpy
+    message, for the message types in rawMessages.RAW_VIEWS.
+    """
+
+    raw_views = False
+
+    def handle(self, topic, msg, t):
+        raise NotImplementedError
+
+    def sync(self):
+        return None
+
+    def close(self):
+        pass
+
+
+def toRosTime(stamp):
+    """rosbag time (ns) -> genpy.Time, for read_messages(start_time=...)"""
+    import genpy
+    return genpy.Time(stamp // 1000000000, stamp % 1000000000)
+
+
+def deserializeRaw(handler, datatype, data, pytype):
+    """The message of a read_messages(raw=True) item, as a view if the handler takes one."""
+    if handler.raw_views:
+        view = RAW_VIEWS.get(datatype)
+        if view is not None:
+            return view(data)
+    msg = pytype()
+    msg.deserialize(data)
+    return msg
+
+
+def demuxBag(bag, handlers, start_time=None, checkpoint=None, end_time=None):
+    """
+    Read bag once and dispatch each message to handlers[topic].
+
+    handlers: dict mapping topic name -> TopicHandler. Only those topics are read, so
+    chunks holding nothing but other topics are never decompressed.
+    start_time, end_time: rosbag times (ns) of the messages to read, e.g. from a resume
+    checkpoint or a --start/--end window; chunks outside them are not decompressed.
+    checkpoint: object whose tick() is called after every message (see checkpoint.py).
+    """
+    if not handlers:
+        return
+
+    if start_time is not None:
+        start_time = toRosTime(start_time)
+    if end_time is not None:
+        end_time = toRosTime(end_time)
+
+    recorder = metrics.current()
+    recorder.expectMessages(bag.get_message_count(topic_filters=list(handlers)))
+    try:
+        # raw messages are deserialized here, as read_messages() would, so both steps are timed
+        read_start = time.perf_counter()
+        for topic, (datatype, data, md5sum, position, pytype), t in bag.read_messages(topics=list(handlers), start_time=start_time,
+                                                                                      end_time=end_time, raw=True):
+            deserialize_start = time.perf_counter()
+            msg = deserializeRaw(handlers[topic], datatype, data, pytype)
+            handle_start = time.perf_counter()
+            handlers[topic].handle(topic, msg, t)
+            handle_end = time.perf_counter()
+            recorder.add('read', deserialize_start - read_start, topic)
+            recorder.add('deserialize', handle_start - deserialize_start, topic)
+            recorder.add('transform', handle_end - handle_start, topic)
+            recorder.count(topic, len(data))
+            if checkpoint is not None:
+                checkpoint.tick()
+            read_start = time.perf_counter()
+    finally:
+        for handler in handlers.values():
+            handler.close()
@@ -0,0 +1,140 @@
+'''
+Discovery of the bag files under project directories, and the ingest manifest that lets a
+re-run skip the bags it already ingested.
+
+discoverBags() walks every directory given, recursively, on a pool of threads (one
+os.scandir() per directory, so directories are listed in parallel, which is what matters on
+network storage), and returns the .bag files found with their size and modification time.
+Hidden directories and the output folder of a bag (<name>/ next to <name>.bag, with its
+images and point clouds) are not entered.
+
+The manifest is a small SQLite file recording, per bag and per kind of run (target), the
+size, mtime, fingerprint and ingest status of the bag. A bag whose size and mtime match its
+'done' entry is skipped with one dictionary lookup; when only those changed (a copy, a touch)
+the fingerprint decides:
+
+    manifest = IngestManifest('.ingest_manifest.sqlite3', target='db')
+    bags = manifest.pending(discoverBags(['/data/drives']))
+    results, failures = runBags(worker, bags, on_result=manifest.record)
+    manifest.close()
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# bytes read from each end of the file by the default (sampled) fingerprint
+FINGERPRINT_SAMPLE_BYTES = 16 * 1024 * 1024
+
+
+def bagFingerprint(path, full=False):
+    """md5 of the file size and its first and last 16 MiB (a bag's index sits at its end), or of the whole file."""
+    md5 = hashlib.md5(str(os.path.getsize(path)).encode())
+    with open(path, 'rb') as f:
+        if full:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(block)
+        else:
+            md5.update(f.read(FINGERPRINT_SAMPLE_BYTES))
+            f.seek(max(0, os.path.getsize(path) - FINGERPRINT_SAMPLE_BYTES))
+            md5.update(f.read(FINGERPRINT_SAMPLE_BYTES))
+    return md5.hexdigest()
+
+
+def scanDirectory(path):
+    """([(bag path, size, mtime_ns)], [subdirectories to scan]) of one directory."""
+    bags = []
+    directories = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.name.endswith('.bag') and entry.is_file():
+                stat = entry.stat()
+                bags.append((entry.path, stat.st_size, stat.st_mtime_ns))
+            elif entry.is_dir(follow_symlinks=False):
+                directories.append(entry)
+    # the output folder of a bag holds no bags, but possibly millions of images
+    names = {os.path.basename(bag[0])[:-len('.bag')] for bag in bags}
+    return bags, [entry.path for entry in directories if entry.name not in names]
+
+
+def discoverBags(paths, workers=16):
+    """{bag path: (size, mtime_ns)} of the bag files given, or found recursively in the directories given."""
+    found = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for path in paths:
+            if os.path.isdir(path):
+                pending.add(executor.submit(scanDirectory, path))
+            else:
+                stat = os.stat(path)
+                found[path] = (stat.st_size, stat.st_mtime_ns)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                bags, directories = future.result()
+                for bag, size, mtime in bags:
+                    found[bag] = (size, mtime)
+                pending.update(executor.submit(scanDirectory, directory) for directory in directories)
+    return found
+
+
+class IngestManifest:
+    """
+    Ingest status of bags for one target (e.g. 'db', or 'csv --no-cameras'), kept in the
+    SQLite file at path. Entries are keyed by absolute path.
+    """
+
+    def __init__(self, path, target, full_fingerprint=False):
+        self.target = target
+        self.full_fingerprint = full_fingerprint
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS bags (path TEXT, target TEXT, size INTEGER, mtime_ns INTEGER, "
+                          "fingerprint TEXT, status TEXT, updated REAL, error TEXT, PRIMARY KEY (path, target))")
+        self.conn.commit()
+        # path -> (size, mtime_ns, fingerprint, status), read once
+        self.entries = {row[0]: row[1:] for row in self.conn.execute(
+            "SELECT path, size, mtime_ns, fingerprint, status FROM bags WHERE target = ?", (target,))}
+
+    def pending(self, bags):
+        """The bags of discoverBags() that are new, changed, or not ingested successfully yet."""
+        pending = []
+        skipped = 0
+        for bagFile, (size, mtime) in bags.items():
+            entry = self.entries.get(os.path.abspath(bagFile))
+            if entry is not None and entry[3] == 'done':
+                if entry[0] == size and entry[1] == mtime:
+                    skipped += 1
+                    continue
+                if entry[0] == size and entry[2] == bagFingerprint(bagFile, self.full_fingerprint):
+                    # same content, new mtime (copied or touched): remember the new one
+                    self._write(bagFile, size, mtime, entry[2], 'done')
+                    skipped += 1
+                    continue
+            pending.append(bagFile)
+        print(f"{len(bags)} bag files found, {skipped} already ingested, {len(pending)} to ingest.")
+        return pending
+
+    def record(self, bagFile, result=None, error=None):
+        """Record the outcome of a bag (a runBags() on_result callback)."""
+        stat = os.stat(bagFile)
+        if error is None:
+            self._write(bagFile, stat.st_size, stat.st_mtime_ns, bagFingerprint(bagFile, self.full_fingerprint), 'done')
+        else:
+            self._write(bagFile, stat.st_size, stat.st_mtime_ns, None, 'failed', repr(error))
+
+    def _write(self, bagFile, size, mtime, fingerprint, status, error=None):
+        path = os.path.abspath(bagFile)
+        self.conn.execute("INSERT OR REPLACE INTO bags (path, target, size, mtime_ns, fingerprint, status, updated, error) "
+                          "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (path, self.target, size, mtime, fingerprint, status, time.time(), error))
+        self.conn.commit()
+        self.entries[path] = (size, mtime, fingerprint, status)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,73 @@
+'''
+Process-pool scheduler for processing many bag files.
+
+Bag processing is mostly Python deserialization, codec and formatting work, so threads are
+serialized by the GIL; here every bag runs in its own worker process instead. Bags are
+submitted largest-first (by file size, or by message count from the bag index), so the
+longest bag starts early instead of becoming the tail straggler, and every bag's result
+or exception is collected instead of being dropped by executor.map().
+
+    results, failures = runBags(functools.partial(process_bag_file, flag_camera_parsing=1), listOfBagFiles)
+
+The worker must be a module-level function (or a functools.partial of one) so it can be
+sent to the worker processes, and the calling script must guard its main code with
+if __name__ == '__main__'.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def bagMessageCount(bagFile):
+    """Number of messages in bagFile, read from its index."""
+    import rosbag
+    with rosbag.Bag(bagFile) as bag:
+        return bag.get_message_count()
+
+
+def orderBagsLargestFirst(bagFiles, by='size'):
+    """Sort bagFiles by file size (by='size') or indexed message count (by='messages'), largest first."""
+    key = bagMessageCount if by == 'messages' else os.path.getsize
+    return sorted(bagFiles, key=key, reverse=True)
+
+
+def runBags(worker, bagFiles, workers=None, order_by='size', initializer=None, initargs=(), on_result=None):
+    """
+    Run worker(bagFile) for every bag in a pool of `workers` processes (default: one per CPU).
+
+    Returns (results, failures): {bagFile: return value} for the bags that finished and
+    {bagFile: exception} for the ones that raised. on_result(bagFile, result, error), if
+    given, is called in this process as each bag finishes (error is None on success).
+    """
+    results = {}
+    failures = {}
+    if not bagFiles:
+        return results, failures
+
+    ordered = orderBagsLargestFirst(bagFiles, by=order_by)
+    workers = min(workers or os.cpu_count() or 1, len(ordered))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        futures = {executor.submit(worker, bagFile): bagFile for bagFile in ordered}
+        for future in as_completed(futures):
+            bagFile = futures[future]
+            try:
+                results[bagFile] = future.result()
+            except Exception as e:
+                failures[bagFile] = e
+                print(f"Failed on {bagFile}: {e!r}")
+            if on_result is not None:
+                on_result(bagFile, results.get(bagFile), failures.get(bagFile))
+
+    return results, failures
+
+
+def printRunSummary(results, failures, total_seconds):
+    """Print the per-bag outcome of runBags()."""
+    for bagFile, result in results.items():
+        print(f"  done    {bagFile}: {result}")
+    for bagFile, e in failures.items():
+        print(f"  FAILED  {bagFile}: {e!r}")
+    print(f"{len(results)} bag files done, {len(failures)} failed, in {total_seconds:.1f} seconds.")
@@ -16,35 +16,102 @@ Additional Notes: As of June 2024, velodyne.decoder library does not accept "rpm
 
 
 
-import rosbag, sys, csv
+import rosbag, sys
 import time
 import os
 import shutil
-import velodyne_decoder as vd
-import numpy as np
-import hashlib
 from parseCamera import parseCamera
-from concurrent.futures import ThreadPoolExecutor
+from bagDemux import listBagTopics, demuxBag
+from textHandlers import LaserScanTextHandler, PointCloudTextHandler, VelodyneScanTextHandler, GenericCsvHandler
+from parquetHandlers import LaserScanParquetHandler, GenericParquetHandler
+from checkpoint import ResumableHandler, SidecarCheckpointStore, PeriodicCheckpoint, resumeStartTime
+from bagScheduler import runBags, printRunSummary
+from bagDiscovery import discoverBags, IngestManifest
+from cloudReduction import reductionsFromSpec
+import metrics
+from topicSelection import TopicSelection, addSelectionArguments, selectionFromArgs, selectionKey
+from functools import partial
+import argparse
+
+# Number of bag files processed in parallel, one worker process each (default: one per CPU)
+BAG_WORKERS = int(os.getenv('BAG_WORKERS', str(os.cpu_count() or 1)))
+
+# Encoding of the LaserScan ranges/intensities: 'float32' or 'delta' hex blobs (see scanArrays.py), or 'text'
+SCAN_ARRAY_ENCODING = os.getenv('SCAN_ARRAY_ENCODING', 'float32')
+
+# Output of the non-camera topics: 'csv' (text files) or 'parquet' (typed, compressed columnar files)
+OUTPUT_FORMAT = os.getenv('OUTPUT_FORMAT', 'csv')
+PARQUET_ROW_GROUP_ROWS = int(os.getenv('PARQUET_ROW_GROUP_ROWS', '65536'))
+PARQUET_COMPRESSION = os.getenv('PARQUET_COMPRESSION', 'zstd')
+
+# Camera frames: 'files' (one image file per frame under <bag folder>/images) or 'pack'
+# (one append-only pack file per camera per bag, see imagePack.py)
+CAMERA_STORAGE = os.getenv('CAMERA_STORAGE', 'files')
+
+# Processes decoding velodyne scans in each bag worker (see velodyneScans.py)
+VELODYNE_WORKERS = int(os.getenv('VELODYNE_WORKERS', str(max(1, (os.cpu_count() or 1) // BAG_WORKERS))))
+
+# Optional range crop, ring filter and voxel downsampling of the lidar clouds before they are
+# stored, per topic (see cloudReduction.py), e.g. '/velodyne_packets:voxel=0.1,max_range=80'
+CLOUD_REDUCTIONS = reductionsFromSpec(os.getenv('CLOUD_REDUCTION', ''))
+
+# Seconds between two checkpoints of the output files (see checkpoint.py)
+CHECKPOINT_SECONDS = float(os.getenv('CHECKPOINT_SECONDS', '5'))
+
+# Bag discovery and ingest manifest (see bagDiscovery.py): threads listing directories in
+# parallel, and the SQLite file recording which bags were ingested (empty: no manifest)
+DISCOVERY_WORKERS = int(os.getenv('DISCOVERY_WORKERS', '16'))
+INGEST_MANIFEST = os.getenv('INGEST_MANIFEST', '.ingest_manifest.sqlite3')
+
+# Per-stage timings and counters (see metrics.py): a progress line every PROGRESS_SECONDS
+# (0: none), and JSON / Prometheus textfile exports at the end of the run (empty: none)
+PROGRESS_SECONDS = float(os.getenv('PROGRESS_SECONDS', '10'))
+METRICS_JSON = os.getenv('METRICS_JSON', 'ingest_metrics.json')
+METRICS_PROMETHEUS = os.getenv('METRICS_PROMETHEUS', 'ingest_metrics.prom')
 
 # Utility function to process a single bag file
-def process_bag_file(bagFile, flag_camera_parsing):
-    start = time.time()
+def process_bag_file(bagFile, flag_camera_parsing, selection=None):
+    metrics.startBag(bagFile, PROGRESS_SECONDS)
     print(f"Reading file {bagFile}...")
 
     # Access bag
     bag = rosbag.Bag(bagFile)
-    bagContents = bag.read_messages()
     bagName = bag.filename
 
     # Create a new directory
     folder = bagName.rstrip(".bag")
     os.makedirs(folder, exist_ok=True)
 
-    # Get list of topics from the bag
-    listOfTopics = set(topic for topic, _, _ in bagContents)
+    # Get list of selected topics from the bag index, without reading any message
+    selection = selection or TopicSelection()
+    listOfTopics = selection.selectTopics(listBagTopics(bag))
+    window_start, window_end = selection.window(bag)
+
+    # Outputs of a time window are named after it (e.g. _slash_gps@<start>-<end>.csv), so windowed
+    # and full runs of the bag neither skip nor overwrite each other's files, shards and packs
+    window = selection.key(bag)
+
+    # Resume from the last checkpoint of an interrupted run, saved in <folder>/.checkpoint.json
+    checkpoint_store = SidecarCheckpointStore(folder, window)
+    checkpoints = checkpoint_store.load()
+    handlers = {}
+
+    def saveCheckpoints():
+        checkpoint_store.save({topic: handler.position() for topic, handler in handlers.items()})
+    periodic = PeriodicCheckpoint(saveCheckpoints, CHECKPOINT_SECONDS)
+
+    def resumable(topic, handler):
+        handlers[topic] = ResumableHandler(handler, checkpoints.get(topic))
+        return handlers[topic]
+
+    # Topics finished by an earlier run are not read again
+    done = {topic for topic, checkpoint in checkpoints.items() if checkpoint.complete}
+    if done:
+        print(f'For "{bagFile}", these {len(done)} topics are already stored: {done}')
+    listOfTopics -= done
 
     # Initialize camera parser
-    PC = parseCamera(folder, bag)
+    PC = parseCamera(folder, bag, storage=CAMERA_STORAGE)
     camera_topics = {
         '/rear_left_camera/image_rect_color/compressed',
         '/rear_center_camera/image_rect_color/compressed',
@@ -54,96 +121,121 @@ def process_bag_file(bagFile, flag_camera_parsing):
         '/front_right_camera/image_color/compressed'
     }
 
+    # Every topic gets a handler, then the bag is read once for all of them
+
     # Parse camera topics if flag is set
+    # All cameras share one worker pool for decode/hash/write
     if flag_camera_parsing:
-        for topic in camera_topics:
-            if topic in listOfTopics:
-                time_start = time.time()
-                OutputFileName = folder + '/' + topic.replace('/', '_slash_') + '.txt'
-                PC.parseCamera(topic, OutputFileName)
-                listOfTopics.remove(topic)
-                print(f"{topic} has been parsed in {time.time() - time_start} seconds.")
+        offsets = {topic: checkpoint.offset for topic, checkpoint in checkpoints.items()}
+        counts = {topic: checkpoint.count for topic, checkpoint in checkpoints.items()}
+        for topic, handler in PC.cameraHandlers({topic: folder + '/' + topic.replace('/', '_slash_') + window + '.txt'
+                                                 for topic in camera_topics & listOfTopics}, offsets=offsets, counts=counts,
+                                                pack_suffix=window).items():
+            resumable(topic, handler)
 
-    else:
-        listOfTopics -= camera_topics
+    listOfTopics -= camera_topics
 
     print(f'For "{bagFile}", these {len(listOfTopics)} topics will be parsed: {listOfTopics}')
 
     # Process each topic
+    parquet = OUTPUT_FORMAT == 'parquet'
+    # Point clouds go to binary shards in either format: a header line per cloud, not a Parquet row
+    shard_topics = {'/velodyne_packets', '/velodyne_points'}
     for topicName in listOfTopics:
-        if topicName == '/sick_lms500/scan' or topicName == '/velodyne_points' or topicName == '/velodyne_packets':
-            filename = folder + '/' + topicName.replace('/', '_slash_') + '.txt'
+        if topicName in shard_topics or (not parquet and topicName == '/sick_lms500/scan'):
+            filename = folder + '/' + topicName.replace('/', '_slash_') + window + '.txt'
+        elif parquet:
+            filename = folder + '/' + topicName.replace('/', '_slash_') + window + '.parquet'
         else:
-            filename = folder + '/' + topicName.replace('/', '_slash_') + '.csv'
+            filename = folder + '/' + topicName.replace('/', '_slash_') + window + '.csv'
+
+        # A Parquet file cannot be appended to: an unfinished one is written again
+        if filename.endswith('.parquet'):
+            checkpoints.pop(topicName, None)
 
-        if os.path.exists(filename):
+        # Files of a checkpointed topic are resumed; other existing files came from an older run
+        checkpoint = checkpoints.get(topicName)
+        offset = checkpoint.offset if checkpoint else None
+        if checkpoint is None and os.path.exists(filename):
             print(f'This file has already existed: {filename}')
             continue
 
-        if topicName == '/sick_lms_5xx/scan':
-            with open(filename, "w") as File:
-                for topic, msg, t in bag.read_messages(topicName):
-                    File.write(f"{msg.header.seq},{msg.header.stamp.secs},{msg.header.stamp.nsecs},{msg.angle_min},{msg.angle_max},{msg.angle_increment},{msg.time_increment},{msg.scan_time},{msg.range_min},{msg.range_max},{','.join(map(str, msg.ranges))},{','.join(map(str, msg.intensities))}\n")
+        if parquet and topicName not in shard_topics:
+            if topicName == '/sick_lms_5xx/scan':
+                resumable(topicName, LaserScanParquetHandler(filename, compression=PARQUET_COMPRESSION))
+            else:
+                resumable(topicName, GenericParquetHandler(filename, PARQUET_ROW_GROUP_ROWS, PARQUET_COMPRESSION))
+
+        elif topicName == '/sick_lms_5xx/scan':
+            resumable(topicName, LaserScanTextHandler(filename, offset=offset, encoding=SCAN_ARRAY_ENCODING))
 
         elif topicName == '/velodyne_points':
-            with open(filename, "w") as File, open(folder + '/velodyne_info.txt', 'w') as InfoFile:
-                for topic, msg, t in bag.read_messages(topicName):
-                    InfoFile.write(', '.join(map(str, msg.fields)) + '\n')
-                    File.write(f"{msg.header.seq},{msg.header.stamp.secs},{msg.header.stamp.nsecs},{msg.height},{msg.width},{msg.is_bigendian},{msg.point_step},{msg.row_step},{msg.is_dense}\n")
+            # Points are decoded into structured arrays (see pointClouds.py) and appended to binary
+            # shards indexed in velodyne_points/clouds.idx
+            resumable(topicName, PointCloudTextHandler(filename, folder + '/velodyne_info' + window + '.txt', folder + '/velodyne_points', offset=offset,
+                                                       resume_count=checkpoint.count if checkpoint else None, reduction=CLOUD_REDUCTIONS.get(topicName),
+                                                       shard_name='clouds' + window))
 
         elif topicName == '/velodyne_packets':
-            velodyne_folder = folder + '/velodyne_pointcloud'
-            os.makedirs(velodyne_folder, exist_ok=True)
-            config = vd.Config(model=vd.modelId.VLP_16)
-            with open(filename, "w") as File:
-                count = 0
-                for stamp, points, topic in vd.read_bag(bagName, config, topicName):
-                    md5_scan = hashlib.md5(points).hexdigest()
-                    sub_folder = velodyne_folder + f'/{md5_scan[:2]}/{md5_scan[2:4]}/'
-                    os.makedirs(sub_folder, exist_ok=True)
-                    points_file = sub_folder + str(md5_scan) + '.txt'
-                    File.write(f"{count},{stamp.secs},{stamp.nsecs},{md5_scan}\n")
-                    np.savetxt(points_file, points, delimiter=',')
-                    count += 1
+            # Scans are decoded on a process pool within the single pass over the bag (see
+            # velodyneScans.py) and appended to binary shards indexed in velodyne_pointcloud/scans.idx
+            resumable(topicName, VelodyneScanTextHandler(filename, folder + '/velodyne_pointcloud', offset=offset,
+                                                         resume_count=checkpoint.count if checkpoint else None, workers=VELODYNE_WORKERS,
+                                                         reduction=CLOUD_REDUCTIONS.get(topicName), shard_name='scans' + window))
 
         else:
-            with open(filename, 'w+') as csvfile:
-                filewriter = csv.writer(csvfile, delimiter=',')
-                firstIteration = True
-                for subtopic, msg, t in bag.read_messages(topicName):
-                    msgString = str(msg)
-                    msgList = msgString.split('\n')
-                    instantaneousListOfData = [pair.split(':') for pair in msgList]
-                    if firstIteration:
-                        headers = ["rosbagTimestamp"] + [pair[0].strip() for pair in instantaneousListOfData]
-                        filewriter.writerow(headers)
-                        firstIteration = False
-                    values = [str(t)] + [pair[1].strip() for pair in instantaneousListOfData if len(pair) > 1]
-                    filewriter.writerow(values)
+            resumable(topicName, GenericCsvHandler(filename, offset=offset))
+
+    # Single streaming pass over the bag for cameras and all remaining topics, from the
+    # earliest checkpoint of a resumed run
+    pending = {topic: handler for topic, handler in handlers.items() if not handler.closed}
+    demuxBag(bag, pending, start_time=resumeStartTime(pending, window_start), checkpoint=periodic, end_time=window_end)
+    PC.close()
+    for handler in pending.values():
+        handler.complete = True
+    saveCheckpoints()
 
     bag.close()
-    print(f"Finished {bagFile} in {time.time() - start} seconds.\n")
-
-# Verify correct input arguments: 1 or 2
-if len(sys.argv) > 2:
-    print("Invalid number of arguments: " + str(len(sys.argv)))
-    print("Should be 2: 'bag2csv.py' and 'bagName'")
-    print("Or just 1: 'bag2csv.py'")
-    sys.exit(1)
-elif len(sys.argv) == 2:
-    listOfBagFiles = [sys.argv[1]]
-else:
-    listOfBagFiles = [f for f in os.listdir(".") if f.endswith(".bag")]
-    print(f"Reading all {len(listOfBagFiles)} bagfiles in current directory: {listOfBagFiles}\n")
-
-# Set flag for camera parsing
-flag_camera_parsing = 1
-
-# Process all bag files with multi-threading
-total_start = time.time()
-with ThreadPoolExecutor() as executor:
-    executor.map(lambda bagFile: process_bag_file(bagFile, flag_camera_parsing), listOfBagFiles)
-total_finish = time.time()
-
-print(f"Done reading all {len(listOfBagFiles)} bag files.")
-print(f"Total time: {total_finish - total_start} seconds.")
+    report = metrics.finishBag()
+    print(f"Finished {bagFile}: {report}\n")
+    return report
+
+if __name__ == '__main__':
+    # Bag files, or every bag file under project directories; optionally only some topics / a time window
+    parser = argparse.ArgumentParser(description="Save the topics of bag files as csv/txt (or parquet) files.")
+    parser.add_argument('paths', nargs='*', default=['.'],
+                        help="bag files, or project directories to search recursively (default: the current directory)")
+    parser.add_argument('--no-cameras', action='store_true', help="do not parse the camera topics")
+    parser.add_argument('--force', action='store_true', help="also process the bags the ingest manifest lists as done")
+    addSelectionArguments(parser)
+    args = parser.parse_args()
+
+    # Find the bags, and leave out the ones already saved in this format by an earlier run
+    foundBagFiles = discoverBags(args.paths, DISCOVERY_WORKERS)
+    manifest = None
+    if INGEST_MANIFEST:
+        target = ' '.join(part for part in [OUTPUT_FORMAT, '--no-cameras' if args.no_cameras else '', selectionKey(args)] if part)
+        manifest = IngestManifest(INGEST_MANIFEST, target)
+    if manifest and not args.force:
+        listOfBagFiles = manifest.pending(foundBagFiles)
+    else:
+        listOfBagFiles = list(foundBagFiles)
+        print(f"Reading all {len(listOfBagFiles)} bag files found.\n")
+
+    # Set flag for camera parsing
+    flag_camera_parsing = 0 if args.no_cameras else 1
+
+    # Process all bag files in parallel worker processes, largest first
+    total_start = time.time()
+    results, failures = runBags(partial(process_bag_file, flag_camera_parsing=flag_camera_parsing, selection=selectionFromArgs(args)),
+                                listOfBagFiles, workers=BAG_WORKERS, on_result=manifest.record if manifest else None)
+    if manifest:
+        manifest.close()
+    total_finish = time.time()
+
+    printRunSummary(results, failures, total_finish - total_start)
+    metrics.writeRunMetrics(results, failures, total_finish - total_start, METRICS_JSON, METRICS_PROMETHEUS)
+    print(f"Done reading all {len(listOfBagFiles)} bag files.")
+    print(f"Total time: {total_finish - total_start} seconds.")
+    if failures:
+        sys.exit(1)
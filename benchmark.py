@@ -0,0 +1,193 @@
+'''
+Throughput benchmark of the ingestion scripts on a synthetic (or given) bag file.
+
+Every case runs in a fresh process, so its peak RSS is its own: each output mode once with
+all of its topics, and once per topic (one topic handler at a time). For every case the
+messages/sec, MB/sec (serialized message bytes) and peak RSS are reported:
+
+    csv      bag_to_csv_2024_py3.py, OUTPUT_FORMAT=csv, no cameras
+    parquet  bag_to_csv_2024_py3.py, OUTPUT_FORMAT=parquet, no cameras
+    db       feeding_bag_files_to_db.py into a local SQLite file standing in for the database
+    camera   bag_to_csv_2024_py3.py, camera topics only
+
+    python3 benchmark.py --seconds 30 --save-baseline          # record benchmark_baseline.json
+    python3 benchmark.py --seconds 30                          # compare against it
+
+A case that got slower (msgs/sec) or bigger (peak RSS) than the baseline by more than
+--tolerance is listed as a regression and the exit status is 1. Baselines are only
+comparable on the same machine and with the same bag arguments.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from syntheticBag import CAMERA_TOPICS, SyntheticBagWriter
+
+MODES = {
+    # script module, flag_camera_parsing, environment
+    'csv': ('bag_to_csv_2024_py3', 0, {'OUTPUT_FORMAT': 'csv'}),
+    'parquet': ('bag_to_csv_2024_py3', 0, {'OUTPUT_FORMAT': 'parquet'}),
+    'db': ('feeding_bag_files_to_db', 0, {'SQL_DB_BACKEND': 'sqlite'}),
+    'camera': ('bag_to_csv_2024_py3', 1, {}),
+}
+
+
+def bagTopicSizes(bagFile):
+    """{topic: (message count, serialized bytes)} of bagFile."""
+    import rosbag
+    sizes = {}
+    with rosbag.Bag(bagFile) as bag:
+        for topic, raw, t in bag.read_messages(raw=True):
+            count, size = sizes.get(topic, (0, 0))
+            sizes[topic] = (count + 1, size + len(raw[1]))
+    return sizes
+
+
+def runCase(mode, bagFile, topics, workdir):
+    """Run one mode on `topics` of bagFile in this (fresh) process; returns seconds and RSS in MB."""
+    script, flag_camera_parsing, environment = MODES[mode]
+    # the run writes next to its own copy of the bag: <workdir>/run/...
+    runBag = os.path.join(workdir, 'run.bag')
+    os.symlink(os.path.abspath(bagFile), runBag)
+    os.environ.update(environment)
+    os.environ['SQLITE_DB_PATH'] = os.path.join(workdir, 'run.sqlite3')
+    os.environ['BAG_WORKERS'] = '1'
+
+    module = __import__(script)
+    from topicSelection import TopicSelection
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(os.path.join(workdir, 'output.txt'), 'w') as output, contextlib.redirect_stdout(output):
+        start = time.perf_counter()
+        module.process_bag_file(runBag, flag_camera_parsing, TopicSelection(include=topics))
+        seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'seconds': seconds, 'start_rss_mb': start_rss / 1024, 'peak_rss_mb': peak_rss / 1024}
+
+
+def benchmarkCases(modes, topic_sizes, per_topic=True):
+    """[(case name, mode, topics)]: every mode with all of its topics, then one topic at a time."""
+    cases = []
+    for mode in modes:
+        if mode == 'camera':
+            topics = sorted(set(CAMERA_TOPICS) & set(topic_sizes))
+        else:
+            topics = sorted(set(topic_sizes) - set(CAMERA_TOPICS))
+        cases.append((f"{mode} all", mode, topics))
+        if per_topic and len(topics) > 1:
+            cases.extend((f"{mode} {topic}", mode, [topic]) for topic in topics)
+    return cases
+
+
+def runBenchmark(bagFile, modes, per_topic=True, repeat=1, workdir=None):
+    topic_sizes = bagTopicSizes(bagFile)
+    results = {}
+    workdir = workdir or tempfile.mkdtemp(prefix='benchmark_')
+    spawn = multiprocessing.get_context('spawn')
+    for name, mode, topics in benchmarkCases(modes, topic_sizes, per_topic):
+        messages = sum(topic_sizes[topic][0] for topic in topics)
+        size = sum(topic_sizes[topic][1] for topic in topics)
+        runs = []
+        for i in range(repeat):
+            casedir = tempfile.mkdtemp(dir=workdir)
+            try:
+                # spawn: a fork would start from this process's memory
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                    runs.append(executor.submit(runCase, mode, bagFile, topics, casedir).result())
+            finally:
+                shutil.rmtree(casedir, ignore_errors=True)
+        seconds = min(run['seconds'] for run in runs)
+        results[name] = {
+            'messages': messages,
+            'mb': size / 1e6,
+            'seconds': seconds,
+            'msgs_per_sec': messages / seconds,
+            'mb_per_sec': size / 1e6 / seconds,
+            'peak_rss_mb': min(run['peak_rss_mb'] for run in runs),
+            'start_rss_mb': min(run['start_rss_mb'] for run in runs),
+        }
+        print(formatResult(name, results[name]), flush=True)
+    return results
+
+
+def formatResult(name, result):
+    return (f"{name:<60} {result['messages']:>8} msgs {result['mb']:>9.1f} MB {result['seconds']:>8.2f} s "
+            f"{result['msgs_per_sec']:>10.0f} msgs/s {result['mb_per_sec']:>8.1f} MB/s {result['peak_rss_mb']:>8.0f} MB RSS")
+
+
+def compareToBaseline(results, baseline, tolerance):
+    """Print each case against the baseline; returns the names of the cases that regressed."""
+    regressions = []
+    print(f"\nCompared to the baseline of {baseline['date']} ({baseline['machine']}):")
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:<60} no baseline")
+            continue
+        speed = result['msgs_per_sec'] / before['msgs_per_sec']
+        memory = result['peak_rss_mb'] / before['peak_rss_mb']
+        regressed = speed < 1 - tolerance or memory > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<60} speed x{speed:.2f}  peak RSS x{memory:.2f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def machineDescription():
+    return f"{platform.node()}, {platform.processor() or platform.machine()}, {os.cpu_count()} CPUs, Python {platform.python_version()}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion scripts on a synthetic bag file.")
+    parser.add_argument('--bag', help="bag file to benchmark on (default: generate a synthetic one)")
+    parser.add_argument('--seconds', type=float, default=10.0, help="duration of the synthetic bag")
+    parser.add_argument('--image-size', default='640x480', help="camera frame size of the synthetic bag, WIDTHxHEIGHT")
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--no-per-topic', action='store_true', help="only run each mode with all of its topics")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per case; the fastest one is kept")
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help="baseline file to compare against or save")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="allowed slowdown/growth before a case is a regression")
+    parser.add_argument('--workdir', help="folder for the synthetic bag and the outputs (default: a temporary folder)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='benchmark_')
+    os.makedirs(workdir, exist_ok=True)
+    bagFile = args.bag
+    if bagFile is None:
+        bagFile = os.path.join(workdir, 'synthetic.bag')
+        width, height = map(int, args.image_size.split('x'))
+        start = time.time()
+        SyntheticBagWriter(args.seconds, image_size=(width, height)).write(bagFile)
+        print(f"Generated {bagFile} ({os.path.getsize(bagFile) / 1e6:.1f} MB) in {time.time() - start:.1f} seconds\n")
+
+    results = runBenchmark(bagFile, args.modes, per_topic=not args.no_per_topic, repeat=args.repeat, workdir=workdir)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'date': time.strftime('%Y-%m-%d %H:%M'), 'machine': machineDescription(),
+                       'bag': {'path': bagFile, 'seconds': args.seconds, 'image_size': args.image_size},
+                       'results': results}, f, indent=2)
+        print(f"\nSaved the baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compareToBaseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} cases regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
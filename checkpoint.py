@@ -0,0 +1,200 @@
+'''
+Resumable, checkpointed ingestion at message granularity.
+
+Every topic handler is wrapped in a ResumableHandler, which tracks how far the topic got:
+the rosbag time of the last message handed on, how many messages share that time, the
+message count, and, for file outputs, the byte offset of the output file. That position is
+saved at every committed batch:
+
+    DbCheckpointStore        table ingest_checkpoints, written in the same transaction as
+                             the rows it describes
+    SidecarCheckpointStore   <bag folder>/.checkpoint.json, for text/CSV/camera outputs
+
+On a restart the bag is read from the earliest saved time with
+read_messages(start_time=...), messages already committed are skipped, and file outputs
+are truncated back to their saved offset, so a crash costs seconds instead of the bag.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import json
+import os
+import time
+from bagDemux import TopicHandler
+
+CHECKPOINT_FILE_NAME = '.checkpoint.json'
+
+
+class TopicCheckpoint:
+    """Committed position of one topic of one bag."""
+
+    __slots__ = ('stamp', 'at_stamp', 'count', 'offset', 'complete')
+
+    def __init__(self, stamp=None, at_stamp=0, count=0, offset=None, complete=False):
+        self.stamp = stamp          # rosbag time (ns) of the last committed message
+        self.at_stamp = at_stamp    # committed messages with exactly that time
+        self.count = count          # committed messages of the topic
+        self.offset = offset        # byte offset of the output file, for file outputs
+        self.complete = complete
+
+    def toDict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def fromDict(cls, values):
+        return cls(**values)
+
+
+def openOutput(filename, offset=None, mode='w'):
+    """
+    Open a text output file: fresh when offset is None, otherwise resumed, with everything
+    written after the checkpoint offset cut off.
+    """
+    if offset is None or not os.path.exists(filename):
+        return open(filename, mode)
+    output = open(filename, 'r+')
+    output.truncate(offset)
+    output.seek(offset)
+    return output
+
+
+class ResumableHandler(TopicHandler):
+    """
+    Wraps a TopicHandler: skips the messages a checkpoint says are committed and tracks the
+    position to save at the next checkpoint; the wrapped handler's sync() is called first.
+    """
+
+    def __init__(self, handler, checkpoint=None):
+        self.handler = handler
+        self.raw_views = handler.raw_views
+        checkpoint = checkpoint or TopicCheckpoint()
+        self.resume_stamp = checkpoint.stamp
+        self.resume_at_stamp = checkpoint.at_stamp
+        self.skipped_at_stamp = 0
+        self.stamp = checkpoint.stamp
+        self.at_stamp = checkpoint.at_stamp
+        self.count = checkpoint.count
+        self.offset = checkpoint.offset
+        self.complete = False
+        self.closed = False
+
+    def handle(self, topic, msg, t):
+        stamp = t.to_nsec()
+        if self.resume_stamp is not None:
+            if stamp < self.resume_stamp:
+                return
+            if stamp == self.resume_stamp and self.skipped_at_stamp < self.resume_at_stamp:
+                self.skipped_at_stamp += 1
+                return
+            self.resume_stamp = None
+
+        # counted first: the wrapped handler's insert may itself fill a batch and commit
+        if stamp == self.stamp:
+            self.at_stamp += 1
+        else:
+            self.stamp = stamp
+            self.at_stamp = 1
+        self.count += 1
+
+        self.handler.handle(topic, msg, t)
+
+    def position(self):
+        """Checkpoint of everything handled so far; the wrapped handler is synced first."""
+        if not self.closed:
+            self.offset = self.handler.sync()
+        return TopicCheckpoint(self.stamp, self.at_stamp, self.count, self.offset, self.complete)
+
+    def close(self):
+        self.offset = self.handler.sync()
+        self.handler.close()
+        self.closed = True
+
+
+def resumeStartTime(handlers, start_time=None):
+    """
+    Earliest time the bag must be read from for these ResumableHandlers (None: the start),
+    never before start_time (the start of a --start/--end window).
+    """
+    stamps = [handler.resume_stamp for handler in handlers.values()]
+    if not stamps or any(stamp is None for stamp in stamps):
+        return start_time
+    if start_time is None:
+        return min(stamps)
+    return max(start_time, min(stamps))
+
+
+class PeriodicCheckpoint:
+    """Calls save() at most every `seconds`, from tick(); for outputs with no commit of their own."""
+
+    def __init__(self, save, seconds=5.0):
+        self.save = save
+        self.seconds = seconds
+        self.last = time.time()
+
+    def tick(self):
+        if time.time() - self.last >= self.seconds:
+            self.save()
+            self.last = time.time()
+
+
+class SidecarCheckpointStore:
+    """
+    Checkpoints of one bag's file outputs, in a JSON file next to them; key names the time
+    window of a windowed run (see topicSelection), which is checkpointed separately.
+    """
+
+    def __init__(self, folder, key=''):
+        name, extension = os.path.splitext(CHECKPOINT_FILE_NAME)
+        self.path = os.path.join(folder, name + key + extension)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as checkpoint_file:
+            return {topic: TopicCheckpoint.fromDict(values) for topic, values in json.load(checkpoint_file).items()}
+
+    def save(self, checkpoints):
+        """Merge {topic: TopicCheckpoint} into the file; replaced atomically, never half written."""
+        merged = {topic: checkpoint.toDict() for topic, checkpoint in self.load().items()}
+        merged.update({topic: checkpoint.toDict() for topic, checkpoint in checkpoints.items()})
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as checkpoint_file:
+            json.dump(merged, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temporary_path, self.path)
+
+
+class DbCheckpointStore:
+    """Checkpoints of the DB topics, in table ingest_checkpoints of the database itself."""
+
+    table_name = 'ingest_checkpoints'
+    columns = [
+        ('bag', 'NVARCHAR(260)'),
+        ('topic', 'NVARCHAR(260)'),
+        ('stamp', 'BIGINT'),
+        ('at_stamp', 'INT'),
+        ('message_count', 'BIGINT'),
+        ('complete', 'INT')
+    ]
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.writer.sink.create_table(self.writer.cursor, self.table_name, self.columns, if_not_exists=True)
+
+    def load(self, bag):
+        rows = self.writer.query(f"SELECT topic, stamp, at_stamp, message_count, complete FROM {self.table_name} WHERE bag = ?", (bag,))
+        return {topic: TopicCheckpoint(stamp, at_stamp, message_count, None, bool(complete))
+                for topic, stamp, at_stamp, message_count, complete in rows}
+
+    def windowedTopics(self, bag):
+        """Topics that runs over a time window of bag (keys bag@start-end) have checkpoints for."""
+        rows = self.writer.query(f"SELECT bag, topic FROM {self.table_name} WHERE bag LIKE ?", (bag + '@%',))
+        return {topic for key, topic in rows if key.startswith(bag + '@')}
+
+    def save(self, bag, checkpoints):
+        """Write {topic: TopicCheckpoint}; call inside the transaction that commits the rows."""
+        for topic, checkpoint in checkpoints.items():
+            self.writer.execute(f"DELETE FROM {self.table_name} WHERE bag = ? AND topic = ?", (bag, topic))
+            self.writer.execute(f"INSERT INTO {self.table_name} VALUES (?, ?, ?, ?, ?, ?)",
+                                (bag, topic, checkpoint.stamp, checkpoint.at_stamp, checkpoint.count, int(checkpoint.complete)))
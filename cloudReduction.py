@@ -0,0 +1,112 @@
+'''
+Optional reduction of lidar point clouds between decoding and storage.
+
+Most consumers of the velodyne data want a range-limited, downsampled cloud rather than
+all ~30k points of every revolution. A CloudReduction drops the points outside
+[min_range, max_range] (distance to the sensor) or on rings that are not kept, then keeps
+one point per voxel of voxel_size metres: coordinates are quantized, each voxel is packed
+into one int64 key, and np.unique() on the keys gives the first point of every voxel. It
+is all NumPy, no loop over points.
+
+Decoded /velodyne_packets scans (N x 6 arrays of velodyne_decoder 2.x: x, y, z, intensity,
+ring, time; N x 8 of 3.x: x, y, z, intensity, time, column, ring, return_type) are reduced
+in the decoding worker processes, /velodyne_points clouds (structured arrays, see
+pointClouds.py) in the handler, before either is written to its shards.
+
+Reductions are configured per topic, e.g. in CLOUD_REDUCTION:
+
+    /velodyne_packets:voxel=0.1,min_range=1,max_range=80;/velodyne_points:voxel=0.2,rings=0-7
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import numpy as np
+
+# ring column of the decoded scan arrays, by their number of columns
+RING_COLUMNS = {6: 4, 8: 6}
+
+# bits per axis of a packed voxel key
+_KEY_BITS = 21
+
+
+class CloudReduction:
+    """
+    Range crop, ring filter and voxel-grid downsampling of one topic's clouds.
+    Parameters left as None are not applied.
+    """
+
+    def __init__(self, voxel_size=None, min_range=None, max_range=None, rings=None):
+        self.voxel_size = voxel_size
+        self.min_range = min_range
+        self.max_range = max_range
+        self.rings = None if rings is None else np.asarray(sorted(rings))
+
+    def __call__(self, points):
+        """Reduced copy of points: an N x C array (x, y, z first) or a structured array with x, y, z (and ring)."""
+        if points.dtype.names is not None:
+            xyz = np.stack([points['x'], points['y'], points['z']], axis=1).astype(np.float64)
+            ring = points['ring'] if 'ring' in points.dtype.names else None
+        else:
+            xyz = points[:, :3].astype(np.float64)
+            ring = points[:, RING_COLUMNS[points.shape[1]]] if points.shape[1] in RING_COLUMNS else None
+
+        keep = np.isfinite(xyz).all(axis=1)
+        if self.min_range is not None or self.max_range is not None:
+            squared = np.einsum('ij,ij->i', xyz, xyz)
+            if self.min_range is not None:
+                keep &= squared >= self.min_range ** 2
+            if self.max_range is not None:
+                keep &= squared <= self.max_range ** 2
+        if self.rings is not None:
+            if ring is None:
+                raise ValueError(f"Cannot filter rings of points without a ring column ({points.dtype}, {points.shape})")
+            keep &= np.isin(ring, self.rings)
+
+        points = points[keep]
+        if self.voxel_size and len(points):
+            points = points[np.sort(voxelFirstPoints(xyz[keep], self.voxel_size))]
+        return points
+
+
+def voxelFirstPoints(xyz, voxel_size):
+    """Indices of the first point in every occupied voxel of xyz."""
+    cells = np.floor(xyz / voxel_size).astype(np.int64)
+    cells -= cells.min(axis=0)
+    if cells.max() >= 1 << _KEY_BITS:
+        # too wide to pack into one int64: unique on the rows instead
+        return np.unique(cells, axis=0, return_index=True)[1]
+    keys = (cells[:, 0] << (2 * _KEY_BITS)) | (cells[:, 1] << _KEY_BITS) | cells[:, 2]
+    return np.unique(keys, return_index=True)[1]
+
+
+def parseRings(text):
+    """'0-7+12' -> [0, 1, ..., 7, 12]"""
+    rings = []
+    for part in text.split('+'):
+        first, _, last = part.partition('-')
+        rings.extend(range(int(first), int(last or first) + 1))
+    return rings
+
+
+def reductionsFromSpec(spec):
+    """
+    {topic: CloudReduction} of 'topic:key=value,...;topic:...'.
+    Keys: voxel (m), min_range (m), max_range (m), rings ('0-7', '0-3+8-11').
+    """
+    reductions = {}
+    for entry in filter(None, (part.strip() for part in (spec or '').split(';'))):
+        topic, _, options = entry.partition(':')
+        parameters = {}
+        for option in filter(None, options.split(',')):
+            key, _, value = option.partition('=')
+            key = key.strip()
+            if key == 'voxel':
+                parameters['voxel_size'] = float(value)
+            elif key in ('min_range', 'max_range'):
+                parameters[key] = float(value)
+            elif key == 'rings':
+                parameters['rings'] = parseRings(value)
+            else:
+                raise ValueError(f"Unknown cloud reduction option {key!r} for {topic}")
+        reductions[topic.strip()] = CloudReduction(**parameters)
+    return reductions
@@ -0,0 +1,207 @@
+'''
+Per-topic database writers used by feeding_bag_files_to_db.py.
+
+Each class is a bagDemux.TopicHandler: it creates its table, then queues one row per
+message on a dbWriter.BatchedWriter as the single pass over the bag reaches it. Every table
+starts with the bag_id of the bag in the bags catalog (see dbSchema), so bags share tables.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+from bagDemux import TopicHandler
+from dbSchema import BAG_ID_COLUMN
+from rowExtractor import getRowExtractor
+from scanShard import ScanShardWriter
+from scanArrays import packScanArray
+from pointClouds import cloudPoints, fieldLayout
+from velodyneScans import VelodyneScanHandler
+
+
+class LaserScanTableHandler(TopicHandler):
+    """
+    /sick_lms_5xx/scan -> sick_lms_5xx_scan
+
+    ranges and intensities are packed blobs (see scanArrays); array_encoding names their encoding.
+    """
+
+    table_name = 'sick_lms_5xx_scan'
+    columns = [
+        BAG_ID_COLUMN,
+        ('seq', 'INT'),
+        ('secs', 'INT'),
+        ('nsecs', 'INT'),
+        ('angle_min', 'FLOAT'),
+        ('angle_max', 'FLOAT'),
+        ('angle_increment', 'FLOAT'),
+        ('time_increment', 'FLOAT'),
+        ('scan_time', 'FLOAT'),
+        ('range_min', 'FLOAT'),
+        ('range_max', 'FLOAT'),
+        ('array_encoding', 'NVARCHAR(16)'),
+        ('ranges', 'VARBINARY(MAX)'),
+        ('intensities', 'VARBINARY(MAX)')
+    ]
+
+    def __init__(self, writer, bag_id, encoding='float32'):
+        self.writer = writer
+        self.bag_id = bag_id
+        self.encoding = encoding
+        self.writer.create_table(self.table_name, self.columns)
+
+    def handle(self, topic, msg, t):
+        self.writer.insert(self.table_name, (
+            self.bag_id,
+            msg.header.seq,
+            msg.header.stamp.secs,
+            msg.header.stamp.nsecs,
+            msg.angle_min,
+            msg.angle_max,
+            msg.angle_increment,
+            msg.time_increment,
+            msg.scan_time,
+            msg.range_min,
+            msg.range_max,
+            self.encoding,
+            packScanArray(msg.ranges, self.encoding),
+            packScanArray(msg.intensities, self.encoding)
+        ))
+
+
+class PointCloudTableHandler(TopicHandler):
+    """
+    /velodyne_points clouds -> points in binary shards in folder (structured records, see
+    pointClouds), and velodyne_points with the cloud's header, layout and where it is stored.
+    reduction: an optional cloudReduction.CloudReduction applied before the points are stored.
+    """
+
+    raw_views = True
+
+    table_name = 'velodyne_points'
+    columns = [
+        BAG_ID_COLUMN,
+        ('seq', 'INT'),
+        ('secs', 'INT'),
+        ('nsecs', 'INT'),
+        ('height', 'INT'),
+        ('width', 'INT'),
+        ('is_bigendian', 'NVARCHAR(10)'),
+        ('point_step', 'INT'),
+        ('row_step', 'INT'),
+        ('is_dense', 'NVARCHAR(10)'),
+        ('fields', 'NVARCHAR(MAX)'),
+        ('md5_cloud', 'NVARCHAR(32)'),
+        ('shard', 'NVARCHAR(260)'),
+        ('shard_offset', 'BIGINT'),
+        ('points', 'INT')
+    ]
+
+    def __init__(self, writer, bag_id, folder, resume_count=None, reduction=None, shard_name='clouds'):
+        self.writer = writer
+        self.bag_id = bag_id
+        self.reduction = reduction
+        self.writer.create_table(self.table_name, self.columns)
+        self.shards = ScanShardWriter(folder, name=shard_name, resume_count=resume_count)
+
+    def handle(self, topic, msg, t):
+        points = cloudPoints(msg)
+        if self.reduction is not None:
+            points = self.reduction(points)
+        md5_cloud, shard, offset = self.shards.append(points, msg.header.stamp.secs, msg.header.stamp.nsecs)
+        self.writer.insert(self.table_name, (
+            self.bag_id,
+            msg.header.seq,
+            msg.header.stamp.secs,
+            msg.header.stamp.nsecs,
+            msg.height,
+            msg.width,
+            msg.is_bigendian,
+            msg.point_step,
+            msg.row_step,
+            msg.is_dense,
+            fieldLayout(msg.fields),
+            md5_cloud,
+            shard,
+            offset,
+            len(points)
+        ))
+
+    def sync(self):
+        self.shards.sync()
+
+    def close(self):
+        self.shards.close()
+
+
+class VelodyneScanTableHandler(VelodyneScanHandler):
+    """
+    /velodyne_packets scans, decoded on a process pool (see velodyneScans) -> binary shards
+    in folder (see scanShard), and velodyne_packets recording where each scan is stored.
+
+    Scans in flight are stored before each commit, so a checkpoint never counts a scan
+    whose row is not in its transaction.
+    """
+
+    table_name = 'velodyne_packets'
+    columns = [
+        BAG_ID_COLUMN,
+        ('count', 'INT'),
+        ('secs', 'INT'),
+        ('nsecs', 'INT'),
+        ('md5_scan', 'NVARCHAR(32)'),
+        ('shard', 'NVARCHAR(260)'),
+        ('shard_offset', 'BIGINT'),
+        ('points', 'INT')
+    ]
+
+    def __init__(self, writer, bag_id, folder, resume_count=None, workers=None, reduction=None, shard_name='scans'):
+        super().__init__(workers, reduction=reduction)
+        self.writer = writer
+        self.bag_id = bag_id
+        self.writer.create_table(self.table_name, self.columns)
+        self.writer.before_commit.append(self.drain)
+        self.shards = ScanShardWriter(folder, name=shard_name, resume_count=resume_count)
+
+    def store(self, points, stamp):
+        count = self.shards.count
+        md5_scan, shard, offset = self.shards.append(points, stamp.secs, stamp.nsecs)
+        self.writer.insert(self.table_name, (
+            self.bag_id,
+            count,
+            stamp.secs,
+            stamp.nsecs,
+            md5_scan,
+            shard,
+            offset,
+            len(points)
+        ))
+
+    def sync(self):
+        self.shards.sync()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.writer.before_commit.remove(self.drain)
+            self.shards.close()
+
+
+class GenericTableHandler(TopicHandler):
+    """
+    Any other topic -> table named after the topic, with a BIGINT rosbagTimestamp (ns) and
+    one typed column per flattened message field (see rowExtractor). The table is created
+    from the first message the pass delivers.
+    """
+
+    def __init__(self, writer, bag_id, topicName):
+        self.writer = writer
+        self.bag_id = bag_id
+        self.table_name = topicName.replace('/', '_slash_')
+        self.extractor = None
+
+    def handle(self, topic, msg, t):
+        if self.extractor is None:
+            self.extractor = getRowExtractor(msg)
+            self.writer.create_table(self.table_name, [BAG_ID_COLUMN, ('rosbagTimestamp', 'BIGINT')] + self.extractor.columns)
+
+        self.writer.insert(self.table_name, (self.bag_id, t.to_nsec()) + self.extractor(msg))
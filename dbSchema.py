@@ -0,0 +1,159 @@
+'''
+Bag catalog and indexes of the topic tables written by feeding_bag_files_to_db.py.
+
+Every bag gets one row in the bags catalog (name, recording date and split index parsed
+from the file name, size, duration, message count and a fingerprint of the file), and every
+topic table a bag_id column referencing it, so several bags share the same tables and a
+drive is selected by its bag_id. A bag is identified by its fingerprint, not its name: bags
+of the same name in different folders are different bags, and a copy of a bag is the same.
+
+    SELECT secs, nsecs, latitude, longitude FROM _slash_gps_slash_fix
+    WHERE bag_id = (SELECT bag_id FROM bags WHERE file_name = 'mapping_van_2019-10-18-20-39-30_12.bag')
+    ORDER BY secs, nsecs
+
+Topic tables are clustered on (bag_id, secs, nsecs), or (bag_id, rosbagTimestamp) for the
+generic ones. Maintaining that index row by row slows a bulk load down, so the scripts drop
+it before the bags are loaded (dropTimeIndexes) and build it once at the end
+(createTimeIndexes). On SQL Server / Azure SQL the tables can also be partitioned by month
+of their time column.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import calendar
+import datetime
+import os
+
+BAGS_TABLE = 'bags'
+BAGS_COLUMNS = [
+    ('bag_id', 'INT IDENTITY(1,1) PRIMARY KEY'),
+    ('file_name', 'NVARCHAR(260) NOT NULL'),
+    ('recorded_at', 'DATETIME2'),
+    ('split_index', 'INT'),
+    ('file_size', 'BIGINT'),
+    ('start_time', 'FLOAT'),
+    ('duration', 'FLOAT'),
+    ('message_count', 'BIGINT'),
+    ('fingerprint', 'NVARCHAR(32)')
+]
+
+# first column of every topic table
+BAG_ID_COLUMN = ('bag_id', 'INT NOT NULL REFERENCES bags(bag_id)')
+
+def parseBagFileName(file_name):
+    """
+    (recorded_at, split_index) of a name like mapping_van_2019-10-18-20-39-30_12.bag:
+    ('2019-10-18 20:39:30', 12). Either is None where the name does not fit.
+    """
+    parts = os.path.basename(file_name)[:-len('.bag')].split('_') if file_name.endswith('.bag') else []
+    for i, part in enumerate(parts):
+        try:
+            recorded_at = datetime.datetime.strptime(part, '%Y-%m-%d-%H-%M-%S')
+        except ValueError:
+            continue
+        split_index = None
+        if i + 1 < len(parts):
+            try:
+                split_index = int(parts[i + 1])
+            except ValueError:
+                pass
+        return recorded_at.strftime('%Y-%m-%d %H:%M:%S'), split_index
+    return None, None
+
+
+def createCatalog(sink, cursor):
+    sink.create_table(cursor, BAGS_TABLE, BAGS_COLUMNS, if_not_exists=True)
+    # catalogs of older runs identified bags by file name
+    sink.drop_index(cursor, BAGS_TABLE, 'ux_bags_file_name')
+    sink.create_index(cursor, BAGS_TABLE, 'ux_bags_fingerprint', ['fingerprint'], unique=True)
+
+
+def registerBag(writer, bag, path, fingerprint):
+    """Catalog the bag in the bags table (once per fingerprint, see bagDiscovery.bagFingerprint) and return its bag_id."""
+    createCatalog(writer.sink, writer.cursor)
+    recorded_at, split_index = parseBagFileName(path)
+    start_time = bag.get_start_time()
+    values = (os.path.basename(path), recorded_at, split_index, os.path.getsize(path), start_time,
+              bag.get_end_time() - start_time, bag.get_message_count())
+
+    rows = writer.query(f"SELECT bag_id FROM {BAGS_TABLE} WHERE fingerprint = ?", (fingerprint,))
+    if rows:
+        # the same bag again (resumed, a new time window, or a copy): refresh what may have changed
+        writer.execute(f"UPDATE {BAGS_TABLE} SET file_name = ?, recorded_at = ?, split_index = ?, file_size = ?, start_time = ?, "
+                       f"duration = ?, message_count = ? WHERE bag_id = ?", values + (rows[0][0],))
+        return rows[0][0]
+    writer.execute(f"INSERT INTO {BAGS_TABLE} (file_name, recorded_at, split_index, file_size, start_time, duration, message_count, fingerprint) "
+                   f"VALUES (?, ?, ?, ?, ?, ?, ?, ?)", values + (fingerprint,))
+    return writer.query(f"SELECT bag_id FROM {BAGS_TABLE} WHERE fingerprint = ?", (fingerprint,))[0][0]
+
+
+def deleteBagRows(writer, table_name, bag_id):
+    """Delete the rows of bag_id from a topic table, if the table exists."""
+    if table_name.lower() in (name.lower() for name in writer.sink.list_tables(writer.cursor)):
+        writer.execute(f"DELETE FROM {table_name} WHERE bag_id = ?", (bag_id,))
+
+
+def timeIndex(columns):
+    """(index columns, partition column, partition column type) of a topic table, from its column names."""
+    names = {column.lower() for column in columns}
+    if 'secs' in names and 'nsecs' in names:
+        return ['bag_id', 'secs', 'nsecs'], 'secs', 'INT'
+    if 'rosbagtimestamp' in names:
+        return ['bag_id', 'rosbagTimestamp'], 'rosbagTimestamp', 'BIGINT'
+    return ['bag_id'], None, None
+
+
+def topicTables(sink, cursor):
+    """{table: column names} of every table with a bag_id column, the catalog itself excepted."""
+    tables = {}
+    for table_name in sink.list_tables(cursor):
+        if table_name.lower() == BAGS_TABLE:
+            continue
+        columns = sink.table_columns(cursor, table_name)
+        if 'bag_id' in (column.lower() for column in columns):
+            tables[table_name] = columns
+    return tables
+
+
+def timeIndexName(table_name):
+    return f"ix_{table_name}_bag_time"
+
+
+def dropTimeIndexes(sink):
+    """Drop the time index of every topic table before a bulk load; returns the tables."""
+    cursor = sink.cursor()
+    tables = topicTables(sink, cursor)
+    for table_name in tables:
+        sink.drop_index(cursor, table_name, timeIndexName(table_name))
+    sink.commit(final=True)
+    return list(tables)
+
+
+def monthBoundaries(first_month, months):
+    """Unix seconds of the first day of `months` months from first_month ('2019-01')."""
+    year, month = map(int, first_month.split('-'))
+    boundaries = []
+    for i in range(months):
+        boundaries.append(calendar.timegm((year + (month - 1 + i) // 12, (month - 1 + i) % 12 + 1, 1, 0, 0, 0)))
+    return boundaries
+
+
+def createTimeIndexes(sink, partition_from=None, partition_months=120):
+    """
+    Build the clustered time index of every topic table (after a bulk load); returns the tables.
+    partition_from: first month ('2019-01') of monthly partitions, where the backend has them.
+    """
+    cursor = sink.cursor()
+    schemes = {}
+    if partition_from:
+        seconds = monthBoundaries(partition_from, partition_months)
+        schemes['INT'] = sink.partition_scheme(cursor, 'ingest_month_secs', 'INT', seconds)
+        schemes['BIGINT'] = sink.partition_scheme(cursor, 'ingest_month_ns', 'BIGINT', [boundary * 1000000000 for boundary in seconds])
+    tables = topicTables(sink, cursor)
+    for table_name, columns in tables.items():
+        index_columns, partition_column, partition_type = timeIndex(columns)
+        scheme = schemes.get(partition_type)
+        sink.create_index(cursor, table_name, timeIndexName(table_name), index_columns, clustered=True,
+                          partition=(scheme, partition_column) if scheme else None)
+    sink.commit(final=True)
+    return list(tables)
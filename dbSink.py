@@ -0,0 +1,315 @@
+'''
+Database sink backends for the ingestion scripts.
+
+A sink owns the connection and knows the fastest bulk path of its database:
+
+    OdbcSink    pyodbc (Azure SQL / SQL Server): executemany() with fast_executemany, or
+                multi-row "INSERT ... VALUES (...), (...)" statements when the driver has no
+                fast_executemany
+    SqliteSink  embedded SQLite file: WAL journal, one transaction for the whole run and
+                executemany() over a single prepared statement
+
+dbWriter.BatchedWriter sits on top of a sink, so ingestion can be profiled and
+regression-tested offline against SQLite and pointed at Azure per deployment:
+
+    SQL_DB_BACKEND=sqlite SQLITE_DB_PATH=drive.sqlite3 python3 feeding_bag_files_to_db.py
+
+The round trips of inserts and commits are timed in metrics.py ('db execute' per table,
+'commit'), on whichever thread runs them.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import re
+import sqlite3
+from decimal import Decimal
+import metrics
+
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+# DECIMAL values (uint64 fields, see rowExtractor) go to SQLite as their exact text
+sqlite3.register_adapter(Decimal, str)
+
+# Exceptions a sink can raise, whatever the backend
+SINK_ERRORS = (sqlite3.Error,) + ((pyodbc.Error,) if pyodbc is not None else ())
+
+# SQLSTATEs worth a retry on a fresh connection: link failures, timeouts and deadlocks
+TRANSIENT_SQLSTATES = {'08001', '08004', '08007', '08S01', 'HYT00', 'HYT01', '40001'}
+# Azure SQL error numbers of throttling, failover and busy databases
+TRANSIENT_AZURE_ERRORS = ('40143', '40197', '40501', '40613', '49918', '49919', '49920', '10928', '10929')
+
+
+def isTransientError(e):
+    """True for database errors that may succeed when retried on a new connection."""
+    if isinstance(e, sqlite3.OperationalError):
+        return 'locked' in str(e) or 'busy' in str(e)
+    if pyodbc is not None and isinstance(e, pyodbc.Error):
+        if e.args and e.args[0] in TRANSIENT_SQLSTATES:
+            return True
+        return any(f"({code})" in str(e) for code in TRANSIENT_AZURE_ERRORS)
+    return False
+
+
+class InsertStatement:
+    """INSERT of one table, built once and reused for every batch."""
+
+    def __init__(self, table_name, column_names, number_of_columns):
+        self.table_name = table_name
+        self.number_of_columns = number_of_columns
+        columns_clause = f" ({', '.join(column_names)})" if column_names is not None else ""
+        self.prefix = f"INSERT INTO {table_name}{columns_clause} VALUES "
+        self.row_placeholder = "(" + ", ".join('?' for _ in range(number_of_columns)) + ")"
+        self.sql = self.prefix + self.row_placeholder
+        self.multirow_sql = {}
+
+    def multirow(self, number_of_rows):
+        """INSERT with number_of_rows VALUES tuples; cached since batches repeat the same sizes."""
+        if number_of_rows not in self.multirow_sql:
+            self.multirow_sql[number_of_rows] = self.prefix + ", ".join(self.row_placeholder for _ in range(number_of_rows))
+        return self.multirow_sql[number_of_rows]
+
+
+class DatabaseSink:
+    """Interface shared by the backends."""
+
+    name = None
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def column_type(self, sql_type):
+        """Translate a column type written for SQL Server into this backend's dialect."""
+        return sql_type
+
+    def create_table(self, cursor, table_name, columns, if_not_exists=False):
+        """columns: list of (name, SQL Server type) pairs."""
+        create_table_sql = f"CREATE TABLE {table_name} (" + ", ".join(f"{col[0]} {self.column_type(col[1])}" for col in columns) + ")"
+        if if_not_exists:
+            create_table_sql = self.if_not_exists(table_name, create_table_sql)
+        self.execute(cursor, create_table_sql)
+
+    def if_not_exists(self, table_name, create_table_sql):
+        return f"IF OBJECT_ID(N'{table_name}', N'U') IS NULL {create_table_sql}"
+
+    def list_tables(self, cursor):
+        return [row[0] for row in self.query(cursor, "SELECT name FROM sys.tables")]
+
+    def table_columns(self, cursor, table_name):
+        return [row[0] for row in self.query(cursor, "SELECT name FROM sys.columns WHERE object_id = OBJECT_ID(?) ORDER BY column_id", (table_name,))]
+
+    def create_index(self, cursor, table_name, index_name, columns, clustered=False, unique=False, partition=None):
+        """Create index_name unless it exists; partition: (scheme, column) to partition the table on."""
+        kind = ('UNIQUE ' if unique else '') + ('CLUSTERED' if clustered else 'NONCLUSTERED')
+        sql = f"CREATE {kind} INDEX {index_name} ON {table_name} ({', '.join(columns)})"
+        if partition is not None:
+            sql += f" ON {partition[0]}({partition[1]})"
+        self.execute(cursor, f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'{index_name}' "
+                             f"AND object_id = OBJECT_ID(N'{table_name}')) {sql}")
+
+    def drop_index(self, cursor, table_name, index_name):
+        self.execute(cursor, f"DROP INDEX IF EXISTS {index_name} ON {table_name}")
+
+    def partition_scheme(self, cursor, name, sql_type, boundaries):
+        """Create partition function pf_<name> and scheme ps_<name> (RANGE RIGHT on boundaries) unless they exist."""
+        values = ', '.join(str(boundary) for boundary in boundaries)
+        self.execute(cursor, f"IF NOT EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = N'pf_{name}') "
+                             f"CREATE PARTITION FUNCTION pf_{name} ({sql_type}) AS RANGE RIGHT FOR VALUES ({values})")
+        self.execute(cursor, f"IF NOT EXISTS (SELECT 1 FROM sys.partition_schemes WHERE name = N'ps_{name}') "
+                             f"CREATE PARTITION SCHEME ps_{name} AS PARTITION pf_{name} ALL TO ([PRIMARY])")
+        return f"ps_{name}"
+
+    def execute(self, cursor, sql, params=()):
+        cursor.execute(sql, params)
+
+    def ping(self):
+        """Health check: True if the connection still answers a trivial query."""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return True
+        except SINK_ERRORS:
+            return False
+
+    def query(self, cursor, sql, params=()):
+        """Run a SELECT and return all its rows."""
+        self.execute(cursor, sql, params)
+        return cursor.fetchall()
+
+    def prepare_insert(self, table_name, column_names=None, number_of_columns=None):
+        if column_names is not None:
+            number_of_columns = len(column_names)
+        return InsertStatement(table_name, column_names, number_of_columns)
+
+    def insert_many(self, cursor, statement, rows):
+        with metrics.timed('db execute', statement.table_name):
+            cursor.executemany(statement.sql, rows)
+
+    def commit(self, final=False):
+        """Commit the transaction; final marks the end of a bag."""
+        with metrics.timed('commit'):
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def abort(self):
+        """Roll back what was not committed yet and close."""
+        try:
+            self.conn.rollback()
+        finally:
+            self.conn.close()
+
+
+class OdbcSink(DatabaseSink):
+    """
+    Azure SQL / SQL Server through pyodbc.
+
+    multirow_values: None picks executemany() when the cursor supports fast_executemany and
+    multi-row VALUES statements otherwise; True/False forces one or the other.
+    """
+
+    name = 'odbc'
+
+    # SQL Server accepts at most 2100 parameters and 1000 VALUES rows per statement
+    MAX_PARAMETERS = 2100
+    MAX_VALUES_ROWS = 1000
+
+    def __init__(self, conn, multirow_values=None):
+        super().__init__(conn)
+        self.multirow_values = multirow_values
+
+    @classmethod
+    def connect(cls, conn_str, **kwargs):
+        if pyodbc is None:
+            raise ImportError("pyodbc is required for the ODBC sink: pip install pyodbc")
+        return cls(pyodbc.connect(conn_str), **kwargs)
+
+    def cursor(self):
+        cursor = self.conn.cursor()
+        if hasattr(cursor, 'fast_executemany'):
+            cursor.fast_executemany = True
+        return cursor
+
+    def insert_many(self, cursor, statement, rows):
+        multirow_values = self.multirow_values
+        if multirow_values is None:
+            multirow_values = not getattr(cursor, 'fast_executemany', False)
+        if not multirow_values:
+            with metrics.timed('db execute', statement.table_name):
+                cursor.executemany(statement.sql, rows)
+            return
+
+        rows_per_statement = min(self.MAX_VALUES_ROWS, max(1, (self.MAX_PARAMETERS - 1) // statement.number_of_columns))
+        with metrics.timed('db execute', statement.table_name):
+            for i in range(0, len(rows), rows_per_statement):
+                chunk = rows[i:i + rows_per_statement]
+                cursor.execute(statement.multirow(len(chunk)), [value for row in chunk for value in row])
+
+
+class SqliteSink(DatabaseSink):
+    """
+    Embedded SQLite file in WAL mode.
+
+    With single_transaction (the default) everything written for a bag is one transaction:
+    commit() only commits at the end of the bag (final) and on close(). Without it,
+    commit() ends the transaction, so several processes can take turns writing the same
+    file; each waits up to `timeout` seconds for the write lock.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, single_transaction=True, timeout=60.0):
+        # isolation_level=None: transactions are opened explicitly below, and the connection
+        # may be used by the worker threads of the ingestion scripts
+        super().__init__(sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False))
+        self.path = path
+        self.single_transaction = single_transaction
+        self.in_transaction = False
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+    def _begin(self):
+        # The write lock is taken at the first write, not while the next batch is being parsed
+        if not self.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.in_transaction = True
+
+    def column_type(self, sql_type):
+        # NVARCHAR(MAX) / VARBINARY(MAX) are not valid SQLite type names; keep the affinity
+        sql_type = sql_type.upper()
+        if 'IDENTITY' in sql_type:
+            # only an INTEGER PRIMARY KEY numbers its rows by itself
+            return 'INTEGER PRIMARY KEY'
+        if 'CHAR' in sql_type or 'TEXT' in sql_type:
+            return 'TEXT'
+        if 'BINARY' in sql_type or 'BLOB' in sql_type:
+            return 'BLOB'
+        if 'DECIMAL' in sql_type:
+            # SQLite integers stop at 2^63 - 1 and its NUMERIC affinity would round larger
+            # ones to REAL; uint64 values are kept exact as their decimal text
+            return 'TEXT'
+        return re.sub(r'\(MAX\)', '', sql_type)
+
+    def if_not_exists(self, table_name, create_table_sql):
+        return create_table_sql.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1)
+
+    def list_tables(self, cursor):
+        return [row[0] for row in self.query(cursor, "SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+    def table_columns(self, cursor, table_name):
+        return [row[1] for row in self.query(cursor, f"PRAGMA table_info({table_name})")]
+
+    def create_index(self, cursor, table_name, index_name, columns, clustered=False, unique=False, partition=None):
+        # every SQLite table is clustered on its rowid, and there is no partitioning
+        self.execute(cursor, f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name} ON {table_name} ({', '.join(columns)})")
+
+    def drop_index(self, cursor, table_name, index_name):
+        self.execute(cursor, f"DROP INDEX IF EXISTS {index_name}")
+
+    def partition_scheme(self, cursor, name, sql_type, boundaries):
+        return None
+
+    def execute(self, cursor, sql, params=()):
+        self._begin()
+        cursor.execute(sql, params)
+
+    def query(self, cursor, sql, params=()):
+        # Reads take no write lock: outside a transaction a SELECT gets its own snapshot, inside
+        # one it sees this connection's uncommitted rows
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+    def insert_many(self, cursor, statement, rows):
+        self._begin()
+        with metrics.timed('db execute', statement.table_name):
+            cursor.executemany(statement.sql, rows)
+
+    def commit(self, final=False):
+        if final or not self.single_transaction:
+            self._commit()
+
+    def _commit(self):
+        if self.in_transaction:
+            with metrics.timed('commit'):
+                self.conn.execute("COMMIT")
+            self.in_transaction = False
+
+    def close(self):
+        self._commit()
+        self.conn.close()
+
+
+def openSink(backend, conn_str=None, sqlite_path=None, single_transaction=True):
+    """Open the sink named by backend: 'odbc' (conn_str) or 'sqlite' (sqlite_path)."""
+    if backend == OdbcSink.name:
+        return OdbcSink.connect(conn_str)
+    if backend == SqliteSink.name:
+        return SqliteSink(sqlite_path, single_transaction=single_transaction)
+    raise ValueError(f"Unknown database backend: {backend}")
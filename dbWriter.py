@@ -0,0 +1,175 @@
+'''
+Buffered, batched INSERT writer for the ingestion scripts.
+
+Rows are queued per table and sent to a dbSink backend in one bulk call per batch instead
+of one cursor.execute() (one network round trip) per message. The INSERT statement of each
+table is built once, and the transaction is committed every commit_rows rows or commit_seconds
+seconds, whichever comes first, instead of once at the end of the bag. Hooks registered in
+on_commit run inside each transaction just before it commits (used for checkpoints); hooks in
+before_commit run before its rows are sent (to hand in rows still being produced).
+
+RoundTripCountingConnection is a local SQLite stand-in for the Azure connection that counts
+round trips; tests/test_dbWriter.py checks the savings with it.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import sqlite3
+import time
+
+
+class TableBuffer:
+    """Pending rows and throughput counters of one table."""
+
+    def __init__(self, statement):
+        self.statement = statement
+        self.rows = []
+        self.rows_written = 0
+        self.execute_seconds = 0.0
+        self.first_row_time = None
+
+
+class BatchedWriter:
+    """
+    Groups rows into bulk-insert batches and commits periodically.
+
+    sink: dbSink.DatabaseSink; each batch goes through the sink's own bulk path.
+    """
+
+    def __init__(self, sink, batch_size=1000, commit_rows=10000, commit_seconds=5.0):
+        self.sink = sink
+        self.cursor = sink.cursor()
+        self.batch_size = batch_size
+        self.commit_rows = commit_rows
+        self.commit_seconds = commit_seconds
+        self.tables = {}
+        self.uncommitted_rows = 0
+        self.last_commit = time.time()
+        # callables run inside the transaction, after its rows are sent and before it commits
+        self.on_commit = []
+        # callables run before the rows of the transaction are sent
+        self.before_commit = []
+
+    def execute(self, sql, params=()):
+        """Run a one-off statement on the writer's cursor."""
+        self.sink.execute(self.cursor, sql, params)
+
+    def query(self, sql, params=()):
+        """Run a SELECT on the writer's cursor and return all its rows."""
+        return self.sink.query(self.cursor, sql, params)
+
+    def create_table(self, table_name, columns, if_not_exists=True):
+        """Create table_name from (name, type) pairs, unless it exists, and register it for inserts."""
+        self.sink.create_table(self.cursor, table_name, columns, if_not_exists=if_not_exists)
+        self.register(table_name, [col[0] for col in columns])
+
+    def register(self, table_name, column_names=None, number_of_columns=None):
+        """Build the INSERT statement of table_name once; later rows only carry values."""
+        self.tables[table_name] = TableBuffer(self.sink.prepare_insert(table_name, column_names, number_of_columns))
+
+    def insert(self, table_name, row):
+        """Queue one row of a registered table; the batch is sent when it is full."""
+        table = self.tables[table_name]
+        if table.first_row_time is None:
+            table.first_row_time = time.time()
+        table.rows.append(row)
+        if len(table.rows) >= self.batch_size:
+            self.flush(table_name)
+
+    def flush(self, table_name=None):
+        """Send the pending rows of one table (or of every table) and commit if it is due."""
+        names = [table_name] if table_name is not None else list(self.tables)
+        for name in names:
+            table = self.tables[name]
+            if table.rows:
+                self._send(table)
+
+        if self.uncommitted_rows >= self.commit_rows or time.time() - self.last_commit >= self.commit_seconds:
+            self.commit()
+
+    def tick(self):
+        """Commit if commit_seconds passed, even when no batch filled up (called per message)."""
+        if time.time() - self.last_commit >= self.commit_seconds:
+            self.commit()
+
+    def commit(self, final=False):
+        """Send every pending row, run the on_commit hooks and commit, so the transaction is consistent."""
+        for hook in self.before_commit:
+            hook()
+        for table in self.tables.values():
+            if table.rows:
+                self._send(table)
+        for hook in self.on_commit:
+            hook()
+        self.sink.commit(final)
+        self.uncommitted_rows = 0
+        self.last_commit = time.time()
+
+    def _send(self, table):
+        execute_start = time.time()
+        self.sink.insert_many(self.cursor, table.statement, table.rows)
+        table.execute_seconds += time.time() - execute_start
+        table.rows_written += len(table.rows)
+        self.uncommitted_rows += len(table.rows)
+        table.rows = []
+
+    def report(self):
+        """Return {table: (rows, seconds, rows/sec)}, seconds being wall time since the first row."""
+        now = time.time()
+        stats = {}
+        for name, table in self.tables.items():
+            if table.first_row_time is None:
+                continue
+            seconds = now - table.first_row_time
+            stats[name] = (table.rows_written, seconds, table.rows_written / seconds if seconds > 0 else 0.0)
+        return stats
+
+    def close(self):
+        """Flush every table, commit the end of the bag and print the per-table throughput."""
+        self.flush()
+        self.commit(final=True)
+        for name, (rows, seconds, rate) in self.report().items():
+            print(f"{name}: {rows} rows in {seconds:.2f} seconds ({rate:.0f} rows/sec)")
+
+
+class RoundTripCountingConnection:
+    """
+    SQLite stand-in for the Azure connection that counts round trips: every execute(),
+    executemany() and commit() would be one trip to the server over ODBC.
+    """
+
+    def __init__(self, database=':memory:'):
+        self.conn = sqlite3.connect(database)
+        self.round_trips = 0
+        self.commits = 0
+
+    def cursor(self):
+        return RoundTripCountingCursor(self, self.conn.cursor())
+
+    def commit(self):
+        self.round_trips += 1
+        self.commits += 1
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class RoundTripCountingCursor:
+
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self.cursor = cursor
+
+    def execute(self, sql, params=()):
+        self.connection.round_trips += 1
+        # SQLite has no (MAX) length; NVARCHAR(MAX) -> NVARCHAR keeps the text affinity
+        return self.cursor.execute(sql.replace('(MAX)', ''), params)
+
+    def executemany(self, sql, rows):
+        self.connection.round_trips += 1
+        return self.cursor.executemany(sql, rows)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
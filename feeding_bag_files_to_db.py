@@ -16,222 +16,323 @@ This script will also connect up to an Azure Database, please exercise caution w
 '''
 
 
-import pyodbc
 import rosbag
 import sys
 import time
 import os
 import shutil
-import velodyne_decoder as vd
-import numpy as np
-import hashlib
 from parseCamera import parseCamera
-from concurrent.futures import ThreadPoolExecutor
+from bagDemux import listBagTopics, demuxBag
+from dbHandlers import LaserScanTableHandler, PointCloudTableHandler, VelodyneScanTableHandler, GenericTableHandler
+from dbWriter import BatchedWriter
+import dbSchema
+from checkpoint import ResumableHandler, DbCheckpointStore, SidecarCheckpointStore, resumeStartTime
+from dbSink import openSink, SINK_ERRORS
+from pipeline import QueuedSink, pipelinedDemuxBag
+from sinkPool import WorkerSink
+from bagScheduler import runBags, printRunSummary
+from bagDiscovery import bagFingerprint, discoverBags, IngestManifest
+from cloudReduction import reductionsFromSpec
+import metrics
+from topicSelection import TopicSelection, addSelectionArguments, selectionFromArgs, selectionKey
+from functools import partial
+import argparse
+
+# Database backend: 'odbc' (Azure SQL through the DSN below) or 'sqlite' (local file, for offline profiling)
+DB_BACKEND = os.getenv('SQL_DB_BACKEND', 'odbc')
+SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH', 'bag_files.sqlite3')
 
 # Database connection details
 DSN_NAME = os.getenv('SQL_DSN_NAME', 'ivsg-demo')  # Setup and Download ODBC Administrator for appropriate device
 DB_USERNAME = os.getenv('SQL_DB_USERNAME', 'blank')     # Fill in appropriate credentials
 DB_PASSWORD = os.getenv('SQL_DB_PASSWORD', 'blank')
 
-try:
+# Bulk insert tuning: rows per executemany() batch, and commit every N rows or M seconds
+DB_BATCH_SIZE = int(os.getenv('SQL_DB_BATCH_SIZE', '1000'))
+DB_COMMIT_ROWS = int(os.getenv('SQL_DB_COMMIT_ROWS', '10000'))
+DB_COMMIT_SECONDS = float(os.getenv('SQL_DB_COMMIT_SECONDS', '5'))
+
+# Number of bag files processed in parallel, one worker process each (default: one per CPU)
+BAG_WORKERS = int(os.getenv('BAG_WORKERS', str(os.cpu_count() or 1)))
+
+# Camera frames: 'files' (one image file per frame under <bag folder>/images) or 'pack'
+# (one append-only pack file per camera per bag, see imagePack.py)
+CAMERA_STORAGE = os.getenv('CAMERA_STORAGE', 'files')
+
+# Processes decoding velodyne scans in each bag worker (see velodyneScans.py)
+VELODYNE_WORKERS = int(os.getenv('VELODYNE_WORKERS', str(max(1, (os.cpu_count() or 1) // BAG_WORKERS))))
+
+# Optional range crop, ring filter and voxel downsampling of the lidar clouds before they are
+# stored, per topic (see cloudReduction.py), e.g. '/velodyne_packets:voxel=0.1,max_range=80'
+CLOUD_REDUCTIONS = reductionsFromSpec(os.getenv('CLOUD_REDUCTION', ''))
+
+# Retries of a bag on a new connection after a transient database error, with exponential backoff
+DB_RETRIES = int(os.getenv('SQL_DB_RETRIES', '3'))
+DB_RETRY_SECONDS = float(os.getenv('SQL_DB_RETRY_SECONDS', '2'))
+
+# Reader/transform/writer pipeline (see pipeline.py): messages read ahead of the handlers,
+# batches queued for the database writer thread, and the memory ceiling of each queue.
+# PIPELINE_QUEUE_DEPTH=0 runs everything on one thread.
+PIPELINE_QUEUE_DEPTH = int(os.getenv('PIPELINE_QUEUE_DEPTH', '1024'))
+PIPELINE_WRITE_QUEUE_DEPTH = int(os.getenv('PIPELINE_WRITE_QUEUE_DEPTH', '16'))
+PIPELINE_MAX_QUEUE_BYTES = int(float(os.getenv('PIPELINE_MAX_QUEUE_MB', '256')) * 1e6)
+
+# Encoding of the LaserScan ranges/intensities blobs: 'float32' or 'delta' (see scanArrays.py)
+SCAN_ARRAY_ENCODING = os.getenv('SCAN_ARRAY_ENCODING', 'float32')
+
+# Time indexes of the topic tables (see dbSchema.py): 'rebuild' drops them before the bags are
+# loaded and builds them once at the end, 'keep' maintains them during the load
+DB_INDEX_MODE = os.getenv('SQL_DB_INDEX_MODE', 'rebuild')
+# Monthly partitions of the topic tables from this month, e.g. '2019-01' (SQL Server only; empty: none)
+DB_PARTITION_FROM = os.getenv('SQL_DB_PARTITION_FROM', '')
+DB_PARTITION_MONTHS = int(os.getenv('SQL_DB_PARTITION_MONTHS', '120'))
+# Fingerprint identifying each bag in the bags catalog and its checkpoints: 'sampled' (size,
+# first and last 16 MiB) or 'full'; keep the same one for a database
+BAG_FINGERPRINT = os.getenv('BAG_FINGERPRINT', 'sampled')
+
+# Bag discovery and ingest manifest (see bagDiscovery.py): threads listing directories in
+# parallel, and the SQLite file recording which bags were ingested (empty: no manifest)
+DISCOVERY_WORKERS = int(os.getenv('DISCOVERY_WORKERS', '16'))
+INGEST_MANIFEST = os.getenv('INGEST_MANIFEST', '.ingest_manifest.sqlite3')
+
+# Per-stage timings and counters (see metrics.py): a progress line every PROGRESS_SECONDS
+# (0: none), and JSON / Prometheus textfile exports at the end of the run (empty: none)
+PROGRESS_SECONDS = float(os.getenv('PROGRESS_SECONDS', '10'))
+METRICS_JSON = os.getenv('METRICS_JSON', 'ingest_metrics.json')
+METRICS_PROMETHEUS = os.getenv('METRICS_PROMETHEUS', 'ingest_metrics.prom')
+
+
+def openDatabaseSink():
     conn_str = f'DSN={DSN_NAME};UID={DB_USERNAME};PWD={DB_PASSWORD}'
-    conn = pyodbc.connect(conn_str)
-    cursor = conn.cursor()
-
-    # Utility function to process a single bag file
-    def process_bag_file(bagFile, flag_camera_parsing):
-        start = time.time()
-        print(f"Reading file {bagFile}...")
-
-        # Access bag
-        bag = rosbag.Bag(bagFile)
-        bagContents = bag.read_messages()
-        bagName = bag.filename
-
-        # Create a new directory
-        folder = bagName.rstrip(".bag")
-        os.makedirs(folder, exist_ok=True)
-
-        # Get list of topics from the bag
-        listOfTopics = set(topic for topic, _, _ in bagContents)
-
-        # Initialize camera parser
-        PC = parseCamera(folder, bag)
-        camera_topics = {
-            '/rear_left_camera/image_rect_color/compressed',
-            '/rear_center_camera/image_rect_color/compressed',
-            '/rear_right_camera/image_rect_color/compressed',
-            '/front_left_camera/image_color/compressed',
-            '/front_center_camera/image_color/compressed',
-            '/front_right_camera/image_color/compressed'
-        }
-
-        # Parse camera topics if flag is set
-        if flag_camera_parsing:
-            for topic in camera_topics:
-                if topic in listOfTopics:
-                    time_start = time.time()
-                    OutputFileName = folder + '/' + topic.replace('/', '_slash_') + '.txt'
-                    PC.parseCamera(topic, OutputFileName)
-                    listOfTopics.remove(topic)
-                    print(f"{topic} has been parsed in {time.time() - time_start} seconds.")
+    # Concurrent worker processes take turns on a SQLite file, so they commit per batch
+    return openSink(DB_BACKEND, conn_str=conn_str, sqlite_path=SQLITE_DB_PATH, single_transaction=BAG_WORKERS == 1)
+
+
+# One connection per worker process, reused by every bag the worker runs
+SINKS = WorkerSink(openDatabaseSink, retries=DB_RETRIES, retry_seconds=DB_RETRY_SECONDS)
+
+
+# Utility function to process a single bag file
+def process_bag_file(bagFile, flag_camera_parsing, selection=None):
+    def ingest(sink):
+        if not PIPELINE_QUEUE_DEPTH:
+            return ingest_bag_file(sink, bagFile, flag_camera_parsing, selection)
+        # Round trips run on a writer thread while the next messages are parsed
+        queued = QueuedSink(sink, PIPELINE_WRITE_QUEUE_DEPTH, PIPELINE_MAX_QUEUE_BYTES)
+        try:
+            return ingest_bag_file(queued, bagFile, flag_camera_parsing, selection)
+        finally:
+            # the writer thread must be done before a failed bag's connection is dropped
+            queued.detach()
+
+    # A transient database error reruns the bag on a new connection, from its last checkpoint
+    return SINKS.run(ingest)
+
+
+def ingest_bag_file(sink, bagFile, flag_camera_parsing, selection=None):
+    metrics.startBag(bagFile, PROGRESS_SECONDS)
+    print(f"Reading file {bagFile}...")
+
+    # Access bag
+    bag = rosbag.Bag(bagFile)
+    bagName = bag.filename
+
+    # Create a new directory
+    folder = bagName.rstrip(".bag")
+    os.makedirs(folder, exist_ok=True)
+
+    # Get list of selected topics from the bag index, without reading any message
+    selection = selection or TopicSelection()
+    listOfTopics = selection.selectTopics(listBagTopics(bag))
+    window_start, window_end = selection.window(bag)
+
+    # Each bag runs in a worker process, on the worker's own connection; rows of every table
+    # are batched and committed periodically by one writer per bag
+    writer = BatchedWriter(sink, batch_size=DB_BATCH_SIZE, commit_rows=DB_COMMIT_ROWS, commit_seconds=DB_COMMIT_SECONDS)
+
+    # Rows of every topic table carry the bag's id in the bags catalog. A bag is known by its
+    # fingerprint, so bags of the same name in different folders never share an id or checkpoints
+    fingerprint = bagFingerprint(bagFile, BAG_FINGERPRINT == 'full')
+    bag_id = dbSchema.registerBag(writer, bag, bagFile, fingerprint)
+
+    # Resume from the last commit of an interrupted run: table topics are checkpointed in the
+    # database, in the transaction of their rows; camera index files next to them. Files, shards
+    # and packs of a time window are named after it, so they never overwrite a full run's
+    window = selection.key(bag)
+    bagKey = fingerprint + window
+    db_checkpoints = DbCheckpointStore(writer)
+    file_checkpoints = SidecarCheckpointStore(folder, window)
+    checkpoints = db_checkpoints.load(bagKey)
+    checkpoints.update(file_checkpoints.load())
+    db_handlers = {}
+    file_handlers = {}
+
+    def saveCheckpoints():
+        file_checkpoints.save({topic: handler.position() for topic, handler in file_handlers.items()})
+        db_checkpoints.save(bagKey, {topic: handler.position() for topic, handler in db_handlers.items()})
+    writer.on_commit.append(saveCheckpoints)
+
+    def resumable(topic, handler, into):
+        into[topic] = ResumableHandler(handler, checkpoints.get(topic))
+        return into[topic]
+
+    # Initialize camera parser
+    PC = parseCamera(folder, bag, storage=CAMERA_STORAGE)
+    camera_topics = {
+        '/rear_left_camera/image_rect_color/compressed',
+        '/rear_center_camera/image_rect_color/compressed',
+        '/rear_right_camera/image_rect_color/compressed',
+        '/front_left_camera/image_color/compressed',
+        '/front_center_camera/image_color/compressed',
+        '/front_right_camera/image_color/compressed'
+    }
+
+    # Topics finished by an earlier run are not read again; for a time window, that includes
+    # the topics a full run of the bag already stored
+    done = {topic for topic, checkpoint in checkpoints.items() if checkpoint.complete}
+    fullKey = fingerprint
+    if bagKey != fullKey:
+        done |= {topic for topic, checkpoint in db_checkpoints.load(fullKey).items() if checkpoint.complete}
+    if done:
+        print(f'For "{bagFile}", these {len(done)} topics are already stored: {done}')
+    listOfTopics -= done
+
+    # Parse camera topics if flag is set
+    # All cameras share one worker pool for decode/hash/write
+    if flag_camera_parsing:
+        offsets = {topic: checkpoint.offset for topic, checkpoint in checkpoints.items()}
+        counts = {topic: checkpoint.count for topic, checkpoint in checkpoints.items()}
+        for topic, handler in PC.cameraHandlers({topic: folder + '/' + topic.replace('/', '_slash_') + window + '.txt'
+                                                 for topic in camera_topics & listOfTopics}, offsets=offsets, counts=counts,
+                                                pack_suffix=window).items():
+            resumable(topic, handler, file_handlers)
+
+    listOfTopics -= camera_topics
+
+    print(f'For "{bagFile}", these {len(listOfTopics)} topics will be parsed: {listOfTopics}')
+
+    # Process each topic
+    for topicName in listOfTopics:
+        if topicName == '/sick_lms500/scan' or topicName == '/velodyne_points' or topicName == '/velodyne_packets':
+            filename = folder + '/' + topicName.replace('/', '_slash_') + window + '.txt'
+        else:
+            filename = folder + '/' + topicName.replace('/', '_slash_') + window + '.csv'
+
+        if os.path.exists(filename):
+            print(f'This file has already existed: {filename}')
+            continue
+                                            # Below creates necessary DB tables and columns
+        if topicName == '/sick_lms_5xx/scan':
+            resumable(topicName, LaserScanTableHandler(writer, bag_id, SCAN_ARRAY_ENCODING), db_handlers)
+
+        elif topicName == '/velodyne_points':
+            # Points are decoded into structured arrays (see pointClouds.py) and stored in binary shards
+            checkpoint = checkpoints.get(topicName)
+            resumable(topicName, PointCloudTableHandler(writer, bag_id, folder + '/velodyne_points',
+                                                        resume_count=checkpoint.count if checkpoint else None,
+                                                        reduction=CLOUD_REDUCTIONS.get(topicName), shard_name='clouds' + window), db_handlers)
+
+        elif topicName == '/velodyne_packets':
+            # Scans are decoded on a process pool within the single pass over the bag (see
+            # velodyneScans.py); points live in binary shards, the table records where each scan is stored
+            checkpoint = checkpoints.get(topicName)
+            resumable(topicName, VelodyneScanTableHandler(writer, bag_id, folder + '/velodyne_pointcloud', resume_count=checkpoint.count if checkpoint else None,
+                                                          workers=VELODYNE_WORKERS, reduction=CLOUD_REDUCTIONS.get(topicName),
+                                                          shard_name='scans' + window), db_handlers)
 
         else:
-            listOfTopics -= camera_topics
-
-        print(f'For "{bagFile}", these {len(listOfTopics)} topics will be parsed: {listOfTopics}')
-
-        # Process each topic
-        for topicName in listOfTopics:
-            if topicName == '/sick_lms500/scan' or topicName == '/velodyne_points' or topicName == '/velodyne_packets':
-                filename = folder + '/' + topicName.replace('/', '_slash_') + '.txt'
-            else:
-                filename = folder + '/' + topicName.replace('/', '_slash_') + '.csv'
-
-            if os.path.exists(filename):
-                print(f'This file has already existed: {filename}')
-                continue
-                                                # Below creates necessary DB tables and columns
-            if topicName == '/sick_lms_5xx/scan':
-                table_name = 'sick_lms_5xx_scan'
-                columns = [
-                    ('seq', 'INT'),
-                    ('secs', 'INT'),
-                    ('nsecs', 'INT'),
-                    ('angle_min', 'FLOAT'),
-                    ('angle_max', 'FLOAT'),
-                    ('angle_increment', 'FLOAT'),
-                    ('time_increment', 'FLOAT'),
-                    ('scan_time', 'FLOAT'),
-                    ('range_min', 'FLOAT'),
-                    ('range_max', 'FLOAT'),
-                    ('ranges', 'NVARCHAR(MAX)'),
-                    ('intensities', 'NVARCHAR(MAX)')
-                ]
-                create_table_sql = f"CREATE TABLE {table_name} (" + ", ".join(f"{col[0]} {col[1]}" for col in columns) + ")"
-                cursor.execute(create_table_sql)
-
-                for topic, msg, t in bag.read_messages(topicName):
-                    insert_data_sql = f"INSERT INTO {table_name} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
-                    cursor.execute(insert_data_sql, (
-                        msg.header.seq,
-                        msg.header.stamp.secs,
-                        msg.header.stamp.nsecs,
-                        msg.angle_min,
-                        msg.angle_max,
-                        msg.angle_increment,
-                        msg.time_increment,
-                        msg.scan_time,
-                        msg.range_min,
-                        msg.range_max,
-                        ','.join(map(str, msg.ranges)),
-                        ','.join(map(str, msg.intensities))
-                    ))
-
-            elif topicName == '/velodyne_points':
-                table_name = 'velodyne_points'
-                columns = [
-                    ('seq', 'INT'),
-                    ('secs', 'INT'),
-                    ('nsecs', 'INT'),
-                    ('height', 'INT'),
-                    ('width', 'INT'),
-                    ('is_bigendian', 'NVARCHAR(10)'),
-                    ('point_step', 'INT'),
-                    ('row_step', 'INT'),
-                    ('is_dense', 'NVARCHAR(10)'),
-                    ('fields', 'NVARCHAR(MAX)')
-                ]
-                create_table_sql = f"CREATE TABLE {table_name} (" + ", ".join(f"{col[0]} {col[1]}" for col in columns) + ")"
-                cursor.execute(create_table_sql)
-
-                for topic, msg, t in bag.read_messages(topicName):
-                    insert_data_sql = f"INSERT INTO {table_name} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
-                    cursor.execute(insert_data_sql, (
-                        msg.header.seq,
-                        msg.header.stamp.secs,
-                        msg.header.stamp.nsecs,
-                        msg.height,
-                        msg.width,
-                        msg.is_bigendian,
-                        msg.point_step,
-                        msg.row_step,
-                        msg.is_dense,
-                        ','.join([f"{field.name}:{field.offset}:{field.datatype}:{field.count}" for field in msg.fields])
-                    ))
-
-            elif topicName == '/velodyne_packets':
-                count = 0
-                velodyne_folder = folder + '/velodyne_pointcloud'
-                os.makedirs(velodyne_folder, exist_ok=True)
-                table_name = 'velodyne_packets'
-                create_table_sql = f"CREATE TABLE {table_name} (count INT, secs INT, nsecs INT, md5_scan NVARCHAR(32), points NVARCHAR(MAX))"
-                cursor.execute(create_table_sql)
-
-                for stamp, points, topic in vd.read_bag(bagName, topicName):
-                    md5_scan = hashlib.md5(points).hexdigest()
-                    sub_folder = velodyne_folder + f'/{md5_scan[:2]}/{md5_scan[2:4]}/'
-                    os.makedirs(sub_folder, exist_ok=True)
-                    points_file = sub_folder + str(md5_scan) + '.txt'
-                    np.savetxt(points_file, points, delimiter=',')
-
-                    insert_data_sql = f"INSERT INTO {table_name} VALUES (?, ?, ?, ?, ?)"
-                    cursor.execute(insert_data_sql, (
-                        count,
-                        stamp.secs,
-                        stamp.nsecs,
-                        md5_scan,
-                        points.tolist()
-                    ))
-                    count += 1
-
-            else:
-                table_name = topicName.replace('/', '_slash_')
-                create_table_sql = f"CREATE TABLE {table_name} (rosbagTimestamp NVARCHAR(MAX), " \
-                                   + ", ".join([f"{pair.split(':')[0].strip()} NVARCHAR(MAX)" for pair in str(next(bag.read_messages(topicName))[1]).split('\n') if len(pair.split(':')) > 1]) + ")"
-                cursor.execute(create_table_sql)
-
-                for subtopic, msg, t in bag.read_messages(topicName):
-                    msgString = str(msg)
-                    msgList = msgString.split('\n')
-                    data = {'rosbagTimestamp': str(t)}
-                    for pair in msgList:
-                        splitPair = pair.split(':')
-                        if len(splitPair) > 1:
-                            data[splitPair[0].strip()] = splitPair[1].strip()
-
-                    insert_data_sql = f"INSERT INTO {table_name} ({', '.join(data.keys())}) VALUES ({', '.join(['?' for _ in data.values()])})"
-                    cursor.execute(insert_data_sql, list(data.values()))
-
-        bag.close()
-        conn.commit()
-        print(f"Finished {bagFile} in {time.time() - start} seconds.\n")
-
-    # Verify correct input arguments: 1 or 2
-    if len(sys.argv) > 2:
-        print("Invalid number of arguments: " + str(len(sys.argv)))
-        print("Should be 2: 'bag2csv.py' and 'bagName'")
-        print("Or just 1: 'bag2csv.py'")
-        sys.exit(1)
-    elif len(sys.argv) == 2:
-        listOfBagFiles = [sys.argv[1]]
+            resumable(topicName, GenericTableHandler(writer, bag_id, topicName), db_handlers)
+
+    # A full run replaces the rows that runs over time windows of the bag stored for a topic
+    # it starts afresh, so no message is stored twice
+    if bagKey == fullKey:
+        windowed = db_checkpoints.windowedTopics(fullKey)
+        for topic, handler in db_handlers.items():
+            if topic in windowed and topic not in checkpoints:
+                dbSchema.deleteBagRows(writer, handler.handler.table_name, bag_id)
+
+    # Single streaming pass over the bag for cameras and all remaining topics, from the
+    # earliest checkpoint of a resumed run
+    handlers = {topic: handler for topic, handler in {**db_handlers, **file_handlers}.items() if not handler.closed}
+    if PIPELINE_QUEUE_DEPTH:
+        read_queue = pipelinedDemuxBag(bag, handlers, start_time=resumeStartTime(handlers, window_start), checkpoint=writer,
+                                       end_time=window_end, max_items=PIPELINE_QUEUE_DEPTH, max_bytes=PIPELINE_MAX_QUEUE_BYTES)
     else:
-        listOfBagFiles = [f for f in os.listdir(".") if f.endswith(".bag")]
-        print(f"Reading all {len(listOfBagFiles)} bagfiles in current directory: {listOfBagFiles}\n")
-
-    # Set flag for camera parsing
-    flag_camera_parsing = 1
-
-    # Process all bag files with multi-threading
-    total_start = time.time()
-    with ThreadPoolExecutor() as executor:
-        executor.map(lambda bagFile: process_bag_file(bagFile, flag_camera_parsing), listOfBagFiles)
-    total_finish = time.time()
-
-    #Provides user-side confirmation for establishing connection, otherwise renders error. Also provides reads bag file(s) time to complete.
-    print(f"Done reading all {len(listOfBagFiles)} bag files.")
-    print(f"Total time: {total_finish - total_start} seconds.")
-
-except pyodbc.Error as e:
-    print(f"Error connecting to SQL Server: {e}")
-
+        demuxBag(bag, handlers, start_time=resumeStartTime(handlers, window_start), checkpoint=writer, end_time=window_end)
+    PC.close()
+    for handler in handlers.values():
+        handler.complete = True
+
+    bag.close()
+    # The last commit also records every topic as complete; the connection stays open for the next bag
+    writer.close()
+    if PIPELINE_QUEUE_DEPTH:
+        sink.detach()
+        # A full queue with a blocked producer points at the stage after it
+        print(read_queue.report())
+        print(sink.report())
+    report = metrics.finishBag()
+    print(f"Finished {bagFile}: {report}\n")
+    return report
+
+
+if __name__ == '__main__':
+    # Bag files, or every bag file under project directories; optionally only some topics / a time window
+    parser = argparse.ArgumentParser(description="Ingest the topics of bag files into the database.")
+    parser.add_argument('paths', nargs='*', default=['.'],
+                        help="bag files, or project directories to search recursively (default: the current directory)")
+    parser.add_argument('--no-cameras', action='store_true', help="do not parse the camera topics")
+    parser.add_argument('--force', action='store_true', help="also process the bags the ingest manifest lists as done")
+    addSelectionArguments(parser)
+    args = parser.parse_args()
+
+    try:
+        # Find the bags, and leave out the ones this database already got from an earlier run
+        foundBagFiles = discoverBags(args.paths, DISCOVERY_WORKERS)
+        manifest = None
+        if INGEST_MANIFEST:
+            database = SQLITE_DB_PATH if DB_BACKEND == 'sqlite' else DSN_NAME
+            target = ' '.join(part for part in [f"db:{database}", '--no-cameras' if args.no_cameras else '', selectionKey(args)] if part)
+            manifest = IngestManifest(INGEST_MANIFEST, target, full_fingerprint=BAG_FINGERPRINT == 'full')
+        if manifest and not args.force:
+            listOfBagFiles = manifest.pending(foundBagFiles)
+        else:
+            listOfBagFiles = list(foundBagFiles)
+            print(f"Reading all {len(listOfBagFiles)} bag files found.\n")
+
+        # Check the connection before any bag is read, and drop the time indexes for the bulk load
+        # (unless there is nothing to load: then the indexes stay as they are)
+        sink = openDatabaseSink()
+        if listOfBagFiles and DB_INDEX_MODE == 'rebuild':
+            dbSchema.dropTimeIndexes(sink)
+        sink.close()
+
+        # Set flag for camera parsing
+        flag_camera_parsing = 0 if args.no_cameras else 1
+
+        # Process all bag files in parallel worker processes, largest first
+        total_start = time.time()
+        results, failures = runBags(partial(process_bag_file, flag_camera_parsing=flag_camera_parsing, selection=selectionFromArgs(args)),
+                                    listOfBagFiles, workers=BAG_WORKERS, on_result=manifest.record if manifest else None)
+        if manifest:
+            manifest.close()
+
+        # Index (and partition) the tables once, over every row loaded
+        if listOfBagFiles:
+            index_start = time.time()
+            sink = openDatabaseSink()
+            indexed = dbSchema.createTimeIndexes(sink, DB_PARTITION_FROM or None, DB_PARTITION_MONTHS)
+            sink.close()
+            print(f"Indexed {len(indexed)} tables in {time.time() - index_start:.1f} seconds.")
+        total_finish = time.time()
+
+        #Provides user-side confirmation for establishing connection, otherwise renders error. Also provides reads bag file(s) time to complete.
+        printRunSummary(results, failures, total_finish - total_start)
+        metrics.writeRunMetrics(results, failures, total_finish - total_start, METRICS_JSON, METRICS_PROMETHEUS)
+        print(f"Done reading all {len(listOfBagFiles)} bag files.")
+        print(f"Total time: {total_finish - total_start} seconds.")
+        if failures:
+            sys.exit(1)
+
+    except SINK_ERRORS as e:
+        print(f"Error connecting to the {DB_BACKEND} database: {e}")
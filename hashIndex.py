@@ -0,0 +1,78 @@
+'''
+Persistent content-addressed dedup index for files named by their md5.
+
+One small SQLite file per output root (<root>/.hash_index.sqlite3) remembers every
+content-addressed file already stored under that root, across runs. Known content skips
+both the write and the mkdir syscalls, and the directories created by this process are
+remembered too, so re-processing overlapping bags, or bags where the vehicle sits still,
+costs close to no I/O.
+
+    index = HashIndex(folder + '/images')
+    if not index.contains(relative_path):
+        index.makedirs(sub_folder)
+        ...write the file...
+        index.add(relative_path)
+    index.close()
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import os
+import sqlite3
+import threading
+
+INDEX_FILE_NAME = '.hash_index.sqlite3'
+
+
+class HashIndex:
+    """Set of stored file paths (relative to root), safe to share between threads."""
+
+    def __init__(self, root, flush_every=1000):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, INDEX_FILE_NAME), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS stored (path TEXT PRIMARY KEY)")
+        self.conn.commit()
+        self.known = set()
+        self.pending = []
+        self.created_dirs = set()
+
+    def contains(self, path):
+        """True if path was stored under root by this or an earlier run."""
+        with self.lock:
+            if path in self.known:
+                return True
+            if self.conn.execute("SELECT 1 FROM stored WHERE path = ?", (path,)).fetchone() is None:
+                return False
+            self.known.add(path)
+            return True
+
+    def add(self, path):
+        with self.lock:
+            if path in self.known:
+                return
+            self.known.add(path)
+            self.pending.append((path,))
+            if len(self.pending) >= self.flush_every:
+                self._flush()
+
+    def makedirs(self, path):
+        """os.makedirs(path, exist_ok=True), skipped when this process already made path."""
+        if path in self.created_dirs:
+            return
+        os.makedirs(path, exist_ok=True)
+        self.created_dirs.add(path)
+
+    def _flush(self):
+        if self.pending:
+            self.conn.executemany("INSERT OR IGNORE INTO stored (path) VALUES (?)", self.pending)
+            self.conn.commit()
+            self.pending = []
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.conn.close()
@@ -0,0 +1,182 @@
+'''
+Append-only pack files for camera frames, instead of one image file per frame.
+
+Saving every frame as images/<camera>/xx/yy/<md5>.jpg costs a directory lookup, often a
+mkdir, an open and a close per frame, and leaves millions of small files to back up and
+delete. In pack mode (CAMERA_STORAGE=pack) the compressed bytes of every frame of a camera
+are appended to one file per bag, and each frame gets one line in a text index:
+
+    images/front_center_camera.pack     JPEG/PNG bytes, back to back
+    images/front_center_camera.idx      count,secs,nsecs,md5,offset,length,format
+
+A frame whose md5 is already in the pack is not appended again; its index line points at
+the first copy. ImagePackReader maps the pack once and serves any frame by position, md5
+or time as a memoryview slice of the mapping, without reading or copying the rest:
+
+    reader = ImagePackReader(folder + '/images', 'front_center_camera')
+    jpeg = reader.imageByMd5(md5)
+    img = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+
+    python3 imagePack.py <bag folder>/images front_center_camera <md5> frame.jpg
+
+A writer created with resume_count keeps the first resume_count frames of an earlier run
+(e.g. up to a checkpoint, see checkpoint.py) and cuts off whatever was written after them.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import argparse
+import bisect
+import mmap
+import os
+
+INDEX_HEADER = 'count,secs,nsecs,md5,offset,length,format\n'
+
+
+class PackEntry:
+    """One line of a pack index."""
+
+    __slots__ = ('count', 'secs', 'nsecs', 'md5', 'offset', 'length', 'format')
+
+    def __init__(self, line):
+        count, secs, nsecs, md5, offset, length, image_format = line.rstrip('\n').split(',')
+        self.count = int(count)
+        self.secs = int(secs)
+        self.nsecs = int(nsecs)
+        self.md5 = md5
+        self.offset = int(offset)
+        self.length = int(length)
+        self.format = image_format
+
+    @property
+    def stamp(self):
+        return self.secs * 1000000000 + self.nsecs
+
+
+class ImagePackWriter:
+    """Append frames to <folder>/<name>.pack and index them in <folder>/<name>.idx."""
+
+    def __init__(self, folder, name, resume_count=None):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.name = name
+        self.count = 0
+        self.offset = 0
+        # md5 -> offset, length of the frames already in the pack
+        self.stored = {}
+        pack_path = os.path.join(folder, name + '.pack')
+        index_path = os.path.join(folder, name + '.idx')
+        if resume_count and os.path.exists(index_path) and os.path.exists(pack_path):
+            self._resume(pack_path, index_path, resume_count)
+        else:
+            self.pack_file = open(pack_path, 'wb')
+            self.index_file = open(index_path, 'w')
+            self.index_file.write(INDEX_HEADER)
+
+    def _resume(self, pack_path, index_path, resume_count):
+        """Reopen index and pack, truncated right after frame number resume_count - 1."""
+        self.index_file = open(index_path, 'r+')
+        self.index_file.readline()
+        while self.count < resume_count:
+            line = self.index_file.readline()
+            if not line.strip():
+                break
+            entry = PackEntry(line)
+            self.stored.setdefault(entry.md5, (entry.offset, entry.length))
+            self.offset = max(self.offset, entry.offset + entry.length)
+            self.count += 1
+        end_of_kept = self.index_file.tell()
+        self.index_file.truncate(end_of_kept)
+        self.index_file.seek(end_of_kept)
+        self.pack_file = open(pack_path, 'r+b')
+        self.pack_file.truncate(self.offset)
+        self.pack_file.seek(self.offset)
+
+    def append(self, data, md5, secs, nsecs, image_format='jpeg'):
+        """Store one frame (bytes-like, e.g. a memoryview of the message) under its md5; returns its offset."""
+        stored = self.stored.get(md5)
+        if stored is None:
+            stored = (self.offset, len(data))
+            self.pack_file.write(data)
+            self.offset += len(data)
+            self.stored[md5] = stored
+        self.index_file.write(f"{self.count},{secs},{nsecs},{md5},{stored[0]},{stored[1]},{image_format}\n")
+        self.count += 1
+        return stored[0]
+
+    def sync(self):
+        """Flush pack and index, so a checkpoint never points past what is on disk."""
+        self.pack_file.flush()
+        self.index_file.flush()
+
+    def close(self):
+        self.pack_file.close()
+        self.index_file.close()
+
+
+class ImagePackReader:
+    """Random access to the frames written by ImagePackWriter(folder, name)."""
+
+    def __init__(self, folder, name):
+        with open(os.path.join(folder, name + '.idx')) as index_file:
+            index_file.readline()
+            self.entries = [PackEntry(line) for line in index_file if line.strip()]
+        self.by_md5 = {entry.md5: entry for entry in self.entries}
+        self.by_time = sorted(self.entries, key=lambda entry: entry.stamp)
+        self.stamps = [entry.stamp for entry in self.by_time]
+        self.pack_file = open(os.path.join(folder, name + '.pack'), 'rb')
+        # an empty file cannot be mapped
+        self.pack = mmap.mmap(self.pack_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.pack_file.name) else b''
+        self.view = memoryview(self.pack)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _slice(self, entry):
+        return self.view[entry.offset:entry.offset + entry.length]
+
+    def image(self, count):
+        """Compressed bytes of frame number count of the camera (0-based, in bag order)."""
+        return self._slice(self.entries[count])
+
+    def imageByMd5(self, md5):
+        return self._slice(self.by_md5[md5])
+
+    def imageAt(self, secs, nsecs=0):
+        """The frame whose stamp is nearest to secs.nsecs, and its index entry."""
+        stamp = secs * 1000000000 + nsecs
+        i = bisect.bisect_left(self.stamps, stamp)
+        if i == len(self.stamps) or (i > 0 and stamp - self.stamps[i - 1] <= self.stamps[i] - stamp):
+            i -= 1
+        entry = self.by_time[i]
+        return self._slice(entry), entry
+
+    def close(self):
+        self.view.release()
+        if isinstance(self.pack, mmap.mmap):
+            try:
+                self.pack.close()
+            except BufferError:
+                # frames handed out are still in use: the mapping goes when they do
+                pass
+        self.pack_file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract a camera frame from an image pack.")
+    parser.add_argument('folder', help="folder of the pack, e.g. <bag folder>/images")
+    parser.add_argument('name', help="camera, e.g. front_center_camera")
+    parser.add_argument('md5', help="md5 of the frame, as in the camera's index file")
+    parser.add_argument('output', help="image file to write")
+    args = parser.parse_args()
+
+    reader = ImagePackReader(args.folder, args.name)
+    image = reader.imageByMd5(args.md5)
+    with open(args.output, 'wb') as f:
+        f.write(image)
+    image.release()
+    reader.close()
+
+
+if __name__ == '__main__':
+    main()
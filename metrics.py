@@ -0,0 +1,246 @@
+'''
+Per-bag timing and counters of the ingestion scripts, exported as JSON and Prometheus text.
+
+Each worker process records the bag it is running: the time spent in every stage, per
+topic (or table), and the messages and serialized bytes read per topic.
+
+    read          bag.read_messages(): chunk reads and decompression
+    deserialize   genpy deserialization of the messages
+    transform     the topic handler: row building, formatting (and whatever it does inline)
+    hash          md5 of camera frames
+    encode        image decode/re-encode, Parquet row groups
+    file write    image files
+    db execute    bulk inserts, per table
+    commit        database commits
+
+Stages run on several threads (bag reader, camera pool, database writer) and nest (a
+handler that inserts inline includes that db execute in its transform time), so the stage
+times of a bag can add up to more than its wall time.
+
+    metrics.startBag(bagFile, progress_seconds=10)
+    with metrics.timed('hash', topic):
+        ...
+    report = metrics.finishBag()        # BagReport, returned by process_bag_file()
+    metrics.writeRunMetrics(results, failures, total_seconds, 'ingest_metrics.json', 'ingest_metrics.prom')
+
+With progress_seconds, a one-line summary of the running bag is printed at most that often.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import json
+import os
+import resource
+import threading
+import time
+
+
+class BagMetrics:
+    """Stage times and message counters of one bag."""
+
+    def __init__(self, bag, progress_seconds=0):
+        self.bag = bag
+        self.lock = threading.Lock()
+        # (stage, topic) -> [seconds, calls]
+        self.stages = {}
+        # topic -> [messages, bytes]
+        self.topics = {}
+        self.start = time.time()
+        # ru_maxrss only ever grows over the life of the process: what this bag adds is the growth
+        self.start_peak_rss_mb = peakRssMb()
+        self.expected_messages = None
+        self.progress_seconds = progress_seconds
+        self.last_progress = time.monotonic()
+
+    def add(self, stage, seconds, topic=''):
+        with self.lock:
+            entry = self.stages.get((stage, topic))
+            if entry is None:
+                entry = self.stages[(stage, topic)] = [0.0, 0]
+            entry[0] += seconds
+            entry[1] += 1
+
+    def count(self, topic, size=0, messages=1):
+        with self.lock:
+            entry = self.topics.get(topic)
+            if entry is None:
+                entry = self.topics[topic] = [0, 0]
+            entry[0] += messages
+            entry[1] += size
+        if self.progress_seconds and time.monotonic() - self.last_progress >= self.progress_seconds:
+            self.last_progress = time.monotonic()
+            print(self.progressLine(), flush=True)
+
+    def expectMessages(self, count):
+        """Number of messages the bag pass will read (from the bag index), for the progress line."""
+        self.expected_messages = (self.expected_messages or 0) + count
+
+    def progressLine(self):
+        seconds = time.time() - self.start
+        messages = sum(entry[0] for entry in self.topics.values())
+        size = sum(entry[1] for entry in self.topics.values())
+        done = f"{messages}/{self.expected_messages}" if self.expected_messages else f"{messages}"
+        return (f"{os.path.basename(self.bag)}: {done} messages, {messages / seconds:.0f} msgs/s, "
+                f"{size / 1e6 / seconds:.1f} MB/s, process peak RSS {peakRssMb():.0f} MB")
+
+    def report(self):
+        peak_rss_mb = peakRssMb()
+        with self.lock:
+            stages = {}
+            for (stage, topic), (seconds, calls) in self.stages.items():
+                stages.setdefault(stage, {})[topic] = {'seconds': seconds, 'calls': calls}
+            topics = {topic: {'messages': messages, 'bytes': size} for topic, (messages, size) in self.topics.items()}
+        return BagReport({
+            'bag': self.bag,
+            'seconds': time.time() - self.start,
+            'messages': sum(topic['messages'] for topic in topics.values()),
+            'bytes': sum(topic['bytes'] for topic in topics.values()),
+            'process_peak_rss_mb': peak_rss_mb,
+            'peak_rss_growth_mb': peak_rss_mb - self.start_peak_rss_mb,
+            'topics': topics,
+            'stages': stages,
+        })
+
+
+class BagReport:
+    """Picklable result of a bag, printed as a one-line summary by bagScheduler.printRunSummary()."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        data = self.data
+        return (f"{len(data['topics'])} topics, {data['messages']} messages ({data['bytes'] / 1e6:.1f} MB) "
+                f"in {data['seconds']:.1f} seconds, process peak RSS {data['process_peak_rss_mb']:.0f} MB "
+                f"(+{data['peak_rss_growth_mb']:.0f} MB during this bag)")
+
+
+class _Timer:
+    __slots__ = ('recorder', 'stage', 'topic', 'start')
+
+    def __init__(self, recorder, stage, topic):
+        self.recorder = recorder
+        self.stage = stage
+        self.topic = topic
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.add(self.stage, time.perf_counter() - self.start, self.topic)
+        return False
+
+
+class _NoMetrics:
+    """Recorder outside of a bag (e.g. parseCamera used on its own): records nothing."""
+
+    def add(self, stage, seconds, topic=''):
+        pass
+
+    def count(self, topic, size=0, messages=1):
+        pass
+
+    def expectMessages(self, count):
+        pass
+
+
+# the bag this process is running; the scripts run one bag per process at a time
+_current = _NoMetrics()
+
+
+def startBag(bag, progress_seconds=0):
+    global _current
+    _current = BagMetrics(bag, progress_seconds)
+    return _current
+
+
+def finishBag():
+    """Stop recording the current bag and return its BagReport."""
+    global _current
+    report = _current.report()
+    _current = _NoMetrics()
+    return report
+
+
+def current():
+    return _current
+
+
+def timed(stage, topic=''):
+    """Context manager adding the time of its block to `stage` of the current bag."""
+    return _Timer(_current, stage, topic)
+
+
+def count(topic, size=0, messages=1):
+    _current.count(topic, size, messages)
+
+
+def peakRssMb():
+    """High-water mark of this process's resident memory since it started, in MB."""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def runReport(results, failures, total_seconds):
+    """JSON-ready report of a bagScheduler.runBags() run whose results are BagReports."""
+    return {
+        'seconds': total_seconds,
+        'bags': {bagFile: result.data for bagFile, result in results.items() if isinstance(result, BagReport)},
+        'failed': {bagFile: repr(e) for bagFile, e in failures.items()},
+    }
+
+
+def prometheusText(report, prefix='bag_ingest'):
+    """Prometheus text exposition (for node_exporter's textfile collector) of a runReport()."""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{_escapeLabel(label)}"' for key, label in labels.items())
+            lines.append(f"{prefix}_{name}{{{label_text}}} {value!r}" if labels else f"{prefix}_{name} {value!r}")
+
+    bags = report['bags']
+    metric('run_seconds', 'gauge', "Wall time of the run.", [({}, float(report['seconds']))])
+    metric('bags_failed', 'gauge', "Bags that failed.", [({}, len(report['failed']))])
+    metric('bag_seconds', 'gauge', "Wall time of a bag.", [({'bag': bag}, float(data['seconds'])) for bag, data in bags.items()])
+    metric('process_peak_rss_bytes', 'gauge', "Peak resident memory of the worker process that ran a bag, over its lifetime up to the end of the bag.",
+           [({'bag': bag}, int(data['process_peak_rss_mb'] * 1024 * 1024)) for bag, data in bags.items()])
+    metric('peak_rss_growth_bytes', 'gauge', "How much a bag raised the peak resident memory of its worker process.",
+           [({'bag': bag}, int(data['peak_rss_growth_mb'] * 1024 * 1024)) for bag, data in bags.items()])
+    metric('messages_total', 'counter', "Messages read per topic.",
+           [({'bag': bag, 'topic': topic}, counts['messages']) for bag, data in bags.items() for topic, counts in data['topics'].items()])
+    metric('bytes_total', 'counter', "Serialized message bytes read per topic.",
+           [({'bag': bag, 'topic': topic}, counts['bytes']) for bag, data in bags.items() for topic, counts in data['topics'].items()])
+    stage_samples = [({'bag': bag, 'stage': stage, 'topic': topic}, timing)
+                     for bag, data in bags.items() for stage, topics in data['stages'].items() for topic, timing in topics.items()]
+    metric('stage_seconds_total', 'counter', "Time spent per stage and topic.",
+           [(labels, float(timing['seconds'])) for labels, timing in stage_samples])
+    metric('stage_calls_total', 'counter', "Timed calls per stage and topic.",
+           [(labels, timing['calls']) for labels, timing in stage_samples])
+    return '\n'.join(lines) + '\n'
+
+
+def _escapeLabel(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def writeRunMetrics(results, failures, total_seconds, json_path=None, prometheus_path=None):
+    """Write the run's metrics to json_path and/or prometheus_path (skipped when empty)."""
+    report = runReport(results, failures, total_seconds)
+    if json_path:
+        _writeAtomically(json_path, json.dumps(report, indent=2))
+        print(f"Metrics written to {json_path}")
+    if prometheus_path:
+        _writeAtomically(prometheus_path, prometheusText(report))
+        print(f"Metrics written to {prometheus_path}")
+
+
+def _writeAtomically(path, text):
+    # the textfile collector may read the file at any time: never show it half written
+    partial = path + '.partial'
+    with open(partial, 'w') as f:
+        f.write(text)
+    os.replace(partial, path)
@@ -0,0 +1,163 @@
+'''
+Per-topic Parquet writers, the columnar alternative to textHandlers.
+
+Each class is a bagDemux.TopicHandler: rows are buffered per topic, turned into one Arrow
+record batch every row_group_rows messages and written as one compressed Parquet row group,
+so memory stays bounded on long bags and no value is ever formatted as text. Columns are
+typed from the message layout (see rowExtractor), and LaserScan arrays are list<float32>
+columns, so downstream loads read only the columns they need:
+
+    pyarrow.parquet.read_table('_slash_gps_slash_fix.parquet', columns=['rosbagTimestamp', 'latitude', 'longitude'])
+
+A Parquet file is only readable once its footer is written, so the file is written as
+<name>.partial and renamed when the topic is closed; an interrupted topic starts over.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import os
+import metrics
+from bagDemux import TopicHandler
+from rowExtractor import getRowExtractor
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+DEFAULT_ROW_GROUP_ROWS = 65536
+DEFAULT_COMPRESSION = 'zstd'
+
+
+def arrowType(sql_type):
+    """Arrow type of a column type written for SQL Server (see rowExtractor.PRIMITIVE_COLUMN_TYPES)."""
+    if sql_type == 'INT':
+        return pa.int32()
+    if sql_type == 'BIGINT':
+        return pa.int64()
+    if sql_type.startswith('DECIMAL'):
+        return pa.decimal128(20, 0)
+    if sql_type == 'FLOAT':
+        return pa.float64()
+    if sql_type.startswith('VARBINARY'):
+        return pa.binary()
+    return pa.string()
+
+
+def toArrowArray(values, arrow_type):
+    try:
+        return pa.array(values, type=arrow_type)
+    except pa.ArrowTypeError:
+        # bool fields share the INT column type; let Arrow infer them, then cast
+        return pa.array(values).cast(arrow_type)
+
+
+class ParquetTableWriter:
+    """Buffers rows (tuples) of a fixed schema and writes them as Parquet row groups."""
+
+    def __init__(self, filename, schema, row_group_rows=DEFAULT_ROW_GROUP_ROWS, compression=DEFAULT_COMPRESSION):
+        if pa is None:
+            raise ImportError("pyarrow is required for Parquet output: pip install pyarrow")
+        self.filename = filename
+        self.partial_filename = filename + '.partial'
+        # label of the row group timings in metrics.py
+        self.name = os.path.basename(filename)
+        self.schema = schema
+        self.row_group_rows = row_group_rows
+        self.writer = pq.ParquetWriter(self.partial_filename, schema, compression=compression)
+        self.rows = []
+
+    def append(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        with metrics.timed('encode', self.name):
+            columns = zip(*self.rows)
+            batch = pa.record_batch([toArrowArray(values, field.type) for values, field in zip(columns, self.schema)], schema=self.schema)
+        with metrics.timed('file write', self.name):
+            self.writer.write_batch(batch, row_group_size=self.row_group_rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        os.replace(self.partial_filename, self.filename)
+
+
+class LaserScanParquetHandler(TopicHandler):
+    """/sick_lms_5xx/scan -> header, scan geometry, and ranges/intensities as list<float32> columns."""
+
+    # ~1000 beams per array: keep the buffered row group around ten megabytes
+    def __init__(self, filename, row_group_rows=1024, compression=DEFAULT_COMPRESSION):
+        if pa is None:
+            raise ImportError("pyarrow is required for Parquet output: pip install pyarrow")
+        schema = pa.schema([
+            ('rosbagTimestamp', pa.int64()),
+            ('seq', pa.int64()),
+            ('secs', pa.int64()),
+            ('nsecs', pa.int64()),
+            ('angle_min', pa.float32()),
+            ('angle_max', pa.float32()),
+            ('angle_increment', pa.float32()),
+            ('time_increment', pa.float32()),
+            ('scan_time', pa.float32()),
+            ('range_min', pa.float32()),
+            ('range_max', pa.float32()),
+            ('ranges', pa.list_(pa.float32())),
+            ('intensities', pa.list_(pa.float32()))
+        ])
+        self.table = ParquetTableWriter(filename, schema, row_group_rows, compression)
+
+    def handle(self, topic, msg, t):
+        self.table.append((
+            t.to_nsec(),
+            msg.header.seq,
+            msg.header.stamp.secs,
+            msg.header.stamp.nsecs,
+            msg.angle_min,
+            msg.angle_max,
+            msg.angle_increment,
+            msg.time_increment,
+            msg.scan_time,
+            msg.range_min,
+            msg.range_max,
+            msg.ranges,
+            msg.intensities
+        ))
+
+    def close(self):
+        self.table.close()
+
+
+class GenericParquetHandler(TopicHandler):
+    """
+    Any other topic -> Parquet file with a rosbagTimestamp column (ns) followed by one typed
+    column per flattened message field (see rowExtractor). The schema comes from the first
+    message the pass delivers.
+    """
+
+    def __init__(self, filename, row_group_rows=DEFAULT_ROW_GROUP_ROWS, compression=DEFAULT_COMPRESSION):
+        if pa is None:
+            raise ImportError("pyarrow is required for Parquet output: pip install pyarrow")
+        self.filename = filename
+        self.row_group_rows = row_group_rows
+        self.compression = compression
+        self.extractor = None
+        self.table = None
+
+    def handle(self, topic, msg, t):
+        if self.extractor is None:
+            self.extractor = getRowExtractor(msg)
+            schema = pa.schema([('rosbagTimestamp', pa.int64())] + [(name, arrowType(sql_type)) for name, sql_type in self.extractor.columns])
+            self.table = ParquetTableWriter(self.filename, schema, self.row_group_rows, self.compression)
+        self.table.append((t.to_nsec(),) + self.extractor(msg))
+
+    def close(self):
+        if self.table is not None:
+            self.table.close()
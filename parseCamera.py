@@ -19,7 +19,15 @@ import os
 import numpy as np
 import datetime
 import cv2
+import metrics
 import parseUtilities
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from bagDemux import TopicHandler, demuxBag
+from checkpoint import openOutput
+from hashIndex import HashIndex
+from imagePack import ImagePackWriter
 
 class parseCamera:
 
@@ -56,10 +64,20 @@ class parseCamera:
 		================================================================================
 	'''
 
-	def __init__(self, folder,bag_file):
+	def __init__(self, folder,bag_file, workers=None, storage='files'):
 		self.folder = folder
 		self.bag_file = bag_file
+		# 'files': one image file per frame under <folder>/images/<camera>/xx/yy/
+		# 'pack': one append-only pack file per camera, <folder>/images/<camera>.pack (see imagePack.py)
+		self.storage = storage
 		# self.output_file_name = output_file_name
+		# decode/hash/write of frames runs on a pool of threads; cv2 and hashlib release the GIL
+		self.workers = workers or os.cpu_count() or 1
+		self.executor = None
+		# images already stored under <folder>/images, by this or an earlier run; made on first use,
+		# under the lock, since the camera worker threads all reach for it
+		self.hash_index = None
+		self.hash_index_lock = threading.Lock()
 
 		'''
 		============================= Method make_sure_path_exists() ====================================
@@ -89,17 +107,21 @@ class parseCamera:
 
 	def make_sure_path_exists(self, path):
 
-		try:
-			os.makedirs(path)
-		except OSError as exception:
-			pass
-			print('This folder already exists:', path)
+		# folders this process already made are remembered, so no syscall is repeated
+		self.getHashIndex().makedirs(path)
+
+	def getHashIndex(self):
+
+		with self.hash_index_lock:
+			if self.hash_index is None:
+				self.hash_index = HashIndex(self.folder + '/images')
+			return self.hash_index
 
 
 	def md5Image(self, img):
 
-		# img.tostring()
-		md5Image = hashlib.md5(img.tostring()).hexdigest()
+		# same bytes as img.tostring(), hashed straight from the array buffer without a copy
+		md5Image = hashlib.md5(np.ascontiguousarray(img)).hexdigest()
 
 		return md5Image
 
@@ -129,20 +151,56 @@ class parseCamera:
 
 	def saveMD5Image(self, image_topic,img):
 
-		md5_filename = self.md5Image(img)
-		print (md5_filename)
+		with metrics.timed('hash', image_topic):
+			md5_filename = self.md5Image(img)
 		# create folder according to hash valus of img
 		camera_sub_folder =  image_topic.replace("image_color/compressed","")
-		print (camera_sub_folder)
+		# the same content was already saved: skip both the mkdir and the write
+		stored_path = camera_sub_folder + md5_filename[0:2] + '/' + md5_filename[2:4] + '/' + md5_filename + '.jpg'
+		if self.getHashIndex().contains(stored_path):
+			return md5_filename
 		self.make_sure_path_exists(
 			self.folder + '/images/'+ camera_sub_folder + md5_filename[0:2] + '/' + md5_filename[2:4] + '/')
 		# create the file name using the hash value of img
 		filename = self.folder + '/images/' + camera_sub_folder + \
 			md5_filename[0:2] + '/' + md5_filename[2:4] + \
 			'/' + md5_filename + '.jpg'
-		print (filename)
 		# from 0 to 100 (the higher is the better). Default value is 95.
-		cv2.imwrite(filename, img, [int(cv2.IMWRITE_JPEG_QUALITY), 100])
+		with metrics.timed('encode', image_topic):
+			cv2.imwrite(filename, img, [int(cv2.IMWRITE_JPEG_QUALITY), 100])
+		self.getHashIndex().add(stored_path)
+
+		return md5_filename
+
+	'''
+		============================= Method saveMD5CompressedImage() ====================================
+		Method Purpose:
+			passthrough mode: save the compressed bytes of a CompressedImage (msg.data) as they
+			are, into the folder with the md5 hash of those bytes as filename. No decode, no
+			re-encode, and the file keeps the original size and quality.
+		Input Variable:
+			image_topic, data: msg.data, extension: '.jpg' or '.png' (from msg.format)
+
+		Output/Return:
+			md5 hash of data
+		================================================================================
+	'''
+
+	def saveMD5CompressedImage(self, image_topic, data, extension='.jpg'):
+
+		with metrics.timed('hash', image_topic):
+			md5_filename = hashlib.md5(data).hexdigest()
+		# create folder according to hash valus of the compressed bytes
+		camera_sub_folder =  image_topic.replace("image_color/compressed","")
+		stored_path = camera_sub_folder + md5_filename[0:2] + '/' + md5_filename[2:4] + '/' + md5_filename + extension
+		# the same content was already saved: skip both the mkdir and the write
+		if self.getHashIndex().contains(stored_path):
+			return md5_filename
+		sub_folder = self.folder + '/images/' + camera_sub_folder + md5_filename[0:2] + '/' + md5_filename[2:4] + '/'
+		self.make_sure_path_exists(sub_folder)
+		with metrics.timed('file write', image_topic), open(sub_folder + md5_filename + extension, 'wb') as image_file:
+			image_file.write(data)
+		self.getHashIndex().add(stored_path)
 
 		return md5_filename
 
@@ -186,7 +244,7 @@ class parseCamera:
 		#
 		#
 		# 	The follow methods are called:
-		#		parseUtilities.printProgress
+		#		parseCameras
 		#
 		# 	Author: Liming Gao
 		# 	Date: 02/05/2020
@@ -195,7 +253,7 @@ class parseCamera:
 
 	'''
 
-	def parseCamera(self, image_topic, output_file_name_images,rotate=False, angle=0):
+	def parseCamera(self, image_topic, output_file_name_images,rotate=False, angle=0, reencode=False):
 
 		# file = open(output_file_name_camera_info, "w")
 
@@ -221,17 +279,98 @@ class parseCamera:
 		# file.close()
 		#values=[bag_file_id,sensor_id, msg.K[0], msg.K[4], msg.K[2], msg.K[5], msg.K[1], msg.width, msg.height, msg.D[0], msg.D[1], msg.D[2], msg.D[3], msg.D[4]]
 
-		file = open(output_file_name_images, "w")
+		self.parseCameras({image_topic: output_file_name_images}, rotate, angle, reencode)
+
+	'''
+		============================= Method parseCameras() ====================================
+		#	Method Purpose:
+		#		parse several camera topics from one single read pass over the bag. Frames are
+		#		handed to the worker pool for decode/hash/write, and every camera's index file
+		#		is still written in frame order.
+		#
+		#	Input Variable:
+		#		outputs			{image_topic: output_file_name_images}
+		#		rotate, angle, reencode		see parseCameraMessage()
+		#
+		#	Output/Return:
+		#		None
+		================================================================================
+	'''
+
+	def parseCameras(self, outputs, rotate=False, angle=0, reencode=False):
+
+		demuxBag(self.bag_file, self.cameraHandlers(outputs, rotate, angle, reencode))
+		self.close()
 
-		number_of_messages = self.bag_file.get_message_count(topic_filters=image_topic)
+	def cameraHandlers(self, outputs, rotate=False, angle=0, reencode=False, offsets=None, counts=None, pack_suffix=''):
 
-		count = 0
-		for topic, msg, t in self.bag_file.read_messages(topics=[image_topic]):
+		# one CameraTopicHandler per camera, all sharing the worker pool; for bagDemux.demuxBag()
+		# offsets: {image_topic: index file offset}, counts: {image_topic: frames} of a resumed run (see checkpoint.py)
+		# pack_suffix: appended to the pack names, e.g. the time window of the run (see topicSelection)
+		if self.executor is None:
+			self.executor = ThreadPoolExecutor(max_workers=self.workers)
+		offsets = offsets or {}
+		counts = counts or {}
+		handlers = {}
+		for image_topic, output_file_name_images in outputs.items():
+			pack = None
+			if self.storage == 'pack':
+				pack = ImagePackWriter(self.folder + '/images', self.cameraName(image_topic) + pack_suffix, resume_count=counts.get(image_topic))
+			handlers[image_topic] = CameraTopicHandler(self, image_topic, output_file_name_images, rotate, angle, reencode, self.executor,
+														offset=offsets.get(image_topic), pack=pack)
+		return handlers
+
+	def cameraName(self, image_topic):
+
+		# '/front_center_camera/image_color/compressed' -> 'front_center_camera'
+		return image_topic.strip('/').split('/')[0]
+
+	def close(self):
+
+		if self.executor is not None:
+			self.executor.shutdown()
+			self.executor = None
+		with self.hash_index_lock:
+			if self.hash_index is not None:
+				self.hash_index.close()
+				self.hash_index = None
+
+	'''
+		============================= Method parseCameraMessage() ====================================
+		#	Method Purpose:
+		#		save and index one CompressedImage message, so the camera topics can be
+		#		parsed from the same single pass over the bag as every other topic (see bagDemux)
+		#
+		#		By default the compressed bytes are written as they are (saveMD5CompressedImage).
+		#		The image is only decoded, and re-encoded at JPEG quality 100 (saveMD5Image),
+		#		when it has to be rotated or reencode is True.
+		#
+		#	Input Variable:
+		#		image_topic, msg, file (open index file of the camera), rotate, angle, reencode
+		#
+		#	Output/Return:
+		#		md5 hash of the saved image
+		#
+		================================================================================
+	'''
+
+	def parseCameraMessage(self, image_topic, msg, file, rotate=False, angle=0, reencode=False):
+
+		md5_filename = self.saveFrame(image_topic, msg, rotate, angle, reencode)
+		self.writeIndexLine(file, msg.header, md5_filename)
+
+		return md5_filename
+
+	def saveFrame(self, image_topic, msg, rotate=False, angle=0, reencode=False):
+
+		# the CPU-heavy part of parseCameraMessage(): decode/hash/write, run on the worker pool
+		if rotate is True or reencode is True:
 			# This must be used for compressed images. CvBridge does not
 			# support compressed images.
 			# http://wiki.ros.org/rospy_tutorials/Tutorials/WritingImagePublisherSubscriber
-			np_arr = np.fromstring(msg.data, np.uint8)
-			img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+			np_arr = np.frombuffer(msg.data, np.uint8)
+			with metrics.timed('encode', image_topic):
+				img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
 
 			if rotate is True:
 				img = self.rotateImage(img, angle)
@@ -247,25 +386,118 @@ class parseCamera:
 			# img = cv2.undistort(img,K_left,D_left)
 
 			md5_filename = self.saveMD5Image(image_topic,img)
+		else:
+			extension = '.png' if 'png' in msg.format else '.jpg'
+			md5_filename = self.saveMD5CompressedImage(image_topic, msg.data, extension)
 
-			# print 'Saving image from ' + topic + ': ' + str(count + 1)
+		return md5_filename
 
-			parseUtilities.printProgress(count + 1, number_of_messages, prefix='Progress:', suffix='Complete', decimals=1, length=50)
+	def packFrame(self, image_topic, msg, rotate=False, angle=0, reencode=False):
 
-			time = repr(msg.header.stamp.secs + msg.header.stamp.nsecs * 10 ** (-9))
-			file.write(str(msg.header.seq))
-			file.write(',')
-			file.write(str(parseUtilities.unixTimeToTimeStamp(msg.header.stamp.secs)))
-			file.write(',')
-			file.write(str(msg.header.stamp.secs))
-			file.write(',')
-			file.write(str(msg.header.stamp.nsecs))
-			file.write(',')
-			file.write(time)
-			file.write(',')
-			file.write(str(md5_filename))
-			file.write('\n')
+		# pack mode counterpart of saveFrame(), run on the worker pool: hash (and re-encode if
+		# asked) only; the bytes are appended to the camera's pack in frame order by its handler
+		if rotate is True or reencode is True:
+			with metrics.timed('encode', image_topic):
+				img = cv2.imdecode(np.frombuffer(msg.data, np.uint8), cv2.IMREAD_COLOR)
+			if rotate is True:
+				img = self.rotateImage(img, angle)
+			with metrics.timed('hash', image_topic):
+				md5_filename = self.md5Image(img)
+			with metrics.timed('encode', image_topic):
+				data = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), 100])[1]
+			return md5_filename, data, 'jpeg'
+
+		with metrics.timed('hash', image_topic):
+			md5_filename = hashlib.md5(msg.data).hexdigest()
+		return md5_filename, msg.data, 'png' if 'png' in msg.format else 'jpeg'
+
+	def writeIndexLine(self, file, header, md5_filename):
+
+		time = repr(header.stamp.secs + header.stamp.nsecs * 10 ** (-9))
+		file.write(str(header.seq))
+		file.write(',')
+		file.write(str(parseUtilities.unixTimeToTimeStamp(header.stamp.secs)))
+		file.write(',')
+		file.write(str(header.stamp.secs))
+		file.write(',')
+		file.write(str(header.stamp.nsecs))
+		file.write(',')
+		file.write(time)
+		file.write(',')
+		file.write(str(md5_filename))
+		file.write('\n')
+
+
+class CameraTopicHandler(TopicHandler):
 
-			count += 1
+	'''
+		Per-topic handler for bagDemux.demuxBag(): owns the index file of one camera topic.
+
+		Without an executor every frame goes through parseCamera.parseCameraMessage() on the
+		reading thread. With one, parseCamera.saveFrame() runs on the pool while the bag keeps
+		being read; at most max_pending frames of the camera are in flight, and index lines are
+		written in frame order as the frames complete. Given a checkpoint offset, the index file
+		is resumed from it instead of being started over. Progress is reported by metrics.py,
+		not per frame.
+
+		Frames arrive as rawMessages views: msg.data is a memoryview of the serialized message,
+		hashed and written to the image file without being copied. With a pack (see
+		imagePack.py) the frames are appended to it instead, in frame order, by this handler.
+	'''
 
-		file.close()
+	raw_views = True
+
+	def __init__(self, parser, image_topic, output_file_name_images, rotate=False, angle=0, reencode=False, executor=None, max_pending=64, offset=None, pack=None):
+		self.parser = parser
+		self.pack = pack
+		self.image_topic = image_topic
+		self.rotate = rotate
+		self.angle = angle
+		self.reencode = reencode
+		self.executor = executor
+		self.max_pending = max_pending
+		self.pending = deque()
+		self.file = openOutput(output_file_name_images, offset)
+
+	def handle(self, topic, msg, t):
+		save = self.parser.saveFrame if self.pack is None else self.parser.packFrame
+		if self.executor is None:
+			self.store(msg.header, save(self.image_topic, msg, self.rotate, self.angle, self.reencode))
+			return
+
+		future = self.executor.submit(save, self.image_topic, msg, self.rotate, self.angle, self.reencode)
+		self.pending.append((msg.header, future))
+
+		# write whatever is finished at the head of the queue; block only when the queue is full
+		while self.pending and (self.pending[0][1].done() or len(self.pending) > self.max_pending):
+			self.writeOldest()
+
+	def writeOldest(self):
+		header, future = self.pending.popleft()
+		self.store(header, future.result())
+
+	def store(self, header, saved):
+		if self.pack is not None:
+			md5_filename, data, image_format = saved
+			with metrics.timed('file write', self.image_topic):
+				self.pack.append(data, md5_filename, header.stamp.secs, header.stamp.nsecs, image_format)
+			saved = md5_filename
+		self.parser.writeIndexLine(self.file, header, saved)
+
+	def sync(self):
+		# a checkpoint covers every frame handed over so far: wait for the ones in flight
+		while self.pending:
+			self.writeOldest()
+		if self.pack is not None:
+			self.pack.sync()
+		self.file.flush()
+		return self.file.tell()
+
+	def close(self):
+		try:
+			while self.pending:
+				self.writeOldest()
+		finally:
+			if self.pack is not None:
+				self.pack.close()
+			self.file.close()
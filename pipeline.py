@@ -0,0 +1,281 @@
+'''
+Staged producer/consumer pipeline for one pass over a bag.
+
+    reader      thread: bag.read_messages(raw=True) -- chunk decompression
+        |  StageQueue 'read' (serialized messages)
+    transform   calling thread: deserialize, topic handlers, row building, BatchedWriter
+        |  StageQueue 'write' (sink operations: batches, statements, commits)
+    writer      thread: the blocking database round trips of a QueuedSink
+
+Decompression, parsing and round trips to the database overlap instead of adding up. The
+queues are bounded by a number of items and by a memory ceiling in bytes, so a fast stage
+blocks (backpressure) instead of buffering the whole bag. Each queue records how full it
+was and how long its producer and consumer waited on it, which shows the bottleneck:
+
+    read:  depth avg 1021/1024 ... producer blocked 41.2 s   -> the transform stage is slowest
+    write: depth avg 0.3/16 ... consumer starved 44.0 s      -> the database keeps up
+
+BatchedWriter stays on the transform thread, so a commit and its checkpoint hooks still
+cover exactly the rows handed over before them; only the sink calls move to the writer
+thread, and run there in the order they were issued.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import threading
+import time
+from collections import deque
+import metrics
+from bagDemux import deserializeRaw, toRosTime
+
+_END = object()
+
+
+class StageQueue:
+    """Bounded FIFO between two stages, limited by item count and by total bytes."""
+
+    def __init__(self, name, max_items, max_bytes=None):
+        self.name = name
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.items = deque()
+        self.bytes = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        # occupancy metrics
+        self.puts = 0
+        self.depth_sum = 0
+        self.max_depth = 0
+        self.max_bytes_seen = 0
+        self.producer_blocked_seconds = 0.0
+        self.consumer_starved_seconds = 0.0
+
+    def put(self, item, size=0):
+        with self.condition:
+            if self._full(size):
+                blocked_start = time.time()
+                while self._full(size) and not self.closed:
+                    self.condition.wait()
+                self.producer_blocked_seconds += time.time() - blocked_start
+            if self.closed:
+                raise PipelineClosed(self.name)
+            self.items.append((item, size))
+            self.bytes += size
+            self.puts += 1
+            self.depth_sum += len(self.items)
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.max_bytes_seen = max(self.max_bytes_seen, self.bytes)
+            self.condition.notify_all()
+
+    def _full(self, size):
+        # an item larger than the ceiling still goes through once the queue is empty
+        if not self.items:
+            return False
+        return len(self.items) >= self.max_items or (self.max_bytes is not None and self.bytes + size > self.max_bytes)
+
+    def get(self):
+        with self.condition:
+            if not self.items:
+                starved_start = time.time()
+                while not self.items and not self.closed:
+                    self.condition.wait()
+                self.consumer_starved_seconds += time.time() - starved_start
+            if not self.items:
+                raise PipelineClosed(self.name)
+            item, size = self.items.popleft()
+            self.bytes -= size
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        """Wake and stop both sides, e.g. when the other stage failed."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def report(self):
+        average_depth = self.depth_sum / self.puts if self.puts else 0.0
+        return (f"{self.name}: {self.puts} items, depth avg {average_depth:.1f}/{self.max_items} max {self.max_depth}, "
+                f"peak {self.max_bytes_seen / 1e6:.1f} MB, producer blocked {self.producer_blocked_seconds:.1f} s, "
+                f"consumer starved {self.consumer_starved_seconds:.1f} s")
+
+
+class PipelineClosed(Exception):
+    """A stage queue was closed while a stage was waiting on it."""
+
+
+class QueuedSink:
+    """
+    dbSink.DatabaseSink stand-in that runs the wrapped sink's calls on a writer thread.
+
+    Writes (execute, create_table, insert_many, commit) are queued in order; query() and
+    close() wait for the queue to drain first. An error on the writer thread is raised by
+    the next call made on the transform thread.
+    """
+
+    def __init__(self, sink, max_items=16, max_bytes=None):
+        self.sink = sink
+        self.name = sink.name
+        self.queue = StageQueue('write', max_items, max_bytes)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='sink writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                operation = self.queue.get()
+            except PipelineClosed:
+                return
+            if operation is _END:
+                return
+            try:
+                operation()
+            except BaseException as e:
+                self.error = e
+                self.queue.close()
+                return
+
+    def _submit(self, operation, size=0):
+        self._raiseError()
+        try:
+            self.queue.put(operation, size)
+        except PipelineClosed:
+            self._raiseError()
+            raise
+
+    def _raiseError(self):
+        if self.error is not None:
+            raise self.error
+
+    def drain(self):
+        """Wait until every queued call has run."""
+        done = threading.Event()
+        self._submit(done.set)
+        while not done.wait(0.1):
+            if not self.thread.is_alive():
+                break
+        self._raiseError()
+
+    def cursor(self):
+        return self.sink.cursor()
+
+    def column_type(self, sql_type):
+        return self.sink.column_type(sql_type)
+
+    def prepare_insert(self, table_name, column_names=None, number_of_columns=None):
+        return self.sink.prepare_insert(table_name, column_names, number_of_columns)
+
+    def create_table(self, cursor, table_name, columns, if_not_exists=False):
+        self._submit(lambda: self.sink.create_table(cursor, table_name, columns, if_not_exists=if_not_exists))
+
+    def execute(self, cursor, sql, params=()):
+        self._submit(lambda: self.sink.execute(cursor, sql, params))
+
+    def query(self, cursor, sql, params=()):
+        self.drain()
+        return self.sink.query(cursor, sql, params)
+
+    def list_tables(self, cursor):
+        self.drain()
+        return self.sink.list_tables(cursor)
+
+    def table_columns(self, cursor, table_name):
+        self.drain()
+        return self.sink.table_columns(cursor, table_name)
+
+    def create_index(self, cursor, table_name, index_name, columns, clustered=False, unique=False, partition=None):
+        self._submit(lambda: self.sink.create_index(cursor, table_name, index_name, columns, clustered, unique, partition))
+
+    def drop_index(self, cursor, table_name, index_name):
+        self._submit(lambda: self.sink.drop_index(cursor, table_name, index_name))
+
+    def insert_many(self, cursor, statement, rows):
+        self._submit(lambda: self.sink.insert_many(cursor, statement, rows), estimateRowsBytes(rows))
+
+    def commit(self, final=False):
+        self._submit(lambda: self.sink.commit(final))
+
+    def detach(self):
+        """Finish every queued call and stop the writer thread; the wrapped sink stays open."""
+        if self.thread.is_alive():
+            self._submit(_END)
+            self.thread.join()
+        self._raiseError()
+
+    def close(self):
+        self.detach()
+        self.sink.close()
+
+    def report(self):
+        return self.queue.report()
+
+
+def estimateRowsBytes(rows):
+    """Rough size of a batch, from its first row: strings/bytes by length, other values 8 bytes."""
+    if not rows:
+        return 0
+    first_row = rows[0]
+    row_bytes = sum(len(value) if isinstance(value, (str, bytes)) else 8 for value in first_row)
+    return row_bytes * len(rows)
+
+
+def pipelinedDemuxBag(bag, handlers, start_time=None, checkpoint=None, end_time=None, max_items=1024, max_bytes=None):
+    """
+    bagDemux.demuxBag() with the bag read on a reader thread, `max_items` messages and
+    `max_bytes` serialized bytes ahead of the handlers at most. Returns the read StageQueue,
+    for its report().
+    """
+    read_queue = StageQueue('read', max_items, max_bytes)
+    if not handlers:
+        return read_queue
+
+    reader_error = []
+    recorder = metrics.current()
+    recorder.expectMessages(bag.get_message_count(topic_filters=list(handlers)))
+
+    def read():
+        try:
+            read_start = time.perf_counter()
+            for topic, raw, t in bag.read_messages(topics=list(handlers),
+                                                   start_time=toRosTime(start_time) if start_time is not None else None,
+                                                   end_time=toRosTime(end_time) if end_time is not None else None, raw=True):
+                recorder.add('read', time.perf_counter() - read_start, topic)
+                read_queue.put((topic, raw, t), len(raw[1]))
+                read_start = time.perf_counter()
+            read_queue.put(_END)
+        except PipelineClosed:
+            pass
+        except BaseException as e:
+            reader_error.append(e)
+            read_queue.close()
+
+    reader = threading.Thread(target=read, name='bag reader', daemon=True)
+    reader.start()
+    try:
+        while True:
+            try:
+                item = read_queue.get()
+            except PipelineClosed:
+                break
+            if item is _END:
+                break
+            topic, (datatype, data, md5sum, position, pytype), t = item
+            deserialize_start = time.perf_counter()
+            msg = deserializeRaw(handlers[topic], datatype, data, pytype)
+            handle_start = time.perf_counter()
+            handlers[topic].handle(topic, msg, t)
+            handle_end = time.perf_counter()
+            recorder.add('deserialize', handle_start - deserialize_start, topic)
+            recorder.add('transform', handle_end - handle_start, topic)
+            recorder.count(topic, len(data))
+            if checkpoint is not None:
+                checkpoint.tick()
+        if reader_error:
+            raise reader_error[0]
+    finally:
+        read_queue.close()
+        reader.join()
+        for handler in handlers.values():
+            handler.close()
+    return read_queue
@@ -0,0 +1,66 @@
+'''
+Vectorized decoding of sensor_msgs/PointCloud2 payloads (/velodyne_points).
+
+The layout of a cloud (fields, point_step, is_bigendian) becomes a NumPy structured dtype
+once, cached for every later cloud with the same layout, and np.frombuffer() turns
+msg.data into an array of points over the message's own bytes: no Python loop over the
+points, and no copy unless rows are padded (row_step > width * point_step).
+
+    points = cloudPoints(msg)
+    points['x'], points['y'], points['z'], points['intensity'], points['ring']
+
+The handlers store the records as they are in scan shards (see scanShard.py), so a cloud
+costs one write of its payload, and ScanShardReader serves it back with the same fields.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import numpy as np
+
+# sensor_msgs/PointField datatype -> NumPy type
+POINT_FIELD_TYPES = {
+    1: 'i1',    # INT8
+    2: 'u1',    # UINT8
+    3: 'i2',    # INT16
+    4: 'u2',    # UINT16
+    5: 'i4',    # INT32
+    6: 'u4',    # UINT32
+    7: 'f4',    # FLOAT32
+    8: 'f8',    # FLOAT64
+}
+
+_DTYPES = {}
+
+
+def cloudDtype(fields, point_step, is_bigendian=False):
+    """Structured dtype of one point (itemsize point_step, padding included), cached per layout."""
+    key = (tuple((field.name, field.offset, field.datatype, field.count) for field in fields), point_step, bool(is_bigendian))
+    dtype = _DTYPES.get(key)
+    if dtype is None:
+        byte_order = '>' if is_bigendian else '<'
+        names, formats, offsets = [], [], []
+        for field in fields:
+            if field.datatype not in POINT_FIELD_TYPES:
+                raise ValueError(f"Unknown PointField datatype {field.datatype} of field {field.name}")
+            base = byte_order + POINT_FIELD_TYPES[field.datatype]
+            names.append(field.name)
+            formats.append(base if field.count == 1 else (base, field.count))
+            offsets.append(field.offset)
+        dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': point_step})
+        _DTYPES[key] = dtype
+    return dtype
+
+
+def cloudPoints(msg):
+    """1-D structured array of the points of a PointCloud2 (genpy message or raw view)."""
+    dtype = cloudDtype(msg.fields, msg.point_step, msg.is_bigendian)
+    if msg.height <= 1 or msg.row_step == msg.width * msg.point_step:
+        return np.frombuffer(msg.data, dtype=dtype, count=msg.width * msg.height)
+    # padded rows: step over the padding, then gather the points into one array
+    rows = np.ndarray((msg.height, msg.width), dtype=dtype, buffer=msg.data, strides=(msg.row_step, msg.point_step))
+    return rows.reshape(-1)
+
+
+def fieldLayout(fields):
+    """Text form of the fields of a cloud: name:offset:datatype:count,..."""
+    return ','.join(f"{field.name}:{field.offset}:{field.datatype}:{field.count}" for field in fields)
@@ -0,0 +1,185 @@
+'''
+Zero-copy views of serialized blob messages, for bag.read_messages(raw=True).
+
+Camera frames, velodyne packets and point clouds are the highest-bandwidth topics, and
+their handlers only need the header, a few fields and the payload bytes. Deserializing
+them with genpy builds a Python object per message and copies the payload out of the
+serialized buffer. The views below read the header fields with struct.unpack_from and
+expose the payload as a memoryview slice of that buffer, which hashlib, file.write() and
+np.frombuffer() take as it is, so the payload is never copied:
+
+    view = RAW_VIEWS['sensor_msgs/CompressedImage'](data)
+    view.header.stamp.secs, view.format, hashlib.md5(view.data)
+
+A view has the attributes of the genpy message the handlers use (header.seq, header.stamp
+secs/nsecs, format/encoding, data), but data is a memoryview instead of bytes.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import struct
+
+_UINT32 = struct.Struct('<I')
+_HEADER = struct.Struct('<III')
+_IMAGE_SIZE = struct.Struct('<II')
+_IMAGE_STEP = struct.Struct('<BI')
+_STAMP = struct.Struct('<II')
+_CLOUD_SIZE = struct.Struct('<III')
+_POINT_FIELD = struct.Struct('<IBI')
+_CLOUD_STEP = struct.Struct('<BII')
+VELODYNE_PACKET_SIZE = 1206
+
+
+class RawTime:
+    """genpy.Time stand-in of a header stamp."""
+
+    __slots__ = ('secs', 'nsecs')
+
+    def __init__(self, secs, nsecs):
+        self.secs = secs
+        self.nsecs = nsecs
+
+    def to_nsec(self):
+        return self.secs * 1000000000 + self.nsecs
+
+    def to_sec(self):
+        return self.secs + self.nsecs * 1e-9
+
+
+class RawHeader:
+    __slots__ = ('seq', 'stamp', 'frame_id')
+
+    def __init__(self, seq, stamp, frame_id):
+        self.seq = seq
+        self.stamp = stamp
+        self.frame_id = frame_id
+
+
+class CompressedImageView:
+    """sensor_msgs/CompressedImage: header, string format, uint8[] data."""
+
+    __slots__ = ('header', 'format', 'data')
+
+    def __init__(self, data):
+        buffer = memoryview(data)
+        self.header, offset = readHeader(buffer, 0)
+        self.format, offset = readString(buffer, offset)
+        self.data, offset = readBytes(buffer, offset)
+
+
+class ImageView:
+    """sensor_msgs/Image: header, height, width, string encoding, is_bigendian, step, uint8[] data."""
+
+    __slots__ = ('header', 'height', 'width', 'encoding', 'is_bigendian', 'step', 'data')
+
+    def __init__(self, data):
+        buffer = memoryview(data)
+        self.header, offset = readHeader(buffer, 0)
+        self.height, self.width = _IMAGE_SIZE.unpack_from(buffer, offset)
+        self.encoding, offset = readString(buffer, offset + _IMAGE_SIZE.size)
+        self.is_bigendian, self.step = _IMAGE_STEP.unpack_from(buffer, offset)
+        self.data, offset = readBytes(buffer, offset + _IMAGE_STEP.size)
+
+
+class VelodynePacketView:
+    __slots__ = ('stamp', 'data')
+
+    def __init__(self, stamp, data):
+        self.stamp = stamp
+        self.data = data
+
+
+class VelodyneScanView:
+    """
+    velodyne_msgs/VelodyneScan: header, VelodynePacket[] packets (time stamp, uint8[1206] data).
+
+    Only the header is read up front; packets are sliced out when asked for. serialized is
+    the message buffer as it came from the bag, e.g. to send the scan to another process.
+    """
+
+    __slots__ = ('header', 'serialized', '_buffer', '_packets_offset')
+
+    def __init__(self, data):
+        self.serialized = data
+        self._buffer = memoryview(data)
+        self.header, self._packets_offset = readHeader(self._buffer, 0)
+
+    @property
+    def packets(self):
+        buffer = self._buffer
+        number_of_packets, = _UINT32.unpack_from(buffer, self._packets_offset)
+        offset = self._packets_offset + _UINT32.size
+        if offset + number_of_packets * (_STAMP.size + VELODYNE_PACKET_SIZE) > len(buffer):
+            raise ValueError(f"Truncated message: {number_of_packets} packets announced in {len(buffer)} bytes")
+        packets = []
+        for i in range(number_of_packets):
+            stamp = RawTime(*_STAMP.unpack_from(buffer, offset))
+            offset += _STAMP.size
+            packets.append(VelodynePacketView(stamp, buffer[offset:offset + VELODYNE_PACKET_SIZE]))
+            offset += VELODYNE_PACKET_SIZE
+        return packets
+
+
+class PointFieldView:
+    __slots__ = ('name', 'offset', 'datatype', 'count')
+
+    def __init__(self, name, offset, datatype, count):
+        self.name = name
+        self.offset = offset
+        self.datatype = datatype
+        self.count = count
+
+
+class PointCloud2View:
+    """
+    sensor_msgs/PointCloud2: header, height, width, PointField[] fields, is_bigendian,
+    point_step, row_step, uint8[] data, is_dense.
+    """
+
+    __slots__ = ('header', 'height', 'width', 'fields', 'is_bigendian', 'point_step', 'row_step', 'data', 'is_dense')
+
+    def __init__(self, data):
+        buffer = memoryview(data)
+        self.header, offset = readHeader(buffer, 0)
+        self.height, self.width, number_of_fields = _CLOUD_SIZE.unpack_from(buffer, offset)
+        offset += _CLOUD_SIZE.size
+        self.fields = []
+        for i in range(number_of_fields):
+            name, offset = readString(buffer, offset)
+            field_offset, datatype, count = _POINT_FIELD.unpack_from(buffer, offset)
+            offset += _POINT_FIELD.size
+            self.fields.append(PointFieldView(name, field_offset, datatype, count))
+        is_bigendian, self.point_step, self.row_step = _CLOUD_STEP.unpack_from(buffer, offset)
+        self.is_bigendian = bool(is_bigendian)
+        self.data, offset = readBytes(buffer, offset + _CLOUD_STEP.size)
+        self.is_dense = bool(buffer[offset])
+
+
+def readBytes(buffer, offset):
+    """uint8[] at offset -> (memoryview slice of buffer, offset after it)."""
+    length, = _UINT32.unpack_from(buffer, offset)
+    start = offset + _UINT32.size
+    if start + length > len(buffer):
+        raise ValueError(f"Truncated message: {length} bytes announced at offset {offset} of {len(buffer)}")
+    return buffer[start:start + length], start + length
+
+
+def readString(buffer, offset):
+    value, offset = readBytes(buffer, offset)
+    return str(value, 'utf-8'), offset
+
+
+def readHeader(buffer, offset):
+    """std_msgs/Header at offset -> (RawHeader, offset after it)."""
+    seq, secs, nsecs = _HEADER.unpack_from(buffer, offset)
+    frame_id, offset = readString(buffer, offset + _HEADER.size)
+    return RawHeader(seq, RawTime(secs, nsecs), frame_id), offset
+
+
+# message type -> view class, for the handlers that take views (TopicHandler.raw_views)
+RAW_VIEWS = {
+    'sensor_msgs/CompressedImage': CompressedImageView,
+    'sensor_msgs/Image': ImageView,
+    'velodyne_msgs/VelodyneScan': VelodyneScanView,
+    'sensor_msgs/PointCloud2': PointCloud2View,
+}
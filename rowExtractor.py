@@ -0,0 +1,178 @@
+'''
+Typed row extraction for generic ROS topics.
+
+Instead of formatting every message as YAML with str(msg) and splitting the text on '\\n'
+and ':', the layout of a message type is read once from the genpy __slots__/_slot_types,
+flattened into typed columns (nested messages become header_stamp_secs, ...), and
+compiled into one function that returns the row of a message as a tuple. Extractors are
+cached by the type's _md5sum, so every bag processed by the same process reuses them.
+
+    extractor = getRowExtractor(msg)
+    extractor.columns       # [('header_seq', 'BIGINT'), ('header_stamp_secs', 'BIGINT'), ...]
+    extractor(msg)          # (4711, 1571431170, ...)
+
+Numeric arrays that are not expanded into columns (variable-length, or longer than
+MAX_EXPANDED_ARRAY_LENGTH) are packed little-endian into one VARBINARY(MAX) column, read
+back with np.frombuffer(blob, extractor.array_dtypes[column]). Fixed-size arrays of
+messages are flattened element by element (poses_0_position_x, ...). Arrays with no fixed
+column layout (variable-length arrays of messages, time[] and duration[]) are stored as JSON
+text, one column each, listed in extractor.json_columns and reported once per message type.
+uint64 values, which do not fit a BIGINT, go to DECIMAL(20,0) columns as decimal.Decimal.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import json
+from decimal import Decimal
+
+import numpy as np
+
+# ROS primitive type -> column type (SQL Server dialect, translated by the dbSink backends)
+PRIMITIVE_COLUMN_TYPES = {
+    'bool': 'INT',
+    'int8': 'INT',
+    'byte': 'INT',
+    'uint8': 'INT',
+    'char': 'INT',
+    'int16': 'INT',
+    'uint16': 'INT',
+    'int32': 'INT',
+    'uint32': 'BIGINT',
+    'int64': 'BIGINT',
+    'uint64': 'DECIMAL(20,0)',
+    'float32': 'FLOAT',
+    'float64': 'FLOAT',
+    'string': 'NVARCHAR(MAX)',
+}
+
+# ROS primitive type -> little-endian NumPy dtype of its packed arrays
+ARRAY_DTYPES = {
+    'bool': 'u1',
+    'int8': 'i1',
+    'byte': 'i1',
+    'int16': '<i2',
+    'uint16': '<u2',
+    'int32': '<i4',
+    'uint32': '<u4',
+    'int64': '<i8',
+    'uint64': '<u8',
+    'float32': '<f4',
+    'float64': '<f8',
+}
+
+# Columns of a row are flattened up to this many elements of a fixed-size array
+MAX_EXPANDED_ARRAY_LENGTH = 64
+
+_EXTRACTORS = {}
+
+
+class RowExtractor:
+    """Compiled column layout of one message type."""
+
+    def __init__(self, msg_type, columns, expressions, array_dtypes, json_columns):
+        self.msg_type = msg_type
+        self.columns = columns
+        self.column_names = [col[0] for col in columns]
+        # column -> dtype of the numeric arrays packed into blobs
+        self.array_dtypes = array_dtypes
+        # columns holding arrays with no fixed column layout, as JSON text
+        self.json_columns = json_columns
+        source = "def extract(msg):\n    return (" + "".join(expr + ", " for expr in expressions) + ")\n"
+        namespace = {'_joinValues': _joinValues, '_packArray': _packArray, '_toJson': _toJson, 'Decimal': Decimal}
+        exec(compile(source, f"<row extractor {msg_type}>", 'exec'), namespace)
+        self.extract = namespace['extract']
+
+    def __call__(self, msg):
+        return self.extract(msg)
+
+
+def _joinValues(values):
+    return ','.join(map(str, values))
+
+
+def _packArray(values, dtype):
+    return np.asarray(values, dtype=dtype).tobytes()
+
+
+def _plain(value):
+    """Messages (and genpy times) as dicts of their slots, arrays as lists, bytes as hex."""
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if hasattr(value, '__slots__') and not isinstance(value, (int, float, str)):
+        return {slot: _plain(getattr(value, slot)) for slot in value.__slots__}
+    return value
+
+
+def _toJson(value):
+    return json.dumps(_plain(value), separators=(',', ':'))
+
+
+def _scalar(slot_type, value_expression):
+    # uint64 may exceed a signed 64-bit integer
+    return f"Decimal({value_expression})" if slot_type == 'uint64' else value_expression
+
+
+def _flatten(msg, prefix, expression, columns, expressions, array_dtypes, json_columns):
+    """Append the (column, expression) pairs of msg's slots, recursing into nested messages."""
+    for slot, slot_type in zip(msg.__slots__, msg._slot_types):
+        name = prefix + slot
+        value_expression = f"{expression}.{slot}"
+        value = getattr(msg, slot)
+
+        if slot_type in PRIMITIVE_COLUMN_TYPES:
+            columns.append((name, PRIMITIVE_COLUMN_TYPES[slot_type]))
+            expressions.append(_scalar(slot_type, value_expression))
+
+        elif slot_type in ('time', 'duration'):
+            columns.append((name + '_secs', 'BIGINT'))
+            expressions.append(value_expression + '.secs')
+            columns.append((name + '_nsecs', 'BIGINT'))
+            expressions.append(value_expression + '.nsecs')
+
+        elif slot_type.endswith(']'):
+            element_type, length = slot_type[:-1].split('[')
+            if element_type in ('uint8', 'char'):
+                # uint8[] is a byte string in genpy
+                columns.append((name, 'VARBINARY(MAX)'))
+                expressions.append(f"bytes({value_expression})")
+            elif length and element_type in PRIMITIVE_COLUMN_TYPES and int(length) <= MAX_EXPANDED_ARRAY_LENGTH:
+                for i in range(int(length)):
+                    columns.append((f"{name}_{i}", PRIMITIVE_COLUMN_TYPES[element_type]))
+                    expressions.append(_scalar(element_type, f"{value_expression}[{i}]"))
+            elif element_type in ARRAY_DTYPES:
+                columns.append((name, 'VARBINARY(MAX)'))
+                expressions.append(f"_packArray({value_expression}, '{ARRAY_DTYPES[element_type]}')")
+                array_dtypes[name] = ARRAY_DTYPES[element_type]
+            elif element_type == 'string':
+                # string arrays keep one comma-separated text column
+                columns.append((name, 'NVARCHAR(MAX)'))
+                expressions.append(f"_joinValues({value_expression})")
+            elif length and int(length) <= MAX_EXPANDED_ARRAY_LENGTH and element_type not in ('time', 'duration'):
+                for i in range(int(length)):
+                    _flatten(value[i], f"{name}_{i}_", f"{value_expression}[{i}]", columns, expressions, array_dtypes, json_columns)
+            else:
+                # variable-length or longer arrays of messages, time[] and duration[]
+                columns.append((name, 'NVARCHAR(MAX)'))
+                expressions.append(f"_toJson({value_expression})")
+                json_columns.append(name)
+
+        else:
+            _flatten(value, name + '_', value_expression, columns, expressions, array_dtypes, json_columns)
+
+
+def getRowExtractor(msg):
+    """Return the cached RowExtractor of msg's type, compiling it from msg on first use."""
+    extractor = _EXTRACTORS.get(msg._md5sum)
+    if extractor is None:
+        columns = []
+        expressions = []
+        array_dtypes = {}
+        json_columns = []
+        _flatten(msg, '', 'msg', columns, expressions, array_dtypes, json_columns)
+        extractor = RowExtractor(msg._type, columns, expressions, array_dtypes, json_columns)
+        if json_columns:
+            print(f"{msg._type}: no column layout for {', '.join(json_columns)}; stored as JSON text")
+        _EXTRACTORS[msg._md5sum] = extractor
+    return extractor
@@ -0,0 +1,71 @@
+'''
+Packed binary storage for LaserScan ranges and intensities.
+
+Instead of formatting every beam with str() and joining the scan into comma-separated text,
+the arrays are packed with NumPy into one blob each:
+
+    float32     little-endian float32, 4 bytes per beam; np.frombuffer(blob, '<f4') reads it
+    delta       quantized to multiples of `step` (default 1 mm), delta-encoded and zlib
+                compressed; non-finite values (no return: inf, nan) are kept exactly
+
+    blob = packScanArray(msg.ranges, 'delta')
+    ranges = unpackScanArray(blob, 'delta')         # float32 array
+
+Blobs go to VARBINARY(MAX) columns in the database and are written as hex in text files;
+unpackScanArray() accepts either. The round trips are checked in tests/test_scanArrays.py.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import struct
+import zlib
+import numpy as np
+
+SCAN_ARRAY_ENCODINGS = ('float32', 'delta')
+
+DEFAULT_QUANTIZATION_STEP = 0.001
+
+# Quantized values reserved for the non-finite floats of the delta encoding
+_NAN = np.iinfo(np.int32).min
+_NEG_INF = _NAN + 1
+_POS_INF = np.iinfo(np.int32).max
+_QUANTIZED_MIN = _NEG_INF + 1
+_QUANTIZED_MAX = _POS_INF - 1
+
+_STEP = struct.Struct('<d')
+
+
+def packScanArray(values, encoding='float32', step=DEFAULT_QUANTIZATION_STEP):
+    """Pack a sequence of floats into a blob of the given encoding."""
+    values = np.asarray(values, dtype='<f4')
+    if encoding == 'float32':
+        return values.tobytes()
+    if encoding == 'delta':
+        quantized = np.clip(np.rint(values.astype(np.float64) / step), _QUANTIZED_MIN, _QUANTIZED_MAX)
+        quantized = np.where(np.isfinite(values), quantized, _NAN)
+        quantized[values == np.inf] = _POS_INF
+        quantized[values == -np.inf] = _NEG_INF
+        quantized = quantized.astype('<i4')
+        # int32 differences wrap around, and so does the cumulative sum that undoes them
+        deltas = np.diff(quantized, prepend=np.int32(0)).astype('<i4')
+        return _STEP.pack(step) + zlib.compress(deltas.tobytes())
+    raise ValueError(f"Unknown scan array encoding: {encoding}")
+
+
+def unpackScanArray(blob, encoding='float32'):
+    """Decode a blob (bytes, or its hex string from a text file) back into a float32 array."""
+    if isinstance(blob, str):
+        blob = bytes.fromhex(blob)
+    if encoding == 'float32':
+        return np.frombuffer(blob, dtype='<f4')
+    if encoding == 'delta':
+        step, = _STEP.unpack_from(blob)
+        deltas = np.frombuffer(zlib.decompress(blob[_STEP.size:]), dtype='<i4')
+        quantized = np.cumsum(deltas, dtype=np.int32)
+        values = (quantized * step).astype(np.float32)
+        values[quantized == _NAN] = np.nan
+        values[quantized == _POS_INF] = np.inf
+        values[quantized == _NEG_INF] = -np.inf
+        return values
+    raise ValueError(f"Unknown scan array encoding: {encoding}")
+
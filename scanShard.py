@@ -0,0 +1,223 @@
+'''
+Binary, memory-mappable shard storage for point-cloud scans.
+
+Instead of one np.savetxt text file per scan under velodyne_pointcloud/xx/yy/<md5>.txt,
+the raw bytes of every scan are appended to one shard file per bag (or per scans_per_shard
+scans), and each scan gets one line in a text index. A scan whose md5 was already stored
+is not appended again; its index line points at the first copy.
+
+    velodyne_pointcloud/scans_0000.bin      raw scan bytes, back to back
+    velodyne_pointcloud/scans.idx           count,secs,nsecs,md5,shard,offset,rows,cols,dtype
+
+A scan is a 2-D array (rows x cols of one dtype), or a 1-D structured array of records
+(e.g. PointCloud2 points, see pointClouds.py), stored as they are with cols 1 and the record
+layout in dtype (see dtypeToken).
+
+ScanShardReader serves any scan as a zero-copy np.memmap view, by position, md5 or time.
+A writer created with resume_count keeps the first resume_count scans of an earlier run
+(e.g. up to a checkpoint, see checkpoint.py) and cuts off whatever was written after them.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import bisect
+import hashlib
+import os
+import numpy as np
+
+INDEX_HEADER = 'count,secs,nsecs,md5,shard,offset,rows,cols,dtype\n'
+
+
+class ScanShardWriter:
+    """
+    Append scans to <folder>/<name>_NNNN.bin and index them in <folder>/<name>.idx.
+
+    scans_per_shard: start a new shard file every N scans; None keeps one shard per writer.
+    resume_count: keep the first resume_count scans already in the folder and append after them.
+    """
+
+    def __init__(self, folder, name='scans', scans_per_shard=None, resume_count=None):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.name = name
+        self.scans_per_shard = scans_per_shard
+        self.shard_number = -1
+        self.shard_file = None
+        self.shard_name = None
+        self.offset = 0
+        self.count = 0
+        # md5 -> (shard, offset) of the scans already stored; repeated scans are not appended again
+        self.stored = {}
+        index_path = os.path.join(folder, name + '.idx')
+        if resume_count and os.path.exists(index_path):
+            self._resume(index_path, resume_count)
+        else:
+            self.index_file = open(index_path, 'w')
+            self.index_file.write(INDEX_HEADER)
+
+    def _resume(self, index_path, resume_count):
+        """Reopen the index and last shard, truncated right after scan number resume_count - 1."""
+        self.index_file = open(index_path, 'r+')
+        self.index_file.readline()
+        entries = []
+        while len(entries) < resume_count:
+            line = self.index_file.readline()
+            if not line.strip():
+                break
+            entries.append(ScanEntry(line))
+        end_of_kept = self.index_file.tell()
+        self.index_file.truncate(end_of_kept)
+        self.index_file.seek(end_of_kept)
+        self.count = len(entries)
+
+        shard_ends = {}
+        for entry in entries:
+            self.stored.setdefault(entry.md5, (entry.shard, entry.offset))
+            end = entry.offset + entry.rows * entry.cols * entry.dtype.itemsize
+            shard_ends[entry.shard] = max(shard_ends.get(entry.shard, 0), end)
+        if entries:
+            # the last line may point back at a scan stored in an older shard: append to the newest one
+            self.shard_name = max(shard_ends, key=self._shardNumber)
+            self.shard_number = self._shardNumber(self.shard_name)
+            self.offset = shard_ends[self.shard_name]
+            self.shard_file = open(os.path.join(self.folder, self.shard_name), 'r+b')
+            self.shard_file.truncate(self.offset)
+            self.shard_file.seek(self.offset)
+
+    def _shardNumber(self, shard_name):
+        return int(shard_name[len(self.name) + 1:-len('.bin')])
+
+    def _nextShard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.shard_number += 1
+        self.shard_name = f"{self.name}_{self.shard_number:04d}.bin"
+        self.shard_file = open(os.path.join(self.folder, self.shard_name), 'wb')
+        self.offset = 0
+
+    def append(self, points, secs, nsecs):
+        """Store one scan (2-D array, or 1-D structured array) and return (md5, shard file name, byte offset)."""
+        if self.shard_file is None or (self.scans_per_shard and self.count % self.scans_per_shard == 0):
+            self._nextShard()
+
+        points = np.ascontiguousarray(points)
+        if points.dtype.names is not None:
+            points = points.reshape(-1, 1)
+        elif points.ndim == 1:
+            points = points.reshape(1, -1)
+        md5_scan = hashlib.md5(points).hexdigest()
+        if md5_scan in self.stored:
+            shard_name, offset = self.stored[md5_scan]
+        else:
+            shard_name, offset = self.shard_name, self.offset
+            self.shard_file.write(points.data)
+            self.offset += points.nbytes
+            self.stored[md5_scan] = (shard_name, offset)
+        self.index_file.write(f"{self.count},{secs},{nsecs},{md5_scan},{shard_name},{offset},{points.shape[0]},{points.shape[1]},{dtypeToken(points.dtype)}\n")
+        self.count += 1
+        return md5_scan, shard_name, offset
+
+    def sync(self):
+        """Flush shard and index, so a checkpoint never points past what is on disk."""
+        if self.shard_file is not None:
+            self.shard_file.flush()
+        self.index_file.flush()
+
+    def close(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.index_file.close()
+
+
+def dtypeToken(dtype):
+    """dtype as written in the index: its str ('<f4'), or for records 'name:type:offset:count ... itemsize'."""
+    if dtype.names is None:
+        return dtype.str
+    fields = []
+    for name in dtype.names:
+        field, offset = dtype.fields[name][:2]
+        base, shape = field.subdtype if field.subdtype else (field, ())
+        fields.append(f"{name}:{base.str}:{offset}:{int(np.prod(shape))}")
+    return ' '.join(fields) + f" {dtype.itemsize}"
+
+
+def parseDtypeToken(token):
+    if ':' not in token:
+        return np.dtype(token)
+    *fields, itemsize = token.split(' ')
+    names, formats, offsets = [], [], []
+    for field in fields:
+        name, base, offset, count = field.split(':')
+        names.append(name)
+        formats.append(base if count == '1' else (base, int(count)))
+        offsets.append(int(offset))
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': int(itemsize)})
+
+
+class ScanEntry:
+    """One line of a shard index."""
+
+    __slots__ = ('count', 'secs', 'nsecs', 'md5', 'shard', 'offset', 'rows', 'cols', 'dtype')
+
+    def __init__(self, line):
+        count, secs, nsecs, md5, shard, offset, rows, cols, dtype = line.rstrip('\n').split(',')
+        self.count = int(count)
+        self.secs = int(secs)
+        self.nsecs = int(nsecs)
+        self.md5 = md5
+        self.shard = shard
+        self.offset = int(offset)
+        self.rows = int(rows)
+        self.cols = int(cols)
+        self.dtype = parseDtypeToken(dtype)
+
+    @property
+    def stamp(self):
+        return self.secs * 1000000000 + self.nsecs
+
+
+class ScanShardReader:
+    """Random access to the scans written by ScanShardWriter(folder, name)."""
+
+    def __init__(self, folder, name='scans'):
+        self.folder = folder
+        with open(os.path.join(folder, name + '.idx')) as index_file:
+            index_file.readline()
+            self.entries = [ScanEntry(line) for line in index_file if line.strip()]
+        self.by_md5 = {entry.md5: entry for entry in self.entries}
+        self.by_time = sorted(self.entries, key=lambda entry: entry.stamp)
+        self.stamps = [entry.stamp for entry in self.by_time]
+        self.shards = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _view(self, entry):
+        nbytes = entry.rows * entry.cols * entry.dtype.itemsize
+        if nbytes == 0:
+            # empty scans (e.g. clouds reduced to nothing) may sit in an empty shard, which cannot be mapped
+            return np.empty(entry.rows if entry.dtype.names is not None else (entry.rows, entry.cols), dtype=entry.dtype)
+        shard = self.shards.get(entry.shard)
+        if shard is None:
+            shard = np.memmap(os.path.join(self.folder, entry.shard), dtype=np.uint8, mode='r')
+            self.shards[entry.shard] = shard
+        view = shard[entry.offset:entry.offset + nbytes].view(entry.dtype)
+        if entry.dtype.names is not None:
+            return view
+        return view.reshape(entry.rows, entry.cols)
+
+    def scan(self, count):
+        """Scan number count of the bag (0-based, in write order)."""
+        return self._view(self.entries[count])
+
+    def scanByMd5(self, md5_scan):
+        return self._view(self.by_md5[md5_scan])
+
+    def scanAt(self, secs, nsecs=0):
+        """The scan whose stamp is nearest to secs.nsecs, and its index entry."""
+        stamp = secs * 1000000000 + nsecs
+        i = bisect.bisect_left(self.stamps, stamp)
+        if i == len(self.stamps) or (i > 0 and stamp - self.stamps[i - 1] <= self.stamps[i] - stamp):
+            i -= 1
+        entry = self.by_time[i]
+        return self._view(entry), entry
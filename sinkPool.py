@@ -0,0 +1,86 @@
+'''
+One database connection per worker process, with health checks and retries.
+
+bagScheduler runs every bag in a worker process. Instead of opening a connection per bag,
+each worker keeps one sink and reuses it for every bag it runs, so the pool holds one
+connection per worker (BAG_WORKERS) and bags never share one. Before each bag the sink is
+health-checked with a trivial query and reopened if it went stale.
+
+A transient error (dropped link, timeout, deadlock, Azure throttling or failover, see
+dbSink.isTransientError) discards the connection and runs the bag again on a new one,
+after an exponential backoff. Rows are committed per batch together with their
+checkpoints (see checkpoint.py), so the retried bag resumes from its last commit instead
+of storing anything twice.
+
+    SINKS = WorkerSink(openDatabaseSink, retries=3, retry_seconds=2.0)   # module level
+    SINKS.run(lambda sink: ingest(sink, bagFile))                         # in the worker
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import os
+import time
+from dbSink import SINK_ERRORS, isTransientError
+
+
+class WorkerSink:
+    """The sink of the current process, opened on first use by open_sink()."""
+
+    def __init__(self, open_sink, retries=3, retry_seconds=2.0):
+        self.open_sink = open_sink
+        self.retries = retries
+        self.retry_seconds = retry_seconds
+        self.sink = None
+        self.pid = None
+
+    def acquire(self):
+        """A healthy sink of this process, (re)connecting with retries if needed."""
+        if self.sink is not None and self.pid != os.getpid():
+            # inherited through fork: the connection belongs to the parent process
+            self.sink = None
+        if self.sink is not None and not self.sink.ping():
+            print("Database connection failed its health check, reconnecting")
+            self.discard()
+        if self.sink is None:
+            self.sink = self._retry(self.open_sink)
+            self.pid = os.getpid()
+        return self.sink
+
+    def discard(self):
+        """Roll back and drop the current connection, e.g. after an error in the middle of a bag."""
+        if self.sink is not None:
+            try:
+                self.sink.abort()
+            except SINK_ERRORS:
+                pass
+        self.sink = None
+
+    def run(self, work):
+        """Return work(sink); on a transient error, reconnect and run it again."""
+        for retry in range(self.retries + 1):
+            sink = self.acquire()
+            try:
+                return work(sink)
+            except BaseException as e:
+                # the failed bag's uncommitted rows must not be committed with the next bag
+                self.discard()
+                if not (isinstance(e, SINK_ERRORS) and isTransientError(e)) or retry == self.retries:
+                    raise
+                self._backoff(e, retry)
+
+    def _retry(self, attempt):
+        for retry in range(self.retries + 1):
+            try:
+                return attempt()
+            except SINK_ERRORS as e:
+                if not isTransientError(e) or retry == self.retries:
+                    raise
+                self._backoff(e, retry)
+
+    def _backoff(self, e, retry):
+        delay = self.retry_seconds * 2 ** retry
+        print(f"Transient database error ({e}), retrying in {delay:.0f} seconds")
+        time.sleep(delay)
+
+    def close(self):
+        self.discard()
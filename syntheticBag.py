@@ -0,0 +1,205 @@
+'''
+Synthetic bag files for benchmarking the ingestion scripts.
+
+Writes a .bag with rosbag's writer holding the topics of the IVSG mapping van, each at its
+own rate, for a chosen duration:
+
+    /sick_lms_5xx/scan                        sensor_msgs/LaserScan, 1081 beams
+    /{front,rear}_{left,center,right}_camera  sensor_msgs/CompressedImage, unique JPEG frames
+    /velodyne_points                          sensor_msgs/PointCloud2, VLP-16 layout
+    /velodyne_packets                         velodyne_msgs/VelodyneScan, VLP-16 data packets
+    /gps/fix                                  sensor_msgs/NavSatFix
+    /encoder/wheels                           sensor_msgs/JointState, left/right wheel ticks
+
+Every message is different (the van drives, frames change), so content-addressed dedup does
+not hide any work. The generator is seeded, so the same arguments give the same bag.
+
+    python3 syntheticBag.py synthetic.bag --seconds 30 --rate /gps/fix=20 --image-size 1280x720
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import argparse
+import numpy as np
+
+CAMERA_TOPICS = [
+    '/front_left_camera/image_color/compressed',
+    '/front_center_camera/image_color/compressed',
+    '/front_right_camera/image_color/compressed',
+    '/rear_left_camera/image_rect_color/compressed',
+    '/rear_center_camera/image_rect_color/compressed',
+    '/rear_right_camera/image_rect_color/compressed',
+]
+
+# messages per second of every topic
+DEFAULT_RATES = {
+    '/sick_lms_5xx/scan': 25.0,
+    '/velodyne_points': 10.0,
+    '/velodyne_packets': 10.0,
+    '/gps/fix': 10.0,
+    '/encoder/wheels': 100.0,
+}
+DEFAULT_RATES.update({topic: 10.0 for topic in CAMERA_TOPICS})
+
+LASER_BEAMS = 1081
+VELODYNE_CHANNELS = 16
+VELODYNE_FIRINGS_PER_SCAN = 1800            # 0.2 degree azimuth resolution at 600 rpm
+VELODYNE_BLOCKS_PER_PACKET = 12
+VELODYNE_PACKETS_PER_SCAN = 76
+START_TIME = 1571431170.0
+
+
+class SyntheticBagWriter:
+    """Builds the messages of every topic; write() puts them in a bag in time order."""
+
+    def __init__(self, seconds=10.0, rates=None, image_size=(640, 480), seed=0):
+        self.seconds = seconds
+        self.rates = dict(DEFAULT_RATES)
+        self.rates.update(rates or {})
+        self.image_size = image_size
+        self.random = np.random.default_rng(seed)
+
+    def schedule(self):
+        """(time, topic, index) of every message, sorted by time."""
+        events = []
+        for topic, rate in self.rates.items():
+            if rate <= 0:
+                continue
+            count = int(self.seconds * rate)
+            events.extend((START_TIME + i / rate, topic, i) for i in range(count))
+        events.sort()
+        return events
+
+    def write(self, path, compression='lz4'):
+        import rosbag
+        import rospy
+        with rosbag.Bag(path, 'w', compression=compression) as bag:
+            for stamp, topic, index in self.schedule():
+                t = rospy.Time.from_sec(stamp)
+                bag.write(topic, self.message(topic, index, t), t)
+
+    def message(self, topic, index, t):
+        if topic in CAMERA_TOPICS:
+            return self.compressedImage(index, t)
+        if topic == '/sick_lms_5xx/scan':
+            return self.laserScan(index, t)
+        if topic == '/velodyne_points':
+            return self.pointCloud(index, t)
+        if topic == '/velodyne_packets':
+            return self.velodyneScan(index, t)
+        if topic == '/gps/fix':
+            return self.navSatFix(index, t)
+        if topic == '/encoder/wheels':
+            return self.wheelEncoders(index, t)
+        raise ValueError(f"No synthetic messages for topic {topic}")
+
+    def header(self, index, t, frame_id):
+        from std_msgs.msg import Header
+        return Header(seq=index, stamp=t, frame_id=frame_id)
+
+    def compressedImage(self, index, t):
+        import cv2
+        from sensor_msgs.msg import CompressedImage
+        width, height = self.image_size
+        # a gradient scrolling with the frame index, plus sensor noise
+        x = (np.arange(width, dtype=np.int32) + index * 7) % 256
+        y = np.arange(height, dtype=np.int32)[:, None] % 256
+        image = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                          np.full((height, width), index % 256)], axis=2).astype(np.uint8)
+        image = cv2.add(image, self.random.integers(0, 16, image.shape, dtype=np.uint8))
+        data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+        return CompressedImage(header=self.header(index, t, 'camera'), format='rgb8; jpeg compressed bgr8', data=data)
+
+    def laserScan(self, index, t):
+        from sensor_msgs.msg import LaserScan
+        angles = np.linspace(-0.75 * np.pi, 0.75 * np.pi, LASER_BEAMS)
+        ranges = 8.0 + 3.0 * np.sin(angles * 3 + index * 0.05) + self.random.normal(0, 0.01, LASER_BEAMS)
+        ranges[self.random.random(LASER_BEAMS) < 0.02] = np.inf
+        intensities = self.random.uniform(50, 250, LASER_BEAMS)
+        return LaserScan(header=self.header(index, t, 'laser'), angle_min=angles[0], angle_max=angles[-1],
+                         angle_increment=angles[1] - angles[0], time_increment=1 / (25 * LASER_BEAMS), scan_time=0.04,
+                         range_min=0.05, range_max=80.0, ranges=ranges.astype(np.float32).tolist(),
+                         intensities=intensities.astype(np.float32).tolist())
+
+    def pointCloud(self, index, t):
+        from sensor_msgs.msg import PointCloud2, PointField
+        points = VELODYNE_CHANNELS * VELODYNE_FIRINGS_PER_SCAN
+        dtype = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('intensity', '<f4'), ('ring', '<u2'), ('time', '<f4')])
+        azimuth = np.repeat(np.linspace(0, 2 * np.pi, VELODYNE_FIRINGS_PER_SCAN, endpoint=False), VELODYNE_CHANNELS)
+        ring = np.tile(np.arange(VELODYNE_CHANNELS, dtype=np.uint16), VELODYNE_FIRINGS_PER_SCAN)
+        elevation = np.radians(-15 + 2 * ring.astype(np.float32))
+        distance = 10 + 5 * np.sin(azimuth * 4 + index * 0.1) + self.random.normal(0, 0.02, points)
+        cloud = np.empty(points, dtype=dtype)
+        cloud['x'] = distance * np.cos(elevation) * np.cos(azimuth)
+        cloud['y'] = distance * np.cos(elevation) * np.sin(azimuth)
+        cloud['z'] = distance * np.sin(elevation)
+        cloud['intensity'] = self.random.uniform(0, 100, points)
+        cloud['ring'] = ring
+        cloud['time'] = np.repeat(np.linspace(0, 0.1, VELODYNE_FIRINGS_PER_SCAN, endpoint=False), VELODYNE_CHANNELS)
+        fields = [PointField(name=name, offset=dtype.fields[name][1], datatype=PointField.UINT16 if name == 'ring' else PointField.FLOAT32, count=1)
+                  for name in dtype.names]
+        return PointCloud2(header=self.header(index, t, 'velodyne'), height=1, width=points, fields=fields, is_bigendian=False,
+                           point_step=dtype.itemsize, row_step=dtype.itemsize * points, data=cloud.tobytes(), is_dense=True)
+
+    def velodynePacket(self, scan_index, packet_index):
+        """One 1206-byte VLP-16 data packet: 12 blocks of flag, azimuth and 2 x 16 returns."""
+        block = np.dtype([('flag', '<u2'), ('azimuth', '<u2'), ('returns', [('distance', '<u2'), ('reflectivity', 'u1')], 32)])
+        blocks = np.zeros(VELODYNE_BLOCKS_PER_PACKET, dtype=block)
+        first = packet_index * VELODYNE_BLOCKS_PER_PACKET
+        blocks['flag'] = 0xEEFF
+        blocks['azimuth'] = (np.arange(first, first + VELODYNE_BLOCKS_PER_PACKET) * 40 + scan_index) % 36000
+        # distances in 2 mm units
+        blocks['returns']['distance'] = (5000 + 2500 * self.random.random((VELODYNE_BLOCKS_PER_PACKET, 32))).astype(np.uint16)
+        blocks['returns']['reflectivity'] = self.random.integers(0, 256, (VELODYNE_BLOCKS_PER_PACKET, 32), dtype=np.uint8)
+        timestamp = np.array([(scan_index * 100000 + packet_index * 1327) % 3600000000], dtype='<u4')
+        # strongest return, VLP-16
+        factory = bytes([0x37, 0x22])
+        return blocks.tobytes() + timestamp.tobytes() + factory
+
+    def velodyneScan(self, index, t):
+        import rospy
+        from velodyne_msgs.msg import VelodyneScan, VelodynePacket
+        packets = [VelodynePacket(stamp=t + rospy.Duration.from_sec(i * 0.1 / VELODYNE_PACKETS_PER_SCAN), data=self.velodynePacket(index, i))
+                   for i in range(VELODYNE_PACKETS_PER_SCAN)]
+        return VelodyneScan(header=self.header(index, t, 'velodyne'), packets=packets)
+
+    def navSatFix(self, index, t):
+        from sensor_msgs.msg import NavSatFix, NavSatStatus
+        # driving north-east at about 15 m/s near State College, PA
+        return NavSatFix(header=self.header(index, t, 'gps'), status=NavSatStatus(status=NavSatStatus.STATUS_FIX, service=NavSatStatus.SERVICE_GPS),
+                         latitude=40.7934 + index * 1.5e-5 / self.rates['/gps/fix'] * 10, longitude=-77.8600 + index * 1.5e-5 / self.rates['/gps/fix'] * 10,
+                         altitude=350.0 + self.random.normal(0, 0.1), position_covariance=[0.5, 0, 0, 0, 0.5, 0, 0, 0, 1.0],
+                         position_covariance_type=NavSatFix.COVARIANCE_TYPE_DIAGONAL_KNOWN)
+
+    def wheelEncoders(self, index, t):
+        from sensor_msgs.msg import JointState
+        ticks = index * 12.5
+        return JointState(header=self.header(index, t, 'base_link'), name=['left_wheel', 'right_wheel'],
+                          position=[ticks, ticks + self.random.normal(0, 0.5)], velocity=[1250.0, 1250.0], effort=[])
+
+
+def parseRate(text):
+    """'/gps/fix=20' -> ('/gps/fix', 20.0)"""
+    topic, rate = text.rsplit('=', 1)
+    return topic, float(rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic bag file for benchmarking.")
+    parser.add_argument('path', help="bag file to write")
+    parser.add_argument('--seconds', type=float, default=10.0, help="duration of the recording")
+    parser.add_argument('--rate', type=parseRate, action='append', default=[], metavar='TOPIC=HZ',
+                        help="message rate of a topic; 0 leaves the topic out")
+    parser.add_argument('--image-size', default='640x480', help="camera frame size, WIDTHxHEIGHT")
+    parser.add_argument('--compression', default='lz4', choices=['none', 'bz2', 'lz4'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    width, height = map(int, args.image_size.split('x'))
+    writer = SyntheticBagWriter(args.seconds, dict(args.rate), (width, height), args.seed)
+    writer.write(args.path, args.compression)
+    print(f"Wrote {len(writer.schedule())} messages ({args.seconds} seconds) to {args.path}")
+
+
+if __name__ == '__main__':
+    main()
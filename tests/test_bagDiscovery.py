@@ -0,0 +1,68 @@
+import os
+
+from bagDiscovery import IngestManifest, bagFingerprint, discoverBags
+
+
+def writeBag(path, content=b'bag'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def test_discovery_skips_hidden_and_output_folders(tmp_path):
+    root = str(tmp_path)
+    expected = {writeBag(os.path.join(root, 'day1', 'drive.bag')),
+                writeBag(os.path.join(root, 'day1', 'more', 'deeper', 'other.bag')),
+                writeBag(os.path.join(root, 'day2', 'third.bag'))}
+    # the output folder of drive.bag, and a hidden folder
+    writeBag(os.path.join(root, 'day1', 'drive', 'images', 'copy.bag'))
+    writeBag(os.path.join(root, '.trash', 'old.bag'))
+
+    found = discoverBags([root], workers=4)
+    assert set(found) == expected
+    path = os.path.join(root, 'day2', 'third.bag')
+    assert found[path] == (os.stat(path).st_size, os.stat(path).st_mtime_ns)
+    # a file argument is taken as it is
+    assert set(discoverBags([os.path.join(root, '.trash', 'old.bag')])) == {os.path.join(root, '.trash', 'old.bag')}
+
+
+def test_manifest_skips_unchanged_bags(tmp_path):
+    root = str(tmp_path / 'drives')
+    done = writeBag(os.path.join(root, 'done.bag'), b'a' * 100)
+    failed = writeBag(os.path.join(root, 'failed.bag'), b'b' * 100)
+    manifest_path = str(tmp_path / 'manifest.sqlite3')
+
+    manifest = IngestManifest(manifest_path, 'db')
+    assert sorted(manifest.pending(discoverBags([root]))) == [done, failed]
+    manifest.record(done)
+    manifest.record(failed, error=RuntimeError('crash'))
+    manifest.close()
+
+    manifest = IngestManifest(manifest_path, 'db')
+    assert manifest.pending(discoverBags([root])) == [failed]
+    # another kind of run has its own entries
+    assert len(IngestManifest(manifest_path, 'csv').pending(discoverBags([root]))) == 2
+
+    # touched: same content, new mtime, still skipped (and the new mtime is remembered)
+    stat = os.stat(done)
+    os.utime(done, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert manifest.pending(discoverBags([root])) == [failed]
+    assert manifest.entries[os.path.abspath(done)][1] == stat.st_mtime_ns + 10 ** 9
+
+    # modified: processed again
+    writeBag(done, b'c' * 100)
+    assert sorted(manifest.pending(discoverBags([root]))) == [done, failed]
+    manifest.close()
+
+
+def test_fingerprint_reads_both_ends(tmp_path, monkeypatch):
+    import bagDiscovery
+    monkeypatch.setattr(bagDiscovery, 'FINGERPRINT_SAMPLE_BYTES', 4)
+    path = writeBag(str(tmp_path / 'a.bag'), b'head-middle-tail')
+    sampled = bagFingerprint(path)
+    writeBag(path, b'head-MIDDLE-tail')
+    assert bagFingerprint(path) == sampled
+    assert bagFingerprint(path, full=True) != sampled
+    writeBag(path, b'head-middle-TAIL')
+    assert bagFingerprint(path) != sampled
@@ -0,0 +1,115 @@
+from bagDemux import TopicHandler
+from checkpoint import (DbCheckpointStore, ResumableHandler, SidecarCheckpointStore, TopicCheckpoint,
+                        openOutput, resumeStartTime)
+from dbSink import SqliteSink
+from dbWriter import BatchedWriter
+
+
+class Stamp:
+    def __init__(self, ns):
+        self.ns = ns
+
+    def to_nsec(self):
+        return self.ns
+
+
+class Recorder(TopicHandler):
+    def __init__(self):
+        self.seen = []
+
+    def handle(self, topic, msg, t):
+        self.seen.append(msg)
+
+
+# three messages per stamp, as GPS fixes sharing a receive time do
+MESSAGES = [(i, Stamp(100 + i // 3)) for i in range(12)]
+
+
+def feed(handler, messages):
+    for msg, t in messages:
+        handler.handle('/gps/fix', msg, t)
+
+
+def test_resume_skips_exactly_the_committed_messages():
+    first = ResumableHandler(Recorder())
+    # crash after message 4: two of the three messages at stamp 101 were committed
+    feed(first, MESSAGES[:5])
+    checkpoint = first.position()
+    assert (checkpoint.stamp, checkpoint.at_stamp, checkpoint.count) == (101, 2, 5)
+
+    second = ResumableHandler(Recorder(), checkpoint)
+    assert resumeStartTime({'/gps/fix': second}) == 101
+    # the bag is read again from stamp 101
+    feed(second, [m for m in MESSAGES if m[1].ns >= 101])
+    assert second.handler.seen == list(range(5, 12))
+    assert second.position().count == 12
+
+
+def test_resume_start_time_waits_for_the_least_advanced_topic():
+    fresh = ResumableHandler(Recorder())
+    resumed = ResumableHandler(Recorder(), TopicCheckpoint(stamp=500))
+    assert resumeStartTime({'a': resumed, 'b': fresh}, start_time=50) == 50
+    assert resumeStartTime({'a': resumed}, start_time=50) == 500
+    assert resumeStartTime({'a': resumed}, start_time=800) == 800
+
+
+def test_open_output_cuts_what_follows_the_checkpoint(tmp_path):
+    path = str(tmp_path / 'topic.csv')
+    with openOutput(path) as output:
+        output.write('header\nrow 1\n')
+        offset = output.tell()
+        output.write('row 2 never checkpointed\n')
+    with openOutput(path, offset) as output:
+        output.write('row 2\n')
+    with open(path) as output:
+        assert output.read() == 'header\nrow 1\nrow 2\n'
+
+
+def test_sidecar_store_merges_and_keeps_windows_apart(tmp_path):
+    full = SidecarCheckpointStore(str(tmp_path))
+    full.save({'/a': TopicCheckpoint(10, 1, 3, 42)})
+    full.save({'/b': TopicCheckpoint(20, 2, 4, None, True)})
+    SidecarCheckpointStore(str(tmp_path), '@1-2').save({'/a': TopicCheckpoint(1, 1, 1, 7)})
+
+    loaded = full.load()
+    assert loaded['/a'].toDict() == TopicCheckpoint(10, 1, 3, 42).toDict()
+    assert loaded['/b'].complete
+    assert SidecarCheckpointStore(str(tmp_path), '@1-2').load()['/a'].offset == 7
+
+
+def test_db_checkpoints_commit_with_their_rows(tmp_path):
+    path = str(tmp_path / 'db.sqlite3')
+    # as with several bag workers: every commit of the writer ends a transaction
+    sink = SqliteSink(path, single_transaction=False)
+    writer = BatchedWriter(sink, batch_size=2, commit_rows=4, commit_seconds=60.0)
+    store = DbCheckpointStore(writer)
+    writer.create_table('gps', [('rosbagTimestamp', 'BIGINT')])
+    handler = ResumableHandler(Recorder())
+    writer.on_commit.append(lambda: store.save('drive.bag', {'/gps/fix': handler.position()}))
+    for msg, t in MESSAGES[:6]:
+        handler.handle('/gps/fix', msg, t)
+        writer.insert('gps', (t.ns,))
+    # the crash: rows and checkpoint after the last commit are both lost
+    sink.abort()
+
+    sink = SqliteSink(path)
+    writer = BatchedWriter(sink)
+    store = DbCheckpointStore(writer)
+    checkpoint = store.load('drive.bag')['/gps/fix']
+    assert checkpoint.count == 4
+    assert writer.query("SELECT COUNT(*) FROM gps") == [(checkpoint.count,)]
+
+    sink.close()
+
+
+def test_windowed_topics_come_from_the_window_checkpoints_of_the_bag(tmp_path):
+    writer = BatchedWriter(SqliteSink(str(tmp_path / 'db.sqlite3')))
+    store = DbCheckpointStore(writer)
+    store.save('drive.bag', {'/encoder': TopicCheckpoint(100, 1, 1)})
+    store.save('drive.bag@100-200', {'/gps/fix': TopicCheckpoint(100, 1, 1)})
+    store.save('drive.bag@0-', {'/trigger': TopicCheckpoint(100, 1, 1)})
+    writer.commit()
+
+    assert store.windowedTopics('drive.bag') == {'/gps/fix', '/trigger'}
+    assert store.windowedTopics('drive') == set()
+    writer.close()
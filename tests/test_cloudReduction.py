@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from cloudReduction import CloudReduction, parseRings, reductionsFromSpec, voxelFirstPoints
+
+
+def decodedScan():
+    """N x 6 scan of velodyne_decoder 2.x: x, y, z, intensity, ring, time."""
+    return np.array([
+        [0.5, 0.0, 0.0, 1, 0, 0],       # closer than 1 m
+        [2.0, 0.0, 0.0, 2, 1, 0],
+        [2.05, 0.02, 0.0, 3, 2, 0],     # same 0.1 m voxel as the row before
+        [np.nan, 0.0, 0.0, 4, 3, 0],    # no return
+        [50.0, 0.0, 0.0, 5, 4, 0],
+        [100.0, 0.0, 0.0, 6, 5, 0],     # farther than 80 m
+    ], dtype=np.float32)
+
+
+def test_range_crop_and_voxel_grid_keep_the_first_point_of_each_voxel():
+    reduced = CloudReduction(voxel_size=0.1, min_range=1, max_range=80)(decodedScan())
+    assert reduced[:, 3].tolist() == [2, 5]
+
+
+def test_rings_of_decoded_and_structured_points():
+    assert CloudReduction(rings=[1, 2])(decodedScan())[:, 3].tolist() == [2, 3]
+
+    cloud = np.zeros(4, dtype=[('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('ring', '<u2')])
+    cloud['x'] = [1, 2, 3, 4]
+    cloud['ring'] = [0, 8, 1, 9]
+    assert CloudReduction(rings=parseRings('0-7'))(cloud)['x'].tolist() == [1, 3]
+
+    with pytest.raises(ValueError):
+        CloudReduction(rings=[0])(np.zeros((2, 3), dtype=np.float32))
+
+
+def test_wide_clouds_fall_back_to_unique_rows():
+    xyz = np.array([[0.0, 0.0, 0.0], [1e6, 0.0, 0.0], [1e6 + 0.01, 0.0, 0.0]])
+    assert sorted(voxelFirstPoints(xyz, 0.1).tolist()) == [0, 1]
+
+
+def test_reductions_from_spec():
+    assert parseRings('0-3+8+10-11') == [0, 1, 2, 3, 8, 10, 11]
+    reductions = reductionsFromSpec('/velodyne_packets:voxel=0.1,min_range=1,max_range=80; /velodyne_points:rings=0-7')
+    assert reductions['/velodyne_packets'].voxel_size == 0.1 and reductions['/velodyne_packets'].max_range == 80.0
+    assert reductions['/velodyne_points'].rings.tolist() == list(range(8))
+    assert reductionsFromSpec('') == {}
+    with pytest.raises(ValueError):
+        reductionsFromSpec('/velodyne_points:voxels=0.1')
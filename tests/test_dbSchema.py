@@ -0,0 +1,60 @@
+import shutil
+import types
+
+import dbSchema
+from dbSink import SqliteSink
+from dbWriter import BatchedWriter
+
+
+def fakeBag():
+    return types.SimpleNamespace(get_start_time=lambda: 1571431170.0, get_end_time=lambda: 1571431230.0,
+                                 get_message_count=lambda: 42)
+
+
+def writeBag(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_bag_file_names_parse_or_give_none():
+    assert dbSchema.parseBagFileName('/data/mapping_van_2019-10-18-20-39-30_12.bag') == ('2019-10-18 20:39:30', 12)
+    assert dbSchema.parseBagFileName('mapping_van_2019-10-18-20-39-30.bag') == ('2019-10-18 20:39:30', None)
+    assert dbSchema.parseBagFileName('my_test_drive.bag') == (None, None)
+    assert dbSchema.parseBagFileName('a_b_c_d.bag') == (None, None)
+    assert dbSchema.parseBagFileName('van_2019-13-40-20-39-30_1.bag') == (None, None)
+
+
+def test_bags_are_cataloged_by_fingerprint(tmp_path):
+    writer = BatchedWriter(SqliteSink(str(tmp_path / 'db.sqlite3')))
+    first = writeBag(tmp_path / 'monday' / 'drive.bag', b'monday')
+    second = writeBag(tmp_path / 'tuesday' / 'drive.bag', b'tuesday')
+    copy = str(tmp_path / 'copy.bag')
+    shutil.copy(first, copy)
+
+    ids = [dbSchema.registerBag(writer, fakeBag(), path, fingerprint)
+           for path, fingerprint in [(first, 'a' * 32), (second, 'b' * 32), (copy, 'a' * 32)]]
+    writer.commit()
+
+    assert ids[0] != ids[1] and ids[2] == ids[0]
+    assert writer.query("SELECT file_name, duration, message_count FROM bags ORDER BY bag_id") == [('copy.bag', 60.0, 42), ('drive.bag', 60.0, 42)]
+    writer.close()
+
+
+def test_time_indexes_follow_the_time_columns(tmp_path):
+    sink = SqliteSink(str(tmp_path / 'db.sqlite3'))
+    writer = BatchedWriter(sink)
+    dbSchema.createCatalog(sink, writer.cursor)
+    writer.create_table('scan', [dbSchema.BAG_ID_COLUMN, ('secs', 'INT'), ('nsecs', 'INT')])
+    writer.create_table('gps', [dbSchema.BAG_ID_COLUMN, ('rosbagTimestamp', 'BIGINT')])
+    writer.create_table('other', [('value', 'INT')])
+    writer.commit()
+
+    assert sorted(dbSchema.createTimeIndexes(sink)) == ['gps', 'scan']
+    indexes = dict(writer.query("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'"))
+    assert indexes['ix_scan_bag_time'].endswith('(bag_id, secs, nsecs)')
+    assert indexes['ix_gps_bag_time'].endswith('(bag_id, rosbagTimestamp)')
+
+    assert sorted(dbSchema.dropTimeIndexes(sink)) == ['gps', 'scan']
+    assert writer.query("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'") == []
+    writer.close()
@@ -0,0 +1,38 @@
+from dbSink import OdbcSink, SqliteSink
+from dbWriter import BatchedWriter, RoundTripCountingConnection
+
+GPS_COLUMNS = [('rosbagTimestamp', 'BIGINT'), ('latitude', 'FLOAT'), ('longitude', 'FLOAT')]
+
+
+def test_batches_and_commits_cut_round_trips():
+    number_of_rows = 25000
+    batch_size = 1000
+    conn = RoundTripCountingConnection()
+    writer = BatchedWriter(OdbcSink(conn, multirow_values=False), batch_size=batch_size, commit_rows=10000, commit_seconds=60.0)
+    # plain CREATE TABLE: the T-SQL existence check would not parse on the SQLite stand-in
+    writer.create_table('_slash_gps_fix', GPS_COLUMNS, if_not_exists=False)
+    for i in range(number_of_rows):
+        writer.insert('_slash_gps_fix', (i, 40.79 + i * 1e-6, -77.86 - i * 1e-6))
+    writer.close()
+
+    assert conn.conn.execute("SELECT COUNT(*) FROM _slash_gps_fix").fetchone()[0] == number_of_rows
+    # CREATE TABLE + 25 batches + 3 commits (at 10000, 20000 and on close)
+    assert conn.round_trips == 1 + number_of_rows // batch_size + 3
+    assert conn.commits == 3
+
+
+def test_hooks_run_inside_every_commit(tmp_path):
+    sink = SqliteSink(str(tmp_path / 'db.sqlite3'), single_transaction=False)
+    writer = BatchedWriter(sink, batch_size=10, commit_rows=25, commit_seconds=60.0)
+    writer.create_table('gps', GPS_COLUMNS)
+    sent_before_hook = []
+    writer.before_commit.append(lambda: writer.insert('gps', (-1, 0.0, 0.0)))
+    writer.on_commit.append(lambda: sent_before_hook.append(sum(table.rows_written for table in writer.tables.values())))
+    for i in range(60):
+        writer.insert('gps', (i, 40.0, -77.0))
+    writer.close()
+
+    # rows handed in by before_commit are sent in the same transaction, ahead of on_commit
+    assert sent_before_hook == [31, 62, 63]
+    assert writer.query("SELECT COUNT(*) FROM gps") == [(63,)]
+    sink.close()
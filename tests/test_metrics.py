@@ -0,0 +1,43 @@
+import json
+
+import metrics
+
+
+def recordBag(name):
+    recorder = metrics.startBag(name)
+    metrics.count('/gps/fix', size=100)
+    metrics.count('/gps/fix', size=50)
+    with metrics.timed('db execute', 'gps'):
+        pass
+    recorder.add('commit', 0.5)
+    return metrics.finishBag()
+
+
+def test_bag_report_counts_messages_and_stage_times():
+    data = recordBag('drive.bag').data
+
+    assert data['messages'] == 2 and data['bytes'] == 150
+    assert data['topics'] == {'/gps/fix': {'messages': 2, 'bytes': 150}}
+    assert data['stages']['db execute']['gps']['calls'] == 1
+    assert data['stages']['commit'][''] == {'seconds': 0.5, 'calls': 1}
+    assert data['process_peak_rss_mb'] > 0 and 0 <= data['peak_rss_growth_mb'] <= data['process_peak_rss_mb']
+    # outside of a bag nothing is recorded
+    metrics.count('/gps/fix')
+    assert isinstance(metrics.current(), metrics._NoMetrics)
+
+
+def test_run_metrics_export_as_json_and_prometheus_text(tmp_path):
+    results = {'a "quoted".bag': recordBag('a "quoted".bag'), 'skipped.bag': None}
+    json_path, prometheus_path = str(tmp_path / 'run.json'), str(tmp_path / 'run.prom')
+    metrics.writeRunMetrics(results, {'broken.bag': ValueError('bad')}, 12.5, json_path, prometheus_path)
+
+    report = json.load(open(json_path))
+    assert list(report['bags']) == ['a "quoted".bag']
+    assert report['failed'] == {'broken.bag': "ValueError('bad')"}
+
+    lines = open(prometheus_path).read().splitlines()
+    assert 'bag_ingest_run_seconds 12.5' in lines
+    assert 'bag_ingest_bags_failed 1' in lines
+    assert 'bag_ingest_messages_total{bag="a \\"quoted\\".bag",topic="/gps/fix"} 2' in lines
+    assert '# TYPE bag_ingest_stage_seconds_total counter' in lines
+    assert not (tmp_path / 'run.prom.partial').exists()
@@ -0,0 +1,60 @@
+import types
+
+import numpy as np
+import pytest
+
+from pointClouds import cloudDtype, cloudPoints, fieldLayout
+from rawMessages import PointFieldView
+
+# x, y, z, intensity (float32), ring (uint16), padded to 32 bytes, as the velodyne driver writes them
+FIELDS = [PointFieldView('x', 0, 7, 1), PointFieldView('y', 4, 7, 1), PointFieldView('z', 8, 7, 1),
+          PointFieldView('intensity', 16, 7, 1), PointFieldView('ring', 20, 4, 1)]
+POINT_STEP = 32
+
+
+def cloud(points, height=1, row_padding=0, is_bigendian=False):
+    """PointCloud2 stand-in holding the records of points, height rows of equal width."""
+    width = len(points) // height
+    rows = points.reshape(height, width)
+    data = b''.join(row.tobytes() + bytes(row_padding) for row in rows)
+    return types.SimpleNamespace(fields=FIELDS, point_step=POINT_STEP, is_bigendian=is_bigendian, height=height,
+                                 width=width, row_step=width * POINT_STEP + row_padding, data=memoryview(data))
+
+
+def points(n):
+    records = np.zeros(n, dtype=cloudDtype(FIELDS, POINT_STEP))
+    records['x'] = np.arange(n)
+    records['ring'] = np.arange(n) % 16
+    return records
+
+
+def test_dtype_follows_the_fields_and_is_cached():
+    dtype = cloudDtype(FIELDS, POINT_STEP)
+    assert dtype.itemsize == POINT_STEP
+    assert dtype.fields['intensity'][1] == 16
+    assert dtype['ring'] == np.dtype('<u2')
+    assert cloudDtype(list(FIELDS), POINT_STEP) is dtype
+    assert cloudDtype(FIELDS, POINT_STEP, is_bigendian=True)['x'] == np.dtype('>f4')
+
+
+def test_points_are_a_view_of_the_message_bytes():
+    msg = cloud(points(10))
+    decoded = cloudPoints(msg)
+    assert not decoded.flags.owndata
+    np.testing.assert_array_equal(decoded['x'], np.arange(10))
+    np.testing.assert_array_equal(decoded['ring'], np.arange(10) % 16)
+
+
+def test_padded_rows_are_skipped():
+    decoded = cloudPoints(cloud(points(12), height=3, row_padding=8))
+    assert len(decoded) == 12
+    np.testing.assert_array_equal(decoded['x'], np.arange(12))
+
+
+def test_unknown_datatypes_are_rejected():
+    with pytest.raises(ValueError):
+        cloudDtype([PointFieldView('x', 0, 42, 1)], 4)
+
+
+def test_field_layout_text():
+    assert fieldLayout(FIELDS[:2]) == 'x:0:7:1,y:4:7:1'
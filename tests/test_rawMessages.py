@@ -0,0 +1,77 @@
+import hashlib
+import struct
+
+import pytest
+
+from rawMessages import RAW_VIEWS, VELODYNE_PACKET_SIZE
+
+
+# ROS 1 wire format: little-endian fields, uint32 length before strings and arrays
+def string(value):
+    data = value.encode() if isinstance(value, str) else value
+    return struct.pack('<I', len(data)) + data
+
+
+def header(seq=7, secs=1571431170, nsecs=500, frame_id='front'):
+    return struct.pack('<III', seq, secs, nsecs) + string(frame_id)
+
+
+def test_compressed_image_fields_and_payload_slice():
+    payload = bytes(range(256)) * 4
+    serialized = header() + string('jpeg') + string(payload)
+    view = RAW_VIEWS['sensor_msgs/CompressedImage'](serialized)
+
+    assert (view.header.seq, view.header.stamp.secs, view.header.stamp.nsecs) == (7, 1571431170, 500)
+    assert view.header.frame_id == 'front'
+    assert view.format == 'jpeg'
+    assert isinstance(view.data, memoryview)
+    assert view.data.obj is serialized    # a slice of the message buffer, not a copy
+    assert bytes(view.data) == payload
+    assert hashlib.md5(view.data).hexdigest() == hashlib.md5(payload).hexdigest()
+
+
+def test_image_fields_after_the_encoding_string():
+    payload = bytes(2 * 3 * 3)
+    serialized = header() + struct.pack('<II', 2, 3) + string('bgr8') + struct.pack('<BI', 0, 9) + string(payload)
+    view = RAW_VIEWS['sensor_msgs/Image'](serialized)
+
+    assert (view.height, view.width, view.encoding, view.is_bigendian, view.step) == (2, 3, 'bgr8', 0, 9)
+    assert bytes(view.data) == payload
+
+
+def test_velodyne_scan_packets():
+    packets = [(100 + i, i, bytes([i]) * VELODYNE_PACKET_SIZE) for i in range(3)]
+    serialized = header() + struct.pack('<I', len(packets)) + b''.join(struct.pack('<II', secs, nsecs) + data for secs, nsecs, data in packets)
+    view = RAW_VIEWS['velodyne_msgs/VelodyneScan'](serialized)
+
+    assert view.serialized is serialized
+    read = view.packets
+    assert [(packet.stamp.secs, packet.stamp.nsecs) for packet in read] == [(100, 0), (101, 1), (102, 2)]
+    assert [bytes(packet.data) for packet in read] == [data for _, _, data in packets]
+
+
+def test_point_cloud_fields_and_data():
+    fields = [('x', 0, 7, 1), ('y', 4, 7, 1), ('ring', 8, 4, 1)]
+    data = bytes(range(12)) * 2
+    serialized = (header() + struct.pack('<III', 1, 2, len(fields))
+                  + b''.join(string(name) + struct.pack('<IBI', offset, datatype, count) for name, offset, datatype, count in fields)
+                  + struct.pack('<BII', 0, 12, 24) + string(data) + b'\x01')
+    view = RAW_VIEWS['sensor_msgs/PointCloud2'](serialized)
+
+    assert (view.height, view.width, view.point_step, view.row_step) == (1, 2, 12, 24)
+    assert [(f.name, f.offset, f.datatype, f.count) for f in view.fields] == fields
+    assert not view.is_bigendian
+    assert bytes(view.data) == data
+    assert view.is_dense
+
+
+def test_truncated_messages_are_rejected():
+    serialized = header() + string('jpeg') + struct.pack('<I', 1000) + bytes(10)
+    with pytest.raises(ValueError):
+        RAW_VIEWS['sensor_msgs/CompressedImage'](serialized)
+
+
+def test_truncated_velodyne_scans_are_rejected():
+    serialized = header() + struct.pack('<I', 2) + struct.pack('<II', 1, 0) + bytes(VELODYNE_PACKET_SIZE)
+    with pytest.raises(ValueError):
+        RAW_VIEWS['velodyne_msgs/VelodyneScan'](serialized).packets
@@ -0,0 +1,53 @@
+import json
+from decimal import Decimal
+
+import numpy as np
+
+from rowExtractor import getRowExtractor
+
+
+def messageType(name, slots, slot_types):
+    """genpy-like message class: __slots__, _slot_types, _type and _md5sum."""
+    def init(self, *values):
+        for slot, value in zip(slots, values):
+            setattr(self, slot, value)
+    return type(name, (), {'__slots__': slots, '_slot_types': slot_types, '_type': 'test_msgs/' + name,
+                           '_md5sum': name, '__init__': init})
+
+
+Time = messageType('Time', ['secs', 'nsecs'], ['int32', 'int32'])
+Point = messageType('Point', ['x', 'y'], ['float64', 'float64'])
+
+
+def test_numeric_arrays_are_packed_and_short_ones_expanded():
+    Ranges = messageType('Ranges', ['covariance', 'ranges', 'label'], ['float64[4]', 'float32[]', 'uint8[]'])
+    extractor = getRowExtractor(Ranges([1.0, 2.0, 3.0, 4.0], [0.5, 1.5, 2.5], b'\x01\x02'))
+    row = extractor(Ranges([1.0, 2.0, 3.0, 4.0], [0.5, 1.5, 2.5], b'\x01\x02'))
+
+    assert extractor.column_names == ['covariance_0', 'covariance_1', 'covariance_2', 'covariance_3', 'ranges', 'label']
+    assert row[:4] == (1.0, 2.0, 3.0, 4.0)
+    assert np.frombuffer(row[4], extractor.array_dtypes['ranges']).tolist() == [0.5, 1.5, 2.5]
+    assert row[5] == b'\x01\x02'
+
+
+def test_uint64_goes_to_an_exact_decimal_column():
+    Counter = messageType('Counter', ['count', 'counts'], ['uint64', 'uint64[2]'])
+    extractor = getRowExtractor(Counter(2 ** 64 - 1, [2 ** 63, 1]))
+
+    assert dict(extractor.columns)['count'] == 'DECIMAL(20,0)'
+    assert extractor(Counter(2 ** 64 - 1, [2 ** 63, 1])) == (Decimal(2 ** 64 - 1), Decimal(2 ** 63), Decimal(1))
+
+
+def test_arrays_without_a_column_layout_are_stored_as_json(capsys):
+    Path = messageType('Path', ['points', 'stamps'], ['test_msgs/Point[]', 'time[]'])
+    msg = Path([Point(1.0, 2.0), Point(3.0, 4.0)], [Time(1, 500)])
+    extractor = getRowExtractor(msg)
+
+    assert extractor.json_columns == ['points', 'stamps']
+    assert dict(extractor.columns)['points'] == 'NVARCHAR(MAX)'
+    points, stamps = extractor(msg)
+    assert json.loads(points) == [{'x': 1.0, 'y': 2.0}, {'x': 3.0, 'y': 4.0}]
+    assert json.loads(stamps) == [{'secs': 1, 'nsecs': 500}]
+    # reported once, when the type is compiled
+    getRowExtractor(msg)
+    assert capsys.readouterr().out.count('points, stamps') == 1
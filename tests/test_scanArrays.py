@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from scanArrays import DEFAULT_QUANTIZATION_STEP, SCAN_ARRAY_ENCODINGS, packScanArray, unpackScanArray
+
+
+def ranges():
+    """A 1081-beam scan with no-return beams (inf) and one nan."""
+    values = np.random.default_rng(0).uniform(0.05, 80.0, 1081).astype(np.float32)
+    values[::50] = np.inf
+    values[7] = np.nan
+    return values
+
+
+@pytest.mark.parametrize('encoding', SCAN_ARRAY_ENCODINGS)
+def test_round_trip_through_hex_keeps_non_finite_values(encoding):
+    values = ranges()
+    decoded = unpackScanArray(packScanArray(values, encoding).hex(), encoding)
+
+    finite = np.isfinite(values)
+    assert np.array_equal(np.isnan(decoded), np.isnan(values))
+    assert np.array_equal(decoded[np.isinf(values)], values[np.isinf(values)])
+    if encoding == 'float32':
+        assert np.array_equal(decoded[finite], values[finite])
+    else:
+        assert np.max(np.abs(decoded[finite] - values[finite])) <= DEFAULT_QUANTIZATION_STEP / 2 + 1e-5
+
+
+def test_delta_encoding_is_smaller_than_float32():
+    values = np.linspace(1.0, 2.0, 1081, dtype=np.float32)
+    assert len(packScanArray(values, 'delta')) < len(packScanArray(values, 'float32'))
+
+
+def test_unknown_encodings_are_rejected():
+    with pytest.raises(ValueError):
+        packScanArray([1.0], 'text')
+    with pytest.raises(ValueError):
+        unpackScanArray(b'', 'text')
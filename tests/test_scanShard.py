@@ -0,0 +1,83 @@
+import numpy as np
+
+from scanShard import ScanShardReader, ScanShardWriter
+
+
+def scan(value, rows=3):
+    return np.full((rows, 4), value, dtype=np.float32)
+
+
+def test_repeated_scans_are_stored_once(tmp_path):
+    writer = ScanShardWriter(str(tmp_path))
+    first = writer.append(scan(1), 1, 0)
+    writer.append(scan(2), 2, 0)
+    assert writer.append(scan(1), 3, 0) == first
+    writer.close()
+
+    reader = ScanShardReader(str(tmp_path))
+    assert len(reader) == 3
+    assert (tmp_path / 'scans_0000.bin').stat().st_size == 2 * scan(1).nbytes
+    np.testing.assert_array_equal(reader.scan(2), scan(1))
+    view, entry = reader.scanAt(2, 100)
+    assert entry.count == 1
+    np.testing.assert_array_equal(view, scan(2))
+
+
+def test_resume_after_a_repeated_scan_keeps_older_shards(tmp_path):
+    # the last kept index line points back at scans_0000.bin, though scans_0001.bin is in use
+    writer = ScanShardWriter(str(tmp_path), scans_per_shard=2)
+    for i, value in enumerate([1, 2, 3, 1]):
+        writer.append(scan(value), i, 0)
+    writer.append(scan(9), 4, 0)    # past the checkpoint: cut off on resume
+    writer.close()
+
+    writer = ScanShardWriter(str(tmp_path), scans_per_shard=2, resume_count=4)
+    writer.append(scan(4), 4, 0)
+    writer.append(scan(5), 5, 0)
+    writer.close()
+
+    reader = ScanShardReader(str(tmp_path))
+    assert [float(reader.scan(i)[0, 0]) for i in range(len(reader))] == [1, 2, 3, 1, 4, 5]
+    assert [entry.shard for entry in reader.entries] == ['scans_0000.bin', 'scans_0000.bin', 'scans_0001.bin',
+                                                         'scans_0000.bin', 'scans_0002.bin', 'scans_0002.bin']
+
+
+def test_resume_truncates_the_shard_after_the_checkpoint(tmp_path):
+    writer = ScanShardWriter(str(tmp_path))
+    for i in range(4):
+        writer.append(scan(i), i, 0)
+    writer.close()
+
+    writer = ScanShardWriter(str(tmp_path), resume_count=2)
+    writer.append(scan(7), 2, 0)
+    writer.close()
+
+    assert (tmp_path / 'scans_0000.bin').stat().st_size == 3 * scan(0).nbytes
+    reader = ScanShardReader(str(tmp_path))
+    assert [float(reader.scan(i)[0, 0]) for i in range(len(reader))] == [0, 1, 7]
+
+
+def test_empty_scans_in_an_empty_shard(tmp_path):
+    points = np.dtype([('x', '<f4'), ('y', '<f4'), ('ring', '<u2')])
+    writer = ScanShardWriter(str(tmp_path), scans_per_shard=2)
+    writer.append(scan(0, rows=0), 0, 0)
+    writer.append(np.zeros(0, dtype=points), 1, 0)
+    writer.close()
+
+    reader = ScanShardReader(str(tmp_path))
+    assert reader.scan(0).shape == (0, 4)
+    assert reader.scan(1).shape == (0,)
+    assert reader.scan(1).dtype == points
+
+
+def test_structured_scans_round_trip(tmp_path):
+    points = np.dtype({'names': ['x', 'y', 'intensity'], 'formats': ['<f4', '<f4', '<f4'], 'offsets': [0, 4, 16], 'itemsize': 32})
+    cloud = np.zeros(5, dtype=points)
+    cloud['x'] = np.arange(5)
+    writer = ScanShardWriter(str(tmp_path))
+    writer.append(cloud, 0, 0)
+    writer.close()
+
+    stored = ScanShardReader(str(tmp_path)).scan(0)
+    assert stored.dtype == points
+    np.testing.assert_array_equal(stored['x'], cloud['x'])
@@ -0,0 +1,47 @@
+import csv
+
+import numpy as np
+
+from timeAlignment import TopicSeries, alignBagFolder
+
+SECOND = 1000000000
+START = 1571431170 * SECOND
+
+
+def test_linear_and_nearest_values_with_a_max_gap():
+    series = TopicSeries('/gps/fix', np.array([START + 2 * SECOND, START], dtype=np.int64), {'x': np.array([20.0, 0.0])})
+    targets = np.array([START + SECOND // 2, START + 2 * SECOND, START + 10 * SECOND], dtype=np.int64)
+
+    linear = series.at(targets)
+    assert linear['gps_fix_x'].tolist() == [5.0, 20.0, 20.0]
+    assert linear['gps_fix_dt_ns'].tolist() == [SECOND // 2, 0, 8 * SECOND]
+    assert series.at(targets, 'nearest')['gps_fix_x'].tolist() == [0.0, 20.0, 20.0]
+    assert np.isnan(series.at(targets, max_gap=SECOND)['gps_fix_x'][2])
+
+
+def writeCsv(path, header, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def test_bag_folder_is_aligned_on_the_trigger_stamps(tmp_path):
+    folder = tmp_path / 'drive'
+    folder.mkdir()
+    writeCsv(folder / '_slash_gps_slash_fix.csv', ['rosbagTimestamp', 'latitude'],
+             [[START + i * SECOND, 40.0 + i] for i in range(5)])
+    writeCsv(folder / '_slash_trigger.csv', ['rosbagTimestamp', 'mode'], [[START + SECOND // 2, 1], [START + 3 * SECOND, 1]])
+    # the outputs of a run over a time window are left to --window
+    writeCsv(folder / f'_slash_gps_slash_fix@{START}-.csv', ['rosbagTimestamp', 'latitude'], [[START, 0.0]])
+    (folder / '_slash_front_center_camera_slash_image.txt').write_text(f"0,date,{START // SECOND + 2},0,time,abc\n")
+
+    written = alignBagFolder(str(folder), reference='/trigger*')
+
+    assert sorted(path.split('/')[-1] for path in written) == ['_slash_front_center_camera_slash_image.csv', 'positions.csv']
+    with open(folder / 'aligned' / 'positions.csv') as f:
+        rows = list(csv.DictReader(f))
+    assert [float(row['gps_fix_latitude']) for row in rows] == [40.5, 43.0]
+    with open(folder / 'aligned' / '_slash_front_center_camera_slash_image.csv') as f:
+        frame, = csv.DictReader(f)
+    assert frame['md5'] == 'abc' and float(frame['gps_fix_latitude']) == 42.0
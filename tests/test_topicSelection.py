@@ -0,0 +1,24 @@
+import types
+
+from topicSelection import TopicSelection, parseTime
+
+BAG = types.SimpleNamespace(get_start_time=lambda: 1571431170.25)
+
+
+def test_topics_match_includes_and_not_excludes():
+    selection = TopicSelection(include=['/gps/*', '/encoder*'], exclude=['/gps/raw'])
+    assert selection.selectTopics({'/gps/fix', '/gps/raw', '/encoder_left', '/velodyne_points'}) == {'/gps/fix', '/encoder_left'}
+    assert TopicSelection().selectTopics({'/a', '/b'}) == {'/a', '/b'}
+
+
+def test_relative_times_resolve_against_the_bag_start():
+    selection = TopicSelection(start=parseTime('+60'), end=parseTime('1571431300.5'))
+    assert selection.window(BAG) == (1571431230250000000, 1571431300500000000)
+    assert TopicSelection(end=parseTime('+1')).window(BAG) == (None, 1571431171250000000)
+
+
+def test_window_keys_keep_zero_and_open_ends_apart():
+    assert TopicSelection().key(BAG) == ''
+    assert TopicSelection(start=(0, False)).key(BAG) == '@0-'
+    assert TopicSelection(end=(0, False)).key(BAG) == '@-0'
+    assert TopicSelection(start=(0, False), end=(5, False)).key(BAG) == '@0-5'
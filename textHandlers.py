@@ -0,0 +1,152 @@
+'''
+Per-topic text/CSV writers used by the bag_to_csv scripts.
+
+Each class is a bagDemux.TopicHandler: it opens its output file up front, writes one line
+per message as the single pass over the bag reaches it, and closes the file at the end.
+Given the offset of a checkpoint (see checkpoint.py), the file is reopened and cut back to
+that offset instead of being started over; sync() returns the offset to save.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import csv
+from bagDemux import TopicHandler
+from checkpoint import openOutput
+from rowExtractor import getRowExtractor
+from scanShard import ScanShardWriter
+from scanArrays import packScanArray
+from pointClouds import cloudPoints, fieldLayout
+from velodyneScans import VelodyneScanHandler
+
+
+class LaserScanTextHandler(TopicHandler):
+    """
+    /sick_lms_5xx/scan -> one line of header, scan geometry, ranges and intensities.
+
+    encoding 'text' writes ranges and intensities as decimals joined by separator; a
+    scanArrays encoding ('float32', 'delta') writes the encoding name, then both arrays as
+    hex blobs, read back with scanArrays.unpackScanArray().
+    """
+
+    def __init__(self, filename, separator=',', offset=None, encoding='text'):
+        self.file = openOutput(filename, offset)
+        self.separator = separator
+        self.encoding = encoding
+
+    def handle(self, topic, msg, t):
+        if self.encoding == 'text':
+            arrays = f"{self.separator.join(map(str, msg.ranges))},{self.separator.join(map(str, msg.intensities))}"
+        else:
+            arrays = f"{self.encoding},{packScanArray(msg.ranges, self.encoding).hex()},{packScanArray(msg.intensities, self.encoding).hex()}"
+        self.file.write(f"{msg.header.seq},{msg.header.stamp.secs},{msg.header.stamp.nsecs},{msg.angle_min},{msg.angle_max},{msg.angle_increment},{msg.time_increment},{msg.scan_time},{msg.range_min},{msg.range_max},{arrays}\n")
+
+    def sync(self):
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class PointCloudTextHandler(TopicHandler):
+    """
+    /velodyne_points -> points in binary shards in folder (structured records, see
+    pointClouds), a header/geometry line per cloud ending with the md5 of its points, and
+    the field layout (name:offset:datatype:count,...) in info_filename.
+    offset is the [cloud file, info file] pair returned by sync(); reduction: an optional
+    cloudReduction.CloudReduction applied before the points are stored; shard_name: name of
+    the shards and their index (see scanShard).
+    """
+
+    raw_views = True
+
+    def __init__(self, filename, info_filename, folder, offset=None, resume_count=None, reduction=None, shard_name='clouds'):
+        offset = offset or (None, None)
+        self.reduction = reduction
+        self.file = openOutput(filename, offset[0])
+        self.info_file = openOutput(info_filename, offset[1])
+        self.shards = ScanShardWriter(folder, name=shard_name, resume_count=resume_count)
+
+    def handle(self, topic, msg, t):
+        points = cloudPoints(msg)
+        if self.reduction is not None:
+            points = self.reduction(points)
+        md5_cloud, shard, shard_offset = self.shards.append(points, msg.header.stamp.secs, msg.header.stamp.nsecs)
+        self.info_file.write(fieldLayout(msg.fields) + '\n')
+        self.file.write(f"{msg.header.seq},{msg.header.stamp.secs},{msg.header.stamp.nsecs},{msg.height},{msg.width},{msg.is_bigendian},{msg.point_step},{msg.row_step},{msg.is_dense},{md5_cloud}\n")
+
+    def sync(self):
+        self.shards.sync()
+        self.file.flush()
+        self.info_file.flush()
+        return [self.file.tell(), self.info_file.tell()]
+
+    def close(self):
+        self.shards.close()
+        self.file.close()
+        self.info_file.close()
+
+
+class VelodyneScanTextHandler(VelodyneScanHandler):
+    """
+    /velodyne_packets scans, decoded on a process pool (see velodyneScans) -> binary shards
+    in folder (see scanShard), plus one count,secs,nsecs,md5 line per scan in filename.
+    """
+
+    def __init__(self, filename, folder, offset=None, resume_count=None, workers=None, reduction=None, shard_name='scans'):
+        super().__init__(workers, reduction=reduction)
+        self.file = openOutput(filename, offset)
+        self.shards = ScanShardWriter(folder, name=shard_name, resume_count=resume_count)
+
+    def store(self, points, stamp):
+        count = self.shards.count
+        md5_scan, shard, offset = self.shards.append(points, stamp.secs, stamp.nsecs)
+        self.file.write(f"{count},{stamp.secs},{stamp.nsecs},{md5_scan}\n")
+
+    def sync(self):
+        self.drain()
+        self.shards.sync()
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.shards.close()
+            self.file.close()
+
+
+class GenericCsvHandler(TopicHandler):
+    """
+    Any other topic -> CSV with a rosbagTimestamp column (ns) followed by one column per
+    flattened message field (see rowExtractor).
+    """
+
+    def __init__(self, filename, offset=None):
+        self.csvfile = openOutput(filename, offset, 'w+')
+        self.filewriter = csv.writer(self.csvfile, delimiter=',')
+        self.extractor = None
+        # a resumed file already has its header line
+        self.write_header = not offset
+
+    def handle(self, topic, msg, t):
+        if self.extractor is None:
+            self.extractor = getRowExtractor(msg)
+            self.binary_columns = [i + 1 for i, col in enumerate(self.extractor.columns) if col[1] == 'VARBINARY(MAX)']
+            if self.write_header:
+                self.filewriter.writerow(["rosbagTimestamp"] + self.extractor.column_names)
+        row = (t.to_nsec(),) + self.extractor(msg)
+        if self.binary_columns:
+            # byte arrays are written as hex instead of their Python repr
+            row = list(row)
+            for i in self.binary_columns:
+                row[i] = row[i].hex()
+        self.filewriter.writerow(row)
+
+    def sync(self):
+        self.csvfile.flush()
+        return self.csvfile.tell()
+
+    def close(self):
+        self.csvfile.close()
@@ -0,0 +1,311 @@
+'''
+Time alignment of the position topics (GPS, wheel encoders, time trigger) of a bag.
+
+The scripts store every topic on its own (a CSV or Parquet file per topic, see
+bag_to_csv_2024_py3.py), each on its own clock. Here the topics of a bag's output folder
+are loaded as NumPy arrays, keyed by int64 nanosecond stamps (header stamp secs/nsecs,
+or rosbagTimestamp for messages without a header), and resampled together onto one
+reference timeline with np.searchsorted: at a fixed rate over the time all topics cover,
+or at the stamps of a trigger topic. Every topic column is linearly interpolated between
+its two neighbouring samples (or taken from the nearest one), and left empty where the
+nearest sample is more than max_gap seconds away. Camera frames (their index files) and
+velodyne scans (velodyne_pointcloud/scans.idx) get the same pose columns at their own stamps.
+
+    python3 timeAlignment.py mapping_van_2019-10-18-20-39-30_12 --rate 20
+    python3 timeAlignment.py mapping_van_2019-10-18-20-39-30_12 --reference '/trigger*' --method nearest
+
+writes, in <folder>/aligned/:
+
+    positions.csv           stamp, then <topic>_<column> and <topic>_dt_ns per topic
+    <camera topic>.csv      stamp, md5 of the frame, pose columns
+    velodyne_scans.csv      stamp, md5 of the scan, pose columns
+
+<topic>_dt_ns is the reference stamp minus the stamp of the topic's nearest sample.
+
+The outputs of a run over a time window carry the window in their names (see
+topicSelection.key); --window @<start>-<end> aligns those instead of the full run's, into
+aligned@<start>-<end>/.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import argparse
+import csv
+import fnmatch
+import os
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pacsv = None
+    pq = None
+
+DEFAULT_TOPICS = ['/gps*', '/encoder*', '/trigger*']
+DEFAULT_MAX_GAP_SECONDS = 1.0
+
+# columns describing a message rather than what it measures
+STAMP_COLUMNS = {'rosbagTimestamp', 'header_seq', 'header_stamp_secs', 'header_stamp_nsecs', 'header_frame_id'}
+
+
+class TopicSeries:
+    """Samples of one topic: sorted int64 ns stamps and one float64 array per numeric column."""
+
+    def __init__(self, topic, stamps, values):
+        order = np.argsort(stamps, kind='stable')
+        self.topic = topic
+        self.prefix = topic.strip('/').replace('/', '_')
+        self.stamps = stamps[order]
+        self.values = {name: column[order] for name, column in values.items()}
+
+    def __len__(self):
+        return len(self.stamps)
+
+    def at(self, targets, method='linear', max_gap=None):
+        """{<prefix>_<column>: values at targets, <prefix>_dt_ns: targets - nearest stamp}."""
+        nearest, dt = nearestIndices(self.stamps, targets)
+        if method == 'nearest':
+            columns = {f"{self.prefix}_{name}": column[nearest] for name, column in self.values.items()}
+        else:
+            left, right, weight = bracket(self.stamps, targets)
+            columns = {f"{self.prefix}_{name}": column[left] + weight * (column[right] - column[left])
+                       for name, column in self.values.items()}
+        if max_gap is not None:
+            far = np.abs(dt) > max_gap
+            if far.any():
+                for column in columns.values():
+                    column[far] = np.nan
+        columns[f"{self.prefix}_dt_ns"] = dt
+        return columns
+
+
+def nearestIndices(stamps, targets):
+    """Index of the sample nearest to each target, and target - its stamp (int64 ns)."""
+    right = np.clip(np.searchsorted(stamps, targets), 1, len(stamps) - 1) if len(stamps) > 1 else np.zeros(len(targets), dtype=np.intp)
+    left = np.maximum(right - 1, 0)
+    nearest = np.where(np.abs(targets - stamps[left]) <= np.abs(stamps[right] - targets), left, right)
+    return nearest, targets - stamps[nearest]
+
+
+def bracket(stamps, targets):
+    """(left, right, weight) of linear interpolation between the samples around each target."""
+    right = np.clip(np.searchsorted(stamps, targets, side='right'), 0, len(stamps) - 1)
+    left = np.maximum(right - 1, 0)
+    span = (stamps[right] - stamps[left]).astype(np.float64)
+    # differences are taken in int64 before going to float: absolute ns stamps do not fit a double
+    offset = (targets - stamps[left]).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = np.where(span > 0, offset / span, 0.0)
+    # outside the samples: hold the first/last value (max_gap decides whether it is kept)
+    return left, right, np.clip(weight, 0.0, 1.0)
+
+
+def readColumns(path):
+    """{column: numpy array} of a topic's CSV or Parquet file."""
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise ImportError("pyarrow is required to read Parquet files: pip install pyarrow")
+        table = pq.read_table(path)
+    elif pacsv is not None:
+        # typed, multithreaded parse; comma-separated arrays stay text
+        table = pacsv.read_csv(path)
+    else:
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            names = next(reader, [])
+            rows = list(reader)
+        return {name: np.array(values, dtype=object) for name, values in zip(names, zip(*rows) if rows else [()] * len(names))}
+    return {name: table.column(name).to_numpy(zero_copy_only=False) for name in table.column_names}
+
+
+def numericColumns(columns):
+    """float64 arrays of the columns that hold numbers; comma-separated arrays become <name>_0, <name>_1, ..."""
+    numeric = {}
+    for name, column in columns.items():
+        if name in STAMP_COLUMNS or not len(column):
+            continue
+        if column.dtype.kind in 'biuf':
+            numeric[name] = column.astype(np.float64)
+            continue
+        try:
+            numeric[name] = column.astype(np.float64)
+            continue
+        except (TypeError, ValueError):
+            pass
+        try:
+            rows = np.array([value.split(',') for value in column], dtype=np.float64)
+        except (AttributeError, TypeError, ValueError):
+            # text, or arrays whose length changes from message to message
+            continue
+        if rows.ndim == 2:
+            for i in range(rows.shape[1]):
+                numeric[f"{name}_{i}"] = rows[:, i]
+    return numeric
+
+
+def messageStamps(columns):
+    """int64 ns stamps of a topic: its header stamps, or rosbagTimestamp where there is no header."""
+    if 'header_stamp_secs' in columns and 'header_stamp_nsecs' in columns:
+        stamps = columns['header_stamp_secs'].astype(np.int64) * 1000000000 + columns['header_stamp_nsecs'].astype(np.int64)
+        if stamps.any():
+            return stamps
+    return columns['rosbagTimestamp'].astype(np.int64)
+
+
+def runWindow(base):
+    """(name, window) of an output file name without extension: '_slash_gps@1-2' -> ('_slash_gps', '@1-2')."""
+    name, at, window = base.partition('@')
+    return name, at + window
+
+
+def topicFiles(folder, patterns, window=''):
+    """{topic: path} of the CSV/Parquet topic files of a bag's output folder, of the run over window, that match patterns."""
+    files = {}
+    for name in sorted(os.listdir(folder)):
+        base, extension = os.path.splitext(name)
+        if extension not in ('.csv', '.parquet'):
+            continue
+        base, file_window = runWindow(base)
+        if file_window != window:
+            continue
+        topic = base.replace('_slash_', '/')
+        if any(fnmatch.fnmatchcase(topic, pattern) for pattern in patterns):
+            files[topic] = os.path.join(folder, name)
+    return files
+
+
+def loadTopic(topic, path):
+    """TopicSeries of a topic file, or None when it has no samples."""
+    columns = readColumns(path)
+    if not columns or not len(next(iter(columns.values()))):
+        return None
+    return TopicSeries(topic, messageStamps(columns), numericColumns(columns))
+
+
+def rateStamps(series, rate):
+    """Stamps at rate Hz over the time every topic covers."""
+    start = max(topic.stamps[0] for topic in series)
+    end = min(topic.stamps[-1] for topic in series)
+    return np.arange(start, end + 1, int(round(1e9 / rate)), dtype=np.int64)
+
+
+def alignTopics(series, stamps, method='linear', max_gap=None):
+    """{column: array} of the topics resampled at stamps (int64 ns), starting with the stamps."""
+    columns = {'stamp': stamps}
+    for topic in series:
+        columns.update(topic.at(stamps, method, max_gap))
+    return columns
+
+
+def cameraFrames(path):
+    """(stamps, md5s) of a camera index file written by parseCamera (seq,date,secs,nsecs,time,md5)."""
+    secs, nsecs, md5s = [], [], []
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split(',')
+            if len(fields) < 6:
+                continue
+            secs.append(fields[-4])
+            nsecs.append(fields[-3])
+            md5s.append(fields[-1])
+    stamps = np.array(secs, dtype=np.int64) * 1000000000 + np.array(nsecs, dtype=np.int64)
+    return stamps, np.array(md5s, dtype=object)
+
+
+def velodyneScans(path):
+    """(stamps, md5s) of a scan shard index (see scanShard)."""
+    with open(path) as f:
+        f.readline()
+        entries = [line.split(',') for line in f if line.strip()]
+    stamps = np.array([entry[1] for entry in entries], dtype=np.int64) * 1000000000 + np.array([entry[2] for entry in entries], dtype=np.int64)
+    return stamps, np.array([entry[3] for entry in entries], dtype=object)
+
+
+def writeTable(path, columns):
+    """Write {column: array} in one go, as Parquet or CSV after path's extension."""
+    if path.endswith('.parquet'):
+        if pa is None:
+            raise ImportError("pyarrow is required for Parquet output: pip install pyarrow")
+        pq.write_table(pa.table({name: pa.array(column) for name, column in columns.items()}), path, compression='zstd')
+        return
+    partial = path + '.partial'
+    with open(partial, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(list(columns))
+        # NaN (no sample within max_gap) is written as an empty field
+        writer.writerows(zip(*(np.where(np.isnan(column), None, column).tolist() if column.dtype.kind == 'f' else column.tolist()
+                               for column in columns.values())))
+    os.replace(partial, path)
+
+
+def alignBagFolder(folder, topics=DEFAULT_TOPICS, rate=None, reference=None, method='linear',
+                   max_gap=DEFAULT_MAX_GAP_SECONDS, output_format='csv', window=''):
+    """Align the topics of one bag's output folder into <folder>/aligned<window>; returns the files written."""
+    series = []
+    for topic, path in topicFiles(folder, topics, window).items():
+        loaded = loadTopic(topic, path)
+        if loaded is not None:
+            series.append(loaded)
+    if not series:
+        raise ValueError(f"No samples of {topics} in {folder}")
+
+    if reference is not None:
+        trigger = [topic for topic in series if fnmatch.fnmatchcase(topic.topic, reference)]
+        if not trigger:
+            raise ValueError(f"No reference topic {reference} in {folder}")
+        stamps = trigger[0].stamps
+    else:
+        stamps = rateStamps(series, rate or 10.0)
+
+    max_gap_ns = None if max_gap is None else int(max_gap * 1e9)
+    output = os.path.join(folder, 'aligned' + window)
+    os.makedirs(output, exist_ok=True)
+    written = []
+
+    def write(name, columns):
+        path = os.path.join(output, f"{name}.{output_format}")
+        writeTable(path, columns)
+        written.append(path)
+
+    write('positions', alignTopics(series, stamps, method, max_gap_ns))
+
+    # poses of camera frames and velodyne scans, at their own stamps
+    for name in sorted(os.listdir(folder)):
+        base, file_window = runWindow(name[:-len('.txt')])
+        if name.endswith('.txt') and '_camera_' in base and file_window == window:
+            frame_stamps, md5s = cameraFrames(os.path.join(folder, name))
+            if len(frame_stamps):
+                columns = alignTopics(series, frame_stamps, method, max_gap_ns)
+                write(base, {'stamp': frame_stamps, 'md5': md5s, **{k: v for k, v in columns.items() if k != 'stamp'}})
+    scan_index = os.path.join(folder, 'velodyne_pointcloud', 'scans' + window + '.idx')
+    if os.path.exists(scan_index):
+        scan_stamps, md5s = velodyneScans(scan_index)
+        if len(scan_stamps):
+            columns = alignTopics(series, scan_stamps, method, max_gap_ns)
+            write('velodyne_scans', {'stamp': scan_stamps, 'md5': md5s, **{k: v for k, v in columns.items() if k != 'stamp'}})
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Align the position topics of bag output folders on one timeline.")
+    parser.add_argument('folders', nargs='+', help="output folders of bag_to_csv_2024_py3.py (the bag name without .bag)")
+    parser.add_argument('--topics', nargs='+', default=DEFAULT_TOPICS, help="glob patterns of the topics to align")
+    timeline = parser.add_mutually_exclusive_group()
+    timeline.add_argument('--rate', type=float, help="reference rate in Hz (default: 10)")
+    timeline.add_argument('--reference', help="topic (glob pattern) whose stamps are the reference, e.g. a trigger")
+    parser.add_argument('--method', choices=['linear', 'nearest'], default='linear')
+    parser.add_argument('--max-gap', type=float, default=DEFAULT_MAX_GAP_SECONDS, help="seconds to the nearest sample beyond which a value is left empty")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--window', default='', metavar='@START-END', help="align the outputs of the run over this time window, as named in the file names")
+    args = parser.parse_args()
+
+    for folder in args.folders:
+        for path in alignBagFolder(folder, args.topics, args.rate, args.reference, args.method, args.max_gap, args.format, args.window):
+            print(f"Wrote {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+'''
+Topic allowlist/denylist and time window of an ingestion run.
+
+Topics are matched with glob patterns against the bag index, and the time window is handed
+to rosbag's read_messages(topics=..., start_time=..., end_time=...), so chunks that hold
+only unselected topics, or only messages outside the window, are never decompressed:
+
+    python3 feeding_bag_files_to_db.py drive.bag --topics '/gps/*' '/encoder*' '/trigger*' --start +60 --end +120
+
+--start/--end take unix time in seconds (1571431170.5) or, with a leading '+', seconds
+from the start of each bag (+60).
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import fnmatch
+from decimal import Decimal
+
+
+def parseTime(text):
+    """'1571431170.5' -> (ns, False); '+60' -> (ns from bag start, True); None -> None."""
+    if text is None:
+        return None
+    relative = text.startswith('+')
+    return int(Decimal(text.lstrip('+')) * 1000000000), relative
+
+
+class TopicSelection:
+    """
+    include/exclude: glob patterns; a topic is selected if it matches an include pattern
+    (or there are none) and no exclude pattern.
+    start/end: parseTime() values of the time window, either end may be None.
+    """
+
+    def __init__(self, include=None, exclude=None, start=None, end=None):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.start = start
+        self.end = end
+
+    def matches(self, topic):
+        if self.include and not any(fnmatch.fnmatchcase(topic, pattern) for pattern in self.include):
+            return False
+        return not any(fnmatch.fnmatchcase(topic, pattern) for pattern in self.exclude)
+
+    def selectTopics(self, topics):
+        return {topic for topic in topics if self.matches(topic)}
+
+    def window(self, bag):
+        """(start_ns, end_ns) of the window in bag, relative times resolved; None for open ends."""
+        return self._resolve(self.start, bag), self._resolve(self.end, bag)
+
+    def _resolve(self, time, bag):
+        if time is None:
+            return None
+        stamp, relative = time
+        if relative:
+            stamp += int(Decimal(repr(bag.get_start_time())) * 1000000000)
+        return stamp
+
+    def key(self, bag):
+        """
+        Suffix naming the window ('' without one) in checkpoint keys and in the names of the
+        output files, shards and packs, so windows and full runs neither resume nor overwrite
+        each other.
+        """
+        start, end = self.window(bag)
+        if start is None and end is None:
+            return ''
+        return f"@{'' if start is None else start}-{'' if end is None else end}"
+
+
+def addSelectionArguments(parser):
+    """Add --topics, --exclude-topics, --start and --end to an argparse parser."""
+    parser.add_argument('--topics', nargs='+', metavar='GLOB', help="only ingest topics matching these glob patterns")
+    parser.add_argument('--exclude-topics', nargs='+', metavar='GLOB', help="skip topics matching these glob patterns")
+    parser.add_argument('--start', metavar='TIME', help="first message time: unix seconds, or +seconds from the bag start")
+    parser.add_argument('--end', metavar='TIME', help="last message time: unix seconds, or +seconds from the bag start")
+
+
+def selectionFromArgs(args):
+    return TopicSelection(args.topics, args.exclude_topics, parseTime(args.start), parseTime(args.end))
+
+
+def selectionKey(args):
+    """The selection arguments as text ('' without any), to tell runs over different selections apart."""
+    parts = []
+    if args.topics:
+        parts.append('--topics ' + ' '.join(args.topics))
+    if args.exclude_topics:
+        parts.append('--exclude-topics ' + ' '.join(args.exclude_topics))
+    if args.start:
+        parts.append('--start ' + args.start)
+    if args.end:
+        parts.append('--end ' + args.end)
+    return ' '.join(parts)
@@ -0,0 +1,118 @@
+'''
+/velodyne_packets decoded in the single pass over the bag, on a pool of processes.
+
+vd.read_bag() used to open and read the whole bag a second time just for this topic. Here
+each velodyne_msgs/VelodyneScan (the packets of one revolution, as cut by the driver) comes
+from the demux pass as a raw view (see rawMessages.py), its serialized bytes are sent to a
+worker process, and velodyne_decoder turns them into points there. Scans are decoded on
+several cores at once and stored in bag order as they complete; at most max_pending scans
+are in flight, so memory stays bounded.
+
+Every script decodes with the same configuration (velodyneConfig()), and decodeScan()
+returns the points whatever the velodyne_decoder version (2.x returns points, 3.x
+(stamp, points)).
+
+The workers start from a forkserver and import the main module of the script, so a script
+using VelodyneScanHandler runs its bags under `if __name__ == '__main__':`.
+
+Written by Max Duverneuil, IVSG (Penn State University, github: mpd5945)
+'''
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from bagDemux import TopicHandler
+from rawMessages import VelodyneScanView
+
+try:
+    import velodyne_decoder as vd
+except ImportError:
+    vd = None
+
+
+def velodyneConfig():
+    """Decoder configuration of every script; the sensor model is detected from the packets."""
+    return vd.Config()
+
+
+class ScanMessage:
+    """VelodyneScan with bytes packets, as velodyne_decoder's decode_message() reads it."""
+
+    def __init__(self, view):
+        self.header = view.header
+        self.packets = [PacketMessage(packet.stamp, bytes(packet.data)) for packet in view.packets]
+
+
+class PacketMessage:
+    def __init__(self, stamp, data):
+        self.stamp = stamp
+        self.data = data
+
+
+# decoder of this worker process, created by its first scan
+_decoder = None
+
+
+def decodeScan(serialized, reduction=None):
+    """Points (N x 5 or more float array) of one serialized VelodyneScan, reduced if asked (see cloudReduction); runs in the pool."""
+    global _decoder
+    if _decoder is None:
+        _decoder = vd.ScanDecoder(velodyneConfig())
+    points = _decoder.decode_message(ScanMessage(VelodyneScanView(serialized)))
+    if isinstance(points, tuple):
+        points = points[1]
+    if reduction is not None:
+        points = reduction(points)
+    return points
+
+
+class VelodyneScanHandler(TopicHandler):
+    """
+    Base of the /velodyne_packets handlers: handle() sends the scan to the decoding pool,
+    store(points, stamp) is called with the decoded scans, in bag order.
+
+    workers: decoding processes (default: one per CPU); max_pending: scans in flight;
+    reduction: cloudReduction.CloudReduction applied to each scan in the pool, before store().
+    """
+
+    raw_views = True
+
+    def __init__(self, workers=None, max_pending=None, reduction=None):
+        if vd is None:
+            raise ImportError("velodyne_decoder is required for /velodyne_packets: pip install velodyne-decoder")
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 4 * self.workers
+        self.reduction = reduction
+        self.executor = None
+        self.pending = deque()
+
+    def handle(self, topic, msg, t):
+        if self.executor is None:
+            # forkserver: the calling process runs threads (bag reader, camera pool), which fork would copy mid-operation
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('forkserver'))
+        self.pending.append((msg.header.stamp, self.executor.submit(decodeScan, msg.serialized, self.reduction)))
+
+        # store whatever is decoded at the head of the queue; block only when the queue is full
+        while self.pending and (self.pending[0][1].done() or len(self.pending) > self.max_pending):
+            self.storeOldest()
+
+    def storeOldest(self):
+        stamp, future = self.pending.popleft()
+        self.store(future.result(), stamp)
+
+    def store(self, points, stamp):
+        raise NotImplementedError
+
+    def drain(self):
+        """Wait for every scan in flight and store it, e.g. before a checkpoint."""
+        while self.pending:
+            self.storeOldest()
+
+    def close(self):
+        try:
+            self.drain()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None